@@ -1,14 +1,25 @@
-from flask import Flask, request, jsonify
-from deepface import DeepFace
-import cv2
+from flask import Flask, g, request, jsonify
 import os
-import numpy as np
 import logging
-import pickle
 from functools import wraps
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait as wait_futures
 import time
+import re
+import threading
 from dotenv import load_dotenv
-import tempfile
+from face_index import create_index, load_index
+from face_pipeline import detect_faces, embed_faces, face_region, warmup
+from image_io import decode_grayscale_preview, decode_image, encoded_extension, jpeg_size, split_length_prefixed
+from batcher import MicroBatcher
+from inference_pool import DeadlineExceeded, InferencePool, Overloaded
+from inference_processes import InferenceError, InferenceProcessPool
+from embedding_store import EmbeddingStore
+from result_cache import PerceptualCache, frame_signature
+from metrics import Metrics
+from event_store import EventStore, parse_time
+from region_hints import crop_boxes, detect_in_crops, parse_regions
 
 # Load environment variables
 load_dotenv()
@@ -21,71 +32,241 @@ app = Flask(__name__)
 
 # Path to custom database of known faces
 DATABASE_PATH = "./known_faces"
-EMBEDDINGS_PATH = "./known_faces_embeddings.pkl"
-
-# Pre-compute embeddings for known faces
+EMBEDDINGS_PATH = "./known_faces_embeddings.npy"
+MANIFEST_PATH = "./known_faces_manifest.json"
+INDEX_PATH = "./known_faces_index.npz"
+
+# Load and warm the detection/recognition models during startup instead of on the first request
+WARMUP_MODELS = os.getenv('WARMUP_MODELS', '1') != '0'
+
+# Matching configuration
+MATCH_METRIC = os.getenv('MATCH_METRIC', 'euclidean')
+MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD', 0.6))
+MATCH_TOP_K = int(os.getenv('MATCH_TOP_K', 5))
+
+# Processes used to embed new or changed known faces (default: one per CPU)
+ENROLL_WORKERS = int(os.getenv('ENROLL_WORKERS', 0)) or None
+
+# Known-face index configuration ('exact' scans everything, 'ivf' is approximate)
+INDEX_BACKEND = os.getenv('INDEX_BACKEND', 'exact')
+IVF_NLIST = int(os.getenv('IVF_NLIST', 0)) or None
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 8))
+
+# Element type of the in-memory gallery: 'float32', 'float16' (half the memory)
+# or 'int8' (a quarter, scaled per face)
+GALLERY_STORAGE = os.getenv('GALLERY_STORAGE', 'float32')
+
+# Uploads larger than this (longest side, pixels) are downscaled while decoding; 0 disables
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', 0))
+
+# Inference deadline and load shedding
+REQUEST_DEADLINE_S = float(os.getenv('REQUEST_DEADLINE_S', 10))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 2))
+INFERENCE_QUEUE = int(os.getenv('INFERENCE_QUEUE', 8))
+MAX_QUEUE_WAIT_S = float(os.getenv('MAX_QUEUE_WAIT_S', 5))
+
+# Model processes shared by every server process (0 runs the models inside each
+# one). Frames reach them through shared-memory slots of INFERENCE_SLOT_MB.
+INFERENCE_PROCESSES = int(os.getenv('INFERENCE_PROCESSES', 0))
+INFERENCE_SLOT_MB = float(os.getenv('INFERENCE_SLOT_MB', 8))
+
+# Enrolled identity names: used as file names in known_faces/
+IDENTITY_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+# Upper bound on images accepted by one /process_batch request
+MAX_BATCH_IMAGES = int(os.getenv('MAX_BATCH_IMAGES', 32))
+
+# Micro-batching of face crops from concurrent /process_image requests
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 16))
+EMBED_BATCH_WAIT_MS = float(os.getenv('EMBED_BATCH_WAIT_MS', 15))
+
+# Verdict cache for near-duplicate /process_image frames; RESULT_CACHE_SIZE=0 disables it
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 256))
+RESULT_CACHE_TTL_S = float(os.getenv('RESULT_CACHE_TTL_S', 30))
+RESULT_CACHE_MAX_DISTANCE = int(os.getenv('RESULT_CACHE_MAX_DISTANCE', 12))
+
+# Region hints (?regions=x,y,w,h;...) limit detection to padded crops of those regions
+ROI_PADDING = float(os.getenv('ROI_PADDING', 0.25))
+ROI_MIN_SIDE = int(os.getenv('ROI_MIN_SIDE', 160))
+ROI_MAX_COVERAGE = float(os.getenv('ROI_MAX_COVERAGE', 0.6))
+
+# Detection events are stored in day-partitioned SQLite files; an empty EVENT_STORE_DIR disables them
+EVENT_STORE_DIR = os.getenv('EVENT_STORE_DIR', 'events')
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', 30))
+MAX_EVENTS_PAGE = 1000
+
+# Load the embedding store and embed only new or changed images in known_faces/
 def load_or_compute_embeddings():
-    if os.path.exists(EMBEDDINGS_PATH):
-        try:
-            with open(EMBEDDINGS_PATH, 'rb') as f:
-                logger.info("Loading pre-computed embeddings")
-                embeddings = pickle.load(f)
-                logger.info(f"Loaded {len(embeddings)} embeddings")
-                return embeddings
-        except Exception as e:
-            logger.warning(f"Error loading embeddings: {str(e)}. Recomputing embeddings.")
-    
-    logger.info("Computing embeddings for known faces...")
-    embeddings = {}
-    
+    store = EmbeddingStore(EMBEDDINGS_PATH, MANIFEST_PATH)
     if not os.path.exists(DATABASE_PATH):
         logger.warning(f"Directory {DATABASE_PATH} does not exist. Creating it.")
-        os.makedirs(DATABASE_PATH)
-        with open(EMBEDDINGS_PATH, 'wb') as f:
-            pickle.dump(embeddings, f)
-        return embeddings
-    
+        os.makedirs(DATABASE_PATH, exist_ok=True)
+
+    # Workers started without --preload sync at the same time; one of them does the work
+    with store.locked():
+        store.load()
+        try:
+            store.sync(DATABASE_PATH, workers=ENROLL_WORKERS, in_process=inference_processes is None)
+        except Exception as e:
+            logger.error(f"Error syncing embeddings with {DATABASE_PATH}: {str(e)}")
+
+    if not len(store):
+        logger.warning(f"No valid images found in {DATABASE_PATH}. Using empty embeddings.")
+    return store
+
+# Load the saved known-face index, rebuilding it when it no longer matches the embeddings
+def load_or_build_index(store):
+    if os.path.exists(INDEX_PATH):
+        try:
+            index = load_index(INDEX_PATH)
+            if (index.kind == INDEX_BACKEND and index.metric == MATCH_METRIC and index.storage == GALLERY_STORAGE
+                    and index.source == store.fingerprint):
+                if INDEX_BACKEND == 'ivf':
+                    index.nprobe = IVF_NPROBE
+                return index
+            logger.info("Saved index does not match current embeddings or settings. Rebuilding index.")
+        except Exception as e:
+            logger.warning(f"Error loading index: {str(e)}. Rebuilding index.")
+
+    params = {'nlist': IVF_NLIST, 'nprobe': IVF_NPROBE} if INDEX_BACKEND == 'ivf' else {}
+    index = create_index(INDEX_BACKEND, store.labels, store.vectors, metric=MATCH_METRIC, storage=GALLERY_STORAGE, **params)
+    index.source = store.fingerprint
     try:
-        known_faces = [os.path.join(DATABASE_PATH, f) for f in os.listdir(DATABASE_PATH) if f.endswith(('.jpg', '.png'))]
-        logger.info(f"Found {len(known_faces)} images in {DATABASE_PATH}")
+        index.save(INDEX_PATH)
     except Exception as e:
-        logger.error(f"Error accessing {DATABASE_PATH}: {str(e)}")
-        with open(EMBEDDINGS_PATH, 'wb') as f:
-            pickle.dump(embeddings, f)
-        return embeddings
-    
-    if not known_faces:
-        logger.warning(f"No valid images found in {DATABASE_PATH}. Using empty embeddings.")
-    else:
-        for face_path in known_faces:
-            try:
-                embedding = DeepFace.represent(img_path=face_path, model_name='VGG-Face', detector_backend='mtcnn', enforce_detection=True)[0]['embedding']
-                embeddings[face_path] = embedding
-                logger.info(f"Computed embedding for {face_path}")
-            except Exception as e:
-                logger.warning(f"Skipping {face_path}: {str(e)}")
-    
-    with open(EMBEDDINGS_PATH, 'wb') as f:
-        pickle.dump(embeddings, f)
-    logger.info(f"Saved {len(embeddings)} embeddings to {EMBEDDINGS_PATH}")
-    return embeddings
-
-# Load embeddings at startup
-known_embeddings = load_or_compute_embeddings()
-
-# Timeout decorator to prevent hanging
-def timeout(seconds):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            if time.time() - start_time > seconds:
-                logger.error(f"Function {func.__name__} timed out after {seconds} seconds")
-                raise TimeoutError(f"Operation timed out after {seconds} seconds")
-            return result
-        return wrapper
-    return decorator
+        logger.warning(f"Error saving index: {str(e)}")
+    return index
+
+# Populated by startup(); requests are refused with 503 until it has finished
+known_embeddings = None
+known_index = None
+startup_phases = {}
+startup_lock = threading.Lock()
+ready = threading.Event()
+
+@contextmanager
+def startup_phase(name):
+    start = time.time()
+    yield
+    startup_phases[name] = round(time.time() - start, 3)
+    logger.info(f"Startup phase '{name}' took {startup_phases[name]:.2f}s")
+
+# Explicit startup phase: load the gallery, build the index and warm the models
+# before the server reports ready. Under gunicorn --preload this runs once in
+# the master, and forked workers share the loaded weights and gallery pages.
+def startup():
+    global known_embeddings, known_index
+    with startup_lock:
+        if ready.is_set():
+            return
+        start = time.time()
+        with startup_phase('embeddings'):
+            known_embeddings = load_or_compute_embeddings()
+        with startup_phase('index'), known_embeddings.locked():
+            known_index = load_or_build_index(known_embeddings)
+        logger.info(f"Index ready with {len(known_index)} known faces ({INDEX_BACKEND}, {MATCH_METRIC} metric, "
+                    f"{GALLERY_STORAGE} storage, {known_index.nbytes / 2**20:.1f} MiB)")
+        if inference_processes is not None:
+            # The models load in the inference processes; this process never imports TensorFlow
+            with startup_phase('inference_processes'):
+                inference_processes.start()
+        elif WARMUP_MODELS:
+            with startup_phase('warmup'):
+                warmup()
+        startup_phases['total'] = round(time.time() - start, 3)
+        ready.set()
+        logger.info(f"Startup finished in {startup_phases['total']:.2f}s")
+
+# With INFERENCE_PROCESSES, detection and embedding run in model processes
+inference_processes = InferenceProcessPool(
+    processes=INFERENCE_PROCESSES, slots=INFERENCE_PROCESSES + INFERENCE_QUEUE,
+    slot_bytes=int(INFERENCE_SLOT_MB * 2**20), warm=WARMUP_MODELS) if INFERENCE_PROCESSES > 0 else None
+
+# Otherwise face crops from concurrent requests share one VGG-Face forward pass
+embedding_batcher = MicroBatcher(
+    embed_faces, max_batch_size=EMBED_BATCH_SIZE, max_wait_ms=EMBED_BATCH_WAIT_MS,
+    name='embedding-batcher') if inference_processes is None else None
+
+# and detection runs on a bounded pool that sheds load instead of queueing without limit
+inference_pool = InferencePool(
+    workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE, max_wait_s=MAX_QUEUE_WAIT_S) if inference_processes is None else None
+
+def inference_load():
+    return inference_processes.stats() if inference_processes is not None else inference_pool.stats()
+
+# Per-stage latency histograms and outcome counters, served at /metrics
+metrics = Metrics()
+
+# Frames from a fixed camera that barely changed get the previous verdict back
+result_cache = PerceptualCache(max_entries=RESULT_CACHE_SIZE, ttl_s=RESULT_CACHE_TTL_S, max_distance=RESULT_CACHE_MAX_DISTANCE) if RESULT_CACHE_SIZE > 0 else None
+
+# Every verdict is written to the event store in batches, off the request path
+event_store = EventStore(EVENT_STORE_DIR, retention_days=EVENT_RETENTION_DAYS) if EVENT_STORE_DIR else None
+
+# Signature of a small grayscale preview, or None when caching is off or the image is unreadable
+def frame_hash(image_data):
+    if result_cache is None:
+        return None
+    preview = decode_grayscale_preview(image_data)
+    return None if preview is None else frame_signature(preview)
+
+# Outcome counter label for a verdict returned with status 200
+def verdict_outcome(response):
+    if 'faces' in response:
+        return 'unknown' if response['result'] else 'known'
+    if response.get('message') == 'No human face detected':
+        return 'no_face'
+    return 'error'
+
+def log_response(response):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Flask Response: {response}")
+
+# Count a request's outcome and keep it for the request's detection event
+def count_outcome(outcome, response=None):
+    metrics.inc('outcomes', outcome=outcome)
+    g.outcome = outcome
+    g.verdict = response
+
+# Camera a frame came from, as the client names it (?camera= or X-Camera)
+def request_camera():
+    return request.args.get('camera') or request.headers.get('X-Camera')
+
+# Queue a detection event: the outcome, the identity and distance of the
+# closest face, and the request's latency and stage breakdown
+def record_event(outcome, response, camera, latency_s=None, stages=None):
+    if event_store is None:
+        return
+    response = response or {}
+    faces = response.get('faces') or []
+    matched = [face for face in faces if face.get('distance') is not None]
+    best = min(matched, key=lambda face: face['distance']) if matched else {}
+    event_store.record(camera=camera, verdict=outcome, identity=best.get('identity'), distance=best.get('distance'),
+                       faces=len(faces), cached=bool(response.get('cached')),
+                       latency_ms=round(latency_s * 1000, 3) if latency_s is not None else None, stages=stages)
+
+# Count a verdict, cache it under key for the request's camera and return it as
+# JSON. Only face verdicts are cached: a "no face" verdict must not hide a face
+# that enters an otherwise unchanged scene, and errors are never reused.
+def verdict_response(key, response, outcome=None):
+    outcome = outcome or verdict_outcome(response)
+    count_outcome(outcome, response)
+    if key is not None and outcome in ('known', 'unknown'):
+        result_cache.put(key, response, source=request_camera())
+    log_response(response)
+    return jsonify(response)
+
+def overloaded_response(e):
+    logger.warning(f"Rejecting request: {str(e)}")
+    count_outcome('overloaded')
+    response = jsonify({'result': False, 'error': 'Server overloaded'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def deadline_response(e):
+    logger.error(f"Request deadline exceeded: {str(e)}")
+    count_outcome('deadline')
+    return jsonify({'result': False, 'error': 'Deadline exceeded'}), 504
 
 # API key authentication
 def require_api_key(func):
@@ -98,100 +279,513 @@ def require_api_key(func):
             return jsonify({'error': 'Invalid or missing API key'}), 401
     return decorated_function
 
+# Refuse work until startup() has loaded the gallery and models
+def require_ready(func):
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if not ready.is_set():
+            response = jsonify({'error': 'Server is starting up'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        refresh_gallery()
+        return func(*args, **kwargs)
+    return decorated_function
+
+# Admin key authentication for gallery changes (falls back to the regular API key)
+def require_admin_key(func):
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        admin_key = request.headers.get('X-Admin-Key')
+        expected = os.getenv('ADMIN_API_KEY') or os.getenv('API_KEY', '5gl5TTvpUaX3J9K-muC3pSiTfGHy8S_Vn3ruNk8Vnqw')
+        if admin_key and admin_key == expected:
+            return func(*args, **kwargs)
+        else:
+            return jsonify({'error': 'Invalid or missing admin key'}), 401
+    return decorated_function
+
+# Known faces are stored as known_faces/<identity>.jpg|png
+def identity_of(label):
+    return os.path.splitext(os.path.basename(str(label)))[0]
+
+# Compare one face embedding against a snapshot of the known-face index
+def match_face(embedding, index):
+    match = index.match(embedding, top_k=MATCH_TOP_K)
+    if match is None:
+        logger.info("No known embeddings available. Treating face as unknown.")
+        return {'known': False, 'identity': None, 'distance': None}
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Closest known faces: {match['top_k']}")
+    if match['distance'] < MATCH_THRESHOLD:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Match found with {match['label']} (distance {match['distance']:.4f})")
+        return {'known': True, 'identity': identity_of(match['label']), 'distance': match['distance']}
+    return {'known': False, 'identity': None, 'distance': match['distance']}
+
+# Response for one image given its detected faces and their embeddings
+def faces_response(valid_faces, embeddings):
+    # One reference read: enrollment swaps in a new index without blocking us
+    index = known_index
+    with metrics.timer('matching'):
+        faces = [dict(face_region(face), **match_face(embedding, index)) for face, embedding in zip(valid_faces, embeddings)]
+    result = any(not face['known'] for face in faces)
+    logger.info(f"Result: {'Unknown human' if result else 'Known person'} ({len(faces)} faces)")
+    return {'result': result, 'message': 'Unknown human' if result else 'Known person', 'faces': faces}
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    if not ready.is_set():
+        return jsonify({'status': 'starting', 'phases': startup_phases}), 503
+    return jsonify({'status': 'ready', 'phases': startup_phases, 'gallery_size': len(known_index), 'load': inference_load()})
+
+# Detection crops for region hints given in uploaded-image pixels, or None to
+# search the whole decoded image
+def region_crops(regions, image_data, img):
+    height, width = img.shape[:2]
+    scale = 1.0
+    if MAX_IMAGE_SIDE:
+        size = jpeg_size(image_data)
+        if size is None:
+            return None
+        scale = width / size[0]
+    return crop_boxes(regions, width, height, scale, padding=ROI_PADDING, min_side=ROI_MIN_SIDE, max_coverage=ROI_MAX_COVERAGE)
+
+# Verdict for a decoded frame from the inference processes, which detect and
+# embed in one go; only matching happens here
+def remote_verdict(key, img, boxes, deadline):
+    start = time.perf_counter()
+    try:
+        analysed = inference_processes.run(img, boxes, deadline=deadline)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except DeadlineExceeded as e:
+        return deadline_response(e)
+    except InferenceError as e:
+        if e.stage == 'detection':
+            logger.info(f"Face detection failed: {str(e)}")
+            return verdict_response(None, {'result': False, 'message': 'No human face detected'}, outcome='error')
+        logger.error(f"Inference failed ({e.stage}): {str(e)}")
+        return verdict_response(None, {'result': False, 'message': 'Error processing face'})
+    metrics.observe('detection', analysed['detection_s'])
+    metrics.observe('embedding', analysed['embedding_s'])
+    metrics.observe('handoff', time.perf_counter() - start - analysed['detection_s'] - analysed['embedding_s'])
+    if not analysed['faces']:
+        logger.info("No valid face detected in image")
+        return verdict_response(key, {'result': False, 'message': 'No human face detected'})
+    return verdict_response(key, faces_response(analysed['faces'], analysed['embeddings']))
+
 @app.route('/process_image', methods=['POST'])
 @require_api_key
+@require_ready
 def process_image():
+    metrics.inc('requests', endpoint='process_image')
+    start = time.perf_counter()
+    with metrics.in_flight(), metrics.recording() as stages:
+        response = handle_image()
+    elapsed = time.perf_counter() - start
+    metrics.observe('total', elapsed)
+    record_event(g.get('outcome', 'error'), g.get('verdict'), request_camera(), latency_s=elapsed, stages=stages)
+    return response
+
+def handle_image():
+    deadline = time.monotonic() + REQUEST_DEADLINE_S
     try:
         logger.info("Received image for processing")
-        # Save received image to a temporary file
-        image_data = request.get_data()
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_image_path = temp_file.name
-            temp_file.write(image_data)
-
-        # Load image with OpenCV
-        img = cv2.imread(temp_image_path)
+        # Decode the request body in memory; the array feeds detection and embedding
+        with metrics.timer('read'):
+            image_data = request.get_data()
+        try:
+            regions = parse_regions(request.args.get('regions') or request.headers.get('X-Regions'))
+        except ValueError as e:
+            logger.error(f"Invalid region hints: {str(e)}")
+            count_outcome('error')
+            return jsonify({'result': False, 'error': f'Invalid regions: {str(e)}'}), 400
+        # A verdict from cropped detection is not valid for the whole frame, so hinted requests skip the cache
+        with metrics.timer('hash'):
+            key = frame_hash(image_data) if not regions else None
+        if key is not None:
+            cached = result_cache.get(key, source=request_camera())
+            if cached is not None:
+                logger.info(f"Near-duplicate frame, returning cached verdict: {cached.get('message')}")
+                response = dict(cached, cached=True)
+                count_outcome(verdict_outcome(cached), response)
+                return jsonify(response)
+        with metrics.timer('decode'):
+            img = decode_image(image_data, max_side=MAX_IMAGE_SIDE)
         if img is None:
             logger.error("Invalid image received")
-            os.remove(temp_image_path)
+            count_outcome('error')
             return jsonify({'result': False, 'error': 'Invalid image'}), 400
 
-        # Step 1: Detect face
-        @timeout(10)
-        def detect_face():
-            faces = DeepFace.extract_faces(img_path=temp_image_path, detector_backend='mtcnn', enforce_detection=False)
-            # Validate faces
-            valid_faces = [face for face in faces if face['confidence'] > 0.9]
-            logger.info(f"Detected {len(faces)} faces, {len(valid_faces)} valid (confidence > 0.9)")
-            return valid_faces
+        # Search only padded crops around the hinted regions when they are small enough
+        boxes = region_crops(regions, image_data, img) if regions else None
+        metrics.inc('detections', mode='regions' if boxes else 'full')
+        if inference_processes is not None:
+            return remote_verdict(key, img, boxes, deadline)
 
-        face_detected = False
+        # Step 1: Detect faces once, keeping the aligned crops for embedding
         try:
-            valid_faces = detect_face()
-            face_detected = len(valid_faces) > 0
-            if face_detected:
-                logger.info("Valid face detected in image")
-            else:
+            with metrics.timer('detection'):
+                if boxes:
+                    valid_faces = inference_pool.run(detect_in_crops, detect_faces, img, boxes, deadline=deadline)
+                else:
+                    valid_faces = inference_pool.run(detect_faces, img, deadline=deadline)
+            if not valid_faces:
                 logger.info("No valid face detected in image")
-                os.remove(temp_image_path)
-                response = {'result': False, 'message': 'No human face detected'}
-                print(f"Flask Response: {response}")
-                return jsonify(response)
+                return verdict_response(key, {'result': False, 'message': 'No human face detected'})
+        except Overloaded as e:
+            return overloaded_response(e)
+        except DeadlineExceeded as e:
+            return deadline_response(e)
         except Exception as e:
             logger.info(f"Face detection failed: {str(e)}")
-            os.remove(temp_image_path)
-            response = {'result': False, 'message': 'No human face detected'}
-            print(f"Flask Response: {response}")
-            return jsonify(response)
-
-        # Step 2: Compare against known faces
-        @timeout(10)
-        def compute_input_embedding():
-            return DeepFace.represent(img_path=temp_image_path, model_name='VGG-Face', detector_backend='mtcnn', enforce_detection=True)
+            return verdict_response(None, {'result': False, 'message': 'No human face detected'}, outcome='error')
 
+        # Step 2: Embed the detected crops and compare each against known faces
         try:
-            input_embedding = compute_input_embedding()[0]['embedding']
-            is_known = False
-            if not known_embeddings:
-                logger.info("No known embeddings available. Treating face as unknown.")
-            else:
-                for known_face_path, known_embedding in known_embeddings.items():
-                    try:
-                        distance = np.linalg.norm(np.array(input_embedding) - np.array(known_embedding))
-                        logger.info(f"Distance to {known_face_path}: {distance}")
-                        if distance < 0.6:  # Adjusted threshold
-                            logger.info(f"Match found with {known_face_path}")
-                            is_known = True
-                            break
-                    except Exception as e:
-                        logger.warning(f"Error comparing with {known_face_path}: {str(e)}")
-                        continue
-            
-            result = not is_known
-            response = {'result': result, 'message': 'Unknown human' if result else 'Known person'}
-            logger.info(f"Result: {'Unknown human' if result else 'Known person'}")
-            print(f"Flask Response: {response}")
-            os.remove(temp_image_path)
-            return jsonify(response)
-
-        except (ValueError, TimeoutError) as e:
+            remaining = max(0.0, deadline - time.monotonic())
+            with metrics.timer('embedding'):
+                input_embeddings = embedding_batcher([face['face'] for face in valid_faces], timeout=remaining)
+            return verdict_response(key, faces_response(valid_faces, input_embeddings))
+
+        except TimeoutError as e:
+            return deadline_response(e)
+        except ValueError as e:
             logger.error(f"Embedding computation failed: {str(e)}")
-            os.remove(temp_image_path)
-            response = {'result': False, 'message': 'Error processing face'}
-            print(f"Flask Response: {response}")
-            return jsonify(response)
+            return verdict_response(None, {'result': False, 'message': 'Error processing face'})
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        if 'temp_image_path' in locals() and os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        response = {'result': False, 'error': str(e)}
-        print(f"Flask Response: {response}")
-        return jsonify(response)
+        return verdict_response(None, {'result': False, 'error': str(e)})
+
+@app.route('/process_batch', methods=['POST'])
+@require_api_key
+@require_ready
+def process_batch():
+    metrics.inc('requests', endpoint='process_batch')
+    start = time.perf_counter()
+    with metrics.in_flight():
+        response = handle_batch()
+    elapsed = time.perf_counter() - start
+    metrics.observe('batch_total', elapsed)
+    # A rejected batch set no per-image events, so it is recorded as one event
+    if 'outcome' in g:
+        record_event(g.outcome, None, request_camera(), latency_s=elapsed)
+    return response
+
+# Detection of one /process_batch image as (result, faces to embed). With
+# INFERENCE_PROCESSES the faces come back embedded, so the result is final.
+def batch_detection(position, future, deadline):
+    try:
+        if inference_processes is not None:
+            analysed = inference_processes.wait(future, deadline)
+            if analysed['faces']:
+                return faces_response(analysed['faces'], analysed['embeddings']), []
+            valid_faces = []
+        else:
+            valid_faces = inference_pool.wait(future, deadline)
+    except DeadlineExceeded:
+        raise
+    except InferenceError as e:
+        logger.info(f"Face {e.stage} failed for image {position}: {str(e)}")
+        if e.stage != 'detection':
+            return {'result': False, 'message': 'Error processing face'}, []
+        valid_faces = []
+    except Exception as e:
+        logger.info(f"Face detection failed for image {position}: {str(e)}")
+        valid_faces = []
+    if valid_faces:
+        return None, valid_faces
+    return {'result': False, 'message': 'No human face detected'}, []
+
+def handle_batch():
+    # Images arrive either as multipart 'images' files or as one body of
+    # length-prefixed images (4-byte big-endian length + encoded bytes)
+    try:
+        if request.files:
+            blobs = [image_file.read() for image_file in request.files.getlist('images')]
+        else:
+            blobs = split_length_prefixed(request.get_data())
+    except ValueError as e:
+        logger.error(f"Invalid batch body: {str(e)}")
+        count_outcome('error')
+        return jsonify({'error': str(e)}), 400
+    if not blobs:
+        count_outcome('error')
+        return jsonify({'error': 'No images in batch'}), 400
+    if len(blobs) > MAX_BATCH_IMAGES:
+        count_outcome('error')
+        return jsonify({'error': f'Batch has {len(blobs)} images, limit is {MAX_BATCH_IMAGES}'}), 413
+    logger.info(f"Received batch of {len(blobs)} images")
+    deadline = time.monotonic() + REQUEST_DEADLINE_S
+
+    # Step 1: Decode every image and detect faces on the inference pool. The
+    # batch is admitted as one unit: it keeps at most one image per inference
+    # worker in the pool and queues the rest itself, so a batch larger than the
+    # pool's queue is not rejected. Only the first submission can shed it.
+    results = [None] * len(blobs)
+    detections = []
+    window = inference_processes.processes if inference_processes is not None else inference_pool.workers
+    waiting = deque(range(len(blobs)))
+    in_flight = {}
+    admitted = False
+    img = None
+    try:
+        while waiting or in_flight:
+            while waiting and len(in_flight) < window:
+                if img is None:
+                    img = decode_image(blobs[waiting[0]], max_side=MAX_IMAGE_SIDE)
+                    if img is None:
+                        results[waiting.popleft()] = {'result': False, 'error': 'Invalid image'}
+                        continue
+                try:
+                    if inference_processes is not None:
+                        future = inference_processes.submit(img, deadline=deadline)
+                    else:
+                        future = inference_pool.submit(detect_faces, img)
+                except Overloaded:
+                    if not admitted:
+                        raise
+                    # Other requests hold the pool; wait for one of ours, or briefly if none is running
+                    if not in_flight:
+                        time.sleep(0.05)
+                        if time.monotonic() > deadline:
+                            raise DeadlineExceeded("batch could not reach the inference pool before its deadline")
+                    break
+                admitted, img = True, None
+                in_flight[future] = waiting.popleft()
+            if not in_flight:
+                continue
+            done, _ = wait_futures(in_flight, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Raises DeadlineExceeded and counts the timeout against the pool
+                pool = inference_processes if inference_processes is not None else inference_pool
+                pool.wait(next(iter(in_flight)), deadline)
+                continue
+            for future in done:
+                position = in_flight.pop(future)
+                results[position], valid_faces = batch_detection(position, future, deadline)
+                if valid_faces:
+                    detections.append((position, valid_faces))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except DeadlineExceeded as e:
+        for future in in_flight:
+            future.cancel()
+        return deadline_response(e)
+    detections.sort(key=lambda detection: detection[0])
+
+    # Step 2: Embed all faces of the batch in one forward pass and route them back
+    crops = [face['face'] for _, valid_faces in detections for face in valid_faces]
+    if crops:
+        try:
+            embeddings = inference_pool.run(embed_faces, crops, deadline=deadline)
+        except Overloaded as e:
+            return overloaded_response(e)
+        except DeadlineExceeded as e:
+            return deadline_response(e)
+        except ValueError as e:
+            logger.error(f"Batch embedding computation failed: {str(e)}")
+            for position, _ in detections:
+                results[position] = {'result': False, 'message': 'Error processing face'}
+        else:
+            offset = 0
+            for position, valid_faces in detections:
+                results[position] = faces_response(valid_faces, embeddings[offset:offset + len(valid_faces)])
+                offset += len(valid_faces)
+
+    camera = request_camera()
+    for result in results:
+        outcome = verdict_outcome(result)
+        metrics.inc('outcomes', outcome=outcome)
+        record_event(outcome, result, camera)
+    face_count = sum(len(result.get('faces', [])) for result in results)
+    logger.info(f"Processed batch of {len(blobs)} images with {face_count} faces")
+    return jsonify({'results': results})
+
+# Stored detection events, newest first. Filters: camera, verdict (known,
+# unknown, no_face, error, overloaded, deadline), identity, and since/until
+# as epoch seconds or ISO 8601. Pass next_cursor back as cursor for the next page.
+@app.route('/events', methods=['GET'])
+@require_api_key
+def events():
+    if event_store is None:
+        return jsonify({'error': 'Event store is disabled'}), 404
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_EVENTS_PAGE)
+        found, cursor = event_store.query(
+            since=parse_time(request.args.get('since')), until=parse_time(request.args.get('until')),
+            camera=request.args.get('camera'), verdict=request.args.get('verdict'), identity=request.args.get('identity'),
+            limit=limit, cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'events': found, 'next_cursor': cursor})
+
+@app.route('/batch_stats', methods=['GET'])
+@require_api_key
+def batch_stats():
+    if embedding_batcher is None:
+        return jsonify({'error': 'Embeddings are batched in the inference processes'}), 404
+    return jsonify(embedding_batcher.stats())
+
+# Prometheus text format by default, JSON with ?format=json
+@app.route('/metrics', methods=['GET'])
+@require_api_key
+def metrics_endpoint():
+    index = known_index
+    pool = inference_load()
+    counters = {}
+    gauges = {
+        'ready': int(ready.is_set()),
+        'gallery_size': len(index) if index is not None else 0,
+        'inference_pending': pool['pending'],
+    }
+    if embedding_batcher is not None:
+        gauges.update(embedding_queue_depth=embedding_batcher.stats()['queue_depth'])
+    if result_cache is not None:
+        cache = result_cache.stats()
+        gauges.update(result_cache_size=cache['size'])
+        counters.update(result_cache_hits=cache['hits'], result_cache_misses=cache['misses'])
+    if event_store is not None:
+        store = event_store.stats()
+        gauges.update(event_store_queued=store['queued'], event_store_dropped=store['dropped'])
+    if request.args.get('format') == 'json':
+        snapshot = metrics.snapshot()
+        snapshot['counters'].update(counters)
+        return jsonify(dict(snapshot, gauges=gauges, inference_pool=pool))
+    return metrics.prometheus(gauges, counters), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/cache_stats', methods=['GET'])
+@require_api_key
+def cache_stats():
+    if result_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(result_cache.stats(), enabled=True))
+
+# Serialises gallery writers within this process; the store's file lock
+# serialises them across gunicorn workers. Readers never take it: each change
+# builds a new index and publishes it with a single reference swap.
+enrollment_lock = threading.Lock()
+
+# Each gunicorn worker holds its own copy of the gallery. When another worker
+# has enrolled or removed an identity since, reload the store and rebuild (or
+# load the saved) index. Call with enrollment_lock and the store lock held.
+def reload_gallery():
+    global known_index
+    if not known_embeddings.changed_on_disk():
+        return
+    known_embeddings.load()
+    known_index = load_or_build_index(known_embeddings)
+    if result_cache is not None:
+        result_cache.clear()
+    logger.info(f"Reloaded gallery changed by another process ({len(known_index)} known faces)")
+
+# Called before every request that uses the gallery; one stat() when nothing changed
+def refresh_gallery():
+    if known_embeddings is None or not known_embeddings.changed_on_disk():
+        return
+    with enrollment_lock, known_embeddings.locked():
+        reload_gallery()
+
+def identity_paths(name):
+    return [label for label in known_embeddings.labels if identity_of(label) == name]
+
+@app.route('/identities', methods=['GET'])
+@require_admin_key
+@require_ready
+def list_identities():
+    index = known_index
+    identities = sorted({identity_of(label) for label in index.labels})
+    return jsonify({'identities': identities, 'gallery_size': len(index)})
+
+# POST enrolls a new identity, PUT enrolls or replaces one
+@app.route('/identities/<name>', methods=['POST', 'PUT'])
+@require_admin_key
+@require_ready
+def enroll_identity(name):
+    global known_index
+    if not IDENTITY_PATTERN.match(name):
+        return jsonify({'error': 'Invalid identity name'}), 400
+
+    image_data = request.get_data()
+    img = decode_image(image_data)
+    if img is None:
+        return jsonify({'error': 'Invalid image'}), 400
+    extension = encoded_extension(image_data)
+    if extension is None:
+        return jsonify({'error': 'Enrollment photos must be JPEG or PNG'}), 400
+
+    # Detection and embedding happen before taking the lock
+    try:
+        if inference_processes is not None:
+            analysed = inference_processes.run(img, deadline=time.monotonic() + REQUEST_DEADLINE_S)
+            valid_faces, embeddings = analysed['faces'], analysed['embeddings']
+        else:
+            valid_faces = detect_faces(img)
+        if len(valid_faces) != 1:
+            return jsonify({'error': f'Expected exactly one face, found {len(valid_faces)}'}), 422
+        embedding = embeddings[0] if inference_processes is not None else embed_faces([valid_faces[0]['face']])[0]
+    except Exception as e:
+        logger.error(f"Enrollment of {name} failed: {str(e)}")
+        return jsonify({'error': 'Error processing face'}), 500
+
+    with enrollment_lock, known_embeddings.locked():
+        reload_gallery()
+        existing = identity_paths(name)
+        if existing and request.method == 'POST':
+            return jsonify({'error': f'Identity {name} already exists'}), 409
+
+        path = os.path.join(DATABASE_PATH, name + extension)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image_data)
+        os.replace(tmp_path, path)
+        stale = [label for label in existing if label != path]
+        for label in stale:
+            os.remove(label)
+        known_embeddings.remove(stale)
+        known_embeddings.upsert(path, embedding)
+
+        index = known_index.removed(existing) if existing else known_index
+        known_index = index.added([path], [embedding])
+        # Cached verdicts were computed against the old gallery
+        if result_cache is not None:
+            result_cache.clear()
+
+    logger.info(f"{'Replaced' if existing else 'Enrolled'} identity {name} ({len(known_index)} known faces)")
+    return jsonify({'identity': name, 'status': 'replaced' if existing else 'enrolled', 'gallery_size': len(known_index)}), 200 if existing else 201
+
+@app.route('/identities/<name>', methods=['DELETE'])
+@require_admin_key
+@require_ready
+def remove_identity(name):
+    global known_index
+    if not IDENTITY_PATTERN.match(name):
+        return jsonify({'error': 'Invalid identity name'}), 400
+
+    with enrollment_lock, known_embeddings.locked():
+        reload_gallery()
+        existing = identity_paths(name)
+        if not existing:
+            return jsonify({'error': f'Identity {name} not found'}), 404
+        for label in existing:
+            if os.path.exists(label):
+                os.remove(label)
+        known_embeddings.remove(existing)
+        known_index = known_index.removed(existing)
+        if result_cache is not None:
+            result_cache.clear()
+
+    logger.info(f"Removed identity {name} ({len(known_index)} known faces)")
+    return jsonify({'identity': name, 'status': 'removed', 'gallery_size': len(known_index)})
 
 if __name__ == '__main__':
     import os
     port = int(os.getenv('PORT', 5000))
+    startup()
     app.run(host='0.0.0.0', port=port)
 
 
@@ -0,0 +1,55 @@
+import struct
+
+# Bytes of an MJPEG AVI file around the frame data: RIFF/hdrl/strl/movi headers
+# before the frames and the idx1 chunk header after them
+AVI_HEADER_BYTES = 224 + 8
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+def _padded(length):
+    return length + (length & 1)
+
+# Bytes a JPEG of `length` bytes adds to the file: its '00dc' chunk header,
+# the data padded to an even size, and its idx1 entry. A file holds exactly
+# AVI_HEADER_BYTES plus the cost of each frame.
+def avi_frame_cost(length):
+    return 8 + _padded(length) + 16
+
+def _chunk(fourcc, payload):
+    return fourcc + struct.pack('<I', len(payload)) + payload
+
+# Write JPEG frames into a Motion-JPEG AVI (RIFF) file without decoding them.
+# Every frame is a keyframe and must have the given width and height.
+def write_mjpeg_avi(path, frames, fps, width, height):
+    fps = max(fps, 1e-3)
+    rate, scale = int(round(fps * 1000)), 1000
+    largest = max((len(frame) for frame in frames), default=0)
+    movi_bytes = 4 + sum(8 + _padded(len(frame)) for frame in frames)
+    seconds = len(frames) / fps if frames else 1.0
+
+    avih = struct.pack('<14I', int(round(1e6 / fps)), int(sum(map(len, frames)) / seconds), 0, AVIF_HASINDEX,
+                       len(frames), 0, 1, largest, width, height, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIiI4h', b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, len(frames),
+                       largest, -1, 0, 0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    strl = b'LIST' + struct.pack('<I', 4 + 8 + len(strh) + 8 + len(strf)) + b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+    hdrl = b'LIST' + struct.pack('<I', 4 + 8 + len(avih) + len(strl)) + b'hdrl' + _chunk(b'avih', avih) + strl
+    idx1_bytes = 16 * len(frames)
+    riff_bytes = 4 + len(hdrl) + 8 + movi_bytes + 8 + idx1_bytes
+
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', riff_bytes) + b'AVI ')
+        f.write(hdrl)
+        f.write(b'LIST' + struct.pack('<I', movi_bytes) + b'movi')
+        index = bytearray()
+        offset = 4
+        for frame in frames:
+            f.write(b'00dc' + struct.pack('<I', len(frame)))
+            f.write(frame)
+            if len(frame) & 1:
+                f.write(b'\0')
+            index += b'00dc' + struct.pack('<III', AVIIF_KEYFRAME, offset, len(frame))
+            offset += 8 + _padded(len(frame))
+        f.write(b'idx1' + struct.pack('<I', idx1_bytes))
+        f.write(index)
@@ -0,0 +1,158 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the queueing-delay histogram buckets
+DELAY_BUCKETS_MS = (1, 2, 5, 10, 15, 25, 50, 100, 250, float('inf'))
+
+class _Request:
+    __slots__ = ('items', 'future', 'enqueued')
+
+    def __init__(self, items):
+        self.items = items
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+# Collects items submitted by concurrent callers into batches of up to
+# max_batch_size items, waiting at most max_wait_ms after the first one arrives,
+# then runs batch_fn once on the whole batch from a single worker thread.
+# batch_fn takes a list of items and returns a sequence with one result per
+# item; each caller gets back the slice that belongs to its own items.
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=15, name='batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._carry = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._delay_counts = [0] * len(DELAY_BUCKETS_MS)
+        self._delay_total_ms = 0.0
+        self._delay_max_ms = 0.0
+        self._requests = 0
+        self._cancelled = 0
+
+    # The worker thread is started on first use so the batcher survives a fork
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, items):
+        request = _Request(list(items))
+        if not request.items:
+            request.future.set_result([])
+            return request.future
+        self._ensure_started()
+        self._queue.put(request)
+        return request.future
+
+    # Blocking helper: submit and wait for this caller's results. A caller that
+    # gives up cancels its request, so it is dropped if not yet batched.
+    def __call__(self, items, timeout=None):
+        future = self.submit(items)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    # Next request whose caller is still waiting; abandoned ones are skipped
+    def _next_request(self, timeout):
+        if self._carry is not None:
+            # Already claimed when it was first taken off the queue
+            request, self._carry = self._carry, None
+            return request
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                request = self._queue.get()
+            else:
+                request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            if request.future.set_running_or_notify_cancel():
+                return request
+            with self._stats_lock:
+                self._cancelled += 1
+
+    def _collect(self):
+        first = self._next_request(None)
+        pending = [first]
+        size = len(first.items)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(remaining)
+            except queue.Empty:
+                break
+            if size + len(request.items) > self.max_batch_size:
+                # Keep whole requests together; this one opens the next batch
+                self._carry = request
+                break
+            pending.append(request)
+            size += len(request.items)
+        return pending, size
+
+    def _run(self):
+        while True:
+            pending, size = self._collect()
+            started = time.monotonic()
+            self._record(pending, size, started)
+            try:
+                results = self.batch_fn([item for request in pending for item in request.items])
+            except Exception as e:
+                logger.error(f"{self.name}: batch of {size} failed: {str(e)}")
+                for request in pending:
+                    request.future.set_exception(e)
+                continue
+            offset = 0
+            for request in pending:
+                request.future.set_result(results[offset:offset + len(request.items)])
+                offset += len(request.items)
+
+    def _record(self, pending, size, started):
+        with self._stats_lock:
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            for request in pending:
+                delay_ms = (started - request.enqueued) * 1000
+                self._requests += 1
+                self._delay_total_ms += delay_ms
+                self._delay_max_ms = max(self._delay_max_ms, delay_ms)
+                for bucket, bound in enumerate(DELAY_BUCKETS_MS):
+                    if delay_ms <= bound:
+                        self._delay_counts[bucket] += 1
+                        break
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize() + (1 if self._carry is not None else 0),
+                'batches': sum(self._batch_sizes.values()),
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'requests': self._requests,
+                'cancelled': self._cancelled,
+                'queue_delay_ms': {
+                    'mean': self._delay_total_ms / self._requests if self._requests else 0.0,
+                    'max': self._delay_max_ms,
+                    'buckets': {
+                        ('+Inf' if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(DELAY_BUCKETS_MS, self._delay_counts)
+                    },
+                },
+            }
@@ -0,0 +1,82 @@
+# Recall/latency benchmark for the known-face indexes.
+#
+# Run from the Face_detector directory:
+#   python -m benchmarks.bench_index --sizes 1000 10000 100000 --dim 4096 --nprobe 1 4 8 16
+#
+# Galleries are synthetic L2-normalised vectors (VGG-Face embeddings are
+# normalised the same way); each query is a noisy copy of an enrolled face, and
+# recall@1 is measured against the exact index.
+import argparse
+import json
+import time
+import numpy as np
+from face_index import create_index
+from benchmarks.common import summarize
+
+def make_gallery(size, dim, rng):
+    gallery = rng.standard_normal((size, dim), dtype=np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    return gallery
+
+def make_queries(gallery, count, noise, rng):
+    picks = rng.choice(len(gallery), count, replace=len(gallery) < count)
+    queries = gallery[picks] + noise * rng.standard_normal((count, gallery.shape[1]), dtype=np.float32) / np.sqrt(gallery.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def time_queries(index, queries, **kwargs):
+    labels, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        match = index.match(query, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(match['label'])
+    return labels, np.asarray(latencies)
+
+def run(sizes, dim, queries_per_size, nprobes, nlist, noise, metric, seed):
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        gallery = make_gallery(size, dim, rng)
+        labels = [f"face_{i}" for i in range(size)]
+        queries = make_queries(gallery, queries_per_size, noise, rng)
+
+        exact = create_index('exact', labels, gallery, metric=metric)
+        truth, latencies = time_queries(exact, queries)
+        results.append({'size': size, 'index': 'exact', 'recall_at_1': 1.0, **summarize(latencies)})
+
+        start = time.perf_counter()
+        ivf = create_index('ivf', labels, gallery, metric=metric, nlist=nlist)
+        build_s = time.perf_counter() - start
+        for nprobe in nprobes:
+            found, latencies = time_queries(ivf, queries, nprobe=nprobe)
+            recall = float(np.mean([a == b for a, b in zip(found, truth)]))
+            results.append({
+                'size': size, 'index': 'ivf', 'nlist': ivf.nlist, 'nprobe': nprobe,
+                'build_s': round(build_s, 3), 'recall_at_1': round(recall, 4), **summarize(latencies),
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact vs IVF known-face indexes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--dim', type=int, default=4096)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--noise', type=float, default=0.5, help="Query noise relative to a unit vector")
+    parser.add_argument('--metric', default='euclidean', choices=['euclidean', 'cosine'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.dim, args.queries, args.nprobe, args.nlist, args.noise, args.metric, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'size':>8} {'index':>6} {'nlist':>6} {'nprobe':>6} {'recall@1':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in results:
+        print(f"{row['size']:>8} {row['index']:>6} {row.get('nlist', '-'):>6} {row.get('nprobe', '-'):>6} "
+              f"{row['recall_at_1']:>9.4f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+
+if __name__ == '__main__':
+    main()
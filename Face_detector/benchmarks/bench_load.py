@@ -0,0 +1,191 @@
+# Concurrent load generator for /process_image. Reports throughput, client-side
+# p50/p95/p99 latency, status and verdict counts, and the server's per-stage
+# timings from /metrics, as JSON that can be diffed between runs.
+#
+# Run from the Face_detector directory. By default the app is started
+# in-process on a free port, in a scratch directory, with the stand-in models
+# and a synthetic gallery, so no network access or TensorFlow is needed:
+#   python -m benchmarks.bench_load --concurrency 8 --requests 400 --gallery-size 10000
+#
+# Server settings (INFERENCE_WORKERS, EMBED_BATCH_SIZE, ...) are read from the
+# environment as usual. To load a server that is already running instead:
+#   python -m benchmarks.bench_load --url http://localhost:5000 --fixtures known_faces
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from benchmarks.common import summarize
+from benchmarks.fixtures import make_gallery, make_images
+from benchmarks.stand_in_models import StandInModels
+
+API_KEY = os.getenv('API_KEY', '5gl5TTvpUaX3J9K-muC3pSiTfGHy8S_Vn3ruNk8Vnqw')
+
+# Import and start the app in a scratch working directory, replace its gallery
+# with gallery_size synthetic faces plus the faces of known_images, and serve
+# it from a background thread. Returns the base URL.
+def start_local_server(args, known_images):
+    workdir = tempfile.mkdtemp(prefix='face_bench_')
+    os.makedirs(os.path.join(workdir, 'known_faces'))
+    os.chdir(workdir)
+
+    import app
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    if args.models == 'stand-in':
+        StandInModels(detect_ms=args.detect_ms, embed_ms=args.embed_ms).install(app)
+    if not args.cache:
+        app.result_cache = None
+    app.startup()
+
+    labels, vectors = [], []
+    for name, data, _ in known_images:
+        faces = app.detect_faces(app.decode_image(data))
+        if faces:
+            labels.append(os.path.join(app.DATABASE_PATH, name))
+            vectors.append(app.embed_faces([faces[0]['face']])[0])
+    dim = vectors[0].shape[0] if vectors else 4096
+    rng = np.random.default_rng(args.seed + 1)
+    labels += [f"synthetic_{i}.jpg" for i in range(args.gallery_size)]
+    gallery = np.concatenate([np.asarray(vectors, dtype=np.float32).reshape(-1, dim), make_gallery(args.gallery_size, dim, rng)])
+    params = {'nlist': app.IVF_NLIST, 'nprobe': app.IVF_NPROBE} if app.INDEX_BACKEND == 'ivf' else {}
+    app.known_index = app.create_index(app.INDEX_BACKEND, labels, gallery, metric=app.MATCH_METRIC, storage=app.GALLERY_STORAGE, **params)
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+# Closed-loop load: `concurrency` clients each send their next image as soon as
+# the previous response arrives, until `total` requests or `duration` seconds
+def drive(url, images, concurrency, total, duration):
+    lock = threading.Lock()
+    sent = [0]
+    samples = []
+    stop_at = time.monotonic() + duration if duration else None
+
+    def client(worker):
+        session = requests.Session()
+        session.headers['X-API-Key'] = API_KEY
+        local = []
+        while True:
+            with lock:
+                if (total and sent[0] >= total) or (stop_at and time.monotonic() >= stop_at):
+                    break
+                position = sent[0]
+                sent[0] += 1
+            name, data, _ = images[position % len(images)]
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{url}/process_image", data=data, headers={'Content-Type': 'application/octet-stream'}, timeout=60)
+                status = response.status_code
+                body = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+            except requests.RequestException:
+                status, body = 'connection_error', {}
+            local.append(((time.perf_counter() - start) * 1000, status, body.get('message') or body.get('error')))
+        with lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return samples, time.perf_counter() - start
+
+# Mean per-stage server time from the /metrics JSON histograms
+def server_stages(url):
+    try:
+        response = requests.get(f"{url}/metrics", params={'format': 'json'}, headers={'X-API-Key': API_KEY}, timeout=10)
+        snapshot = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+    return {
+        stage: {'count': histogram['count'], 'mean_ms': round(histogram['sum'] / histogram['count'] * 1000, 4) if histogram['count'] else 0.0}
+        for stage, histogram in snapshot.get('stages', {}).items()
+    }
+
+def count(values):
+    counts = {}
+    for value in values:
+        counts[str(value)] = counts.get(str(value), 0) + 1
+    return dict(sorted(counts.items()))
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    images = make_images(args.images, rng, args.width, args.height, fixture_dir=args.fixtures)
+    faces = [image for image in images if image[2]]
+    known_images = faces[:max(0, int(len(faces) * args.known_ratio))]
+    url = args.url or start_local_server(args, known_images)
+
+    if args.warmup:
+        drive(url, images, min(args.concurrency, args.warmup), args.warmup, None)
+    before = server_stages(url)
+    samples, elapsed = drive(url, images, args.concurrency, args.requests, args.duration)
+    after = server_stages(url)
+
+    stages = None
+    if after is not None:
+        # Only the measured run, not the warm-up requests
+        stages = {}
+        for stage, totals in after.items():
+            prior = (before or {}).get(stage, {'count': 0, 'mean_ms': 0.0})
+            n = totals['count'] - prior['count']
+            if n > 0:
+                stages[stage] = {'count': n, 'mean_ms': round((totals['mean_ms'] * totals['count'] - prior['mean_ms'] * prior['count']) / n, 4)}
+
+    ok = [latency for latency, status, _ in samples if status == 200]
+    return {
+        'config': {
+            'url': args.url or 'in-process', 'models': None if args.url else args.models,
+            'concurrency': args.concurrency, 'requests': len(samples), 'images': len(images),
+            'gallery_size': None if args.url else args.gallery_size + len(known_images),
+            'cache': None if args.url else args.cache,
+        },
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'latency': summarize([latency for latency, _, _ in samples]),
+        'latency_ok': summarize(ok),
+        'status': count(status for _, status, _ in samples),
+        'verdicts': count(message for _, status, message in samples if status == 200),
+        'server_stages': stages,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /process_image and report throughput and latency percentiles")
+    parser.add_argument('--url', default=None, help="Running server to load; default starts the app in-process")
+    parser.add_argument('--models', choices=['stand-in', 'real'], default='stand-in', help="Models for the in-process server")
+    parser.add_argument('--detect-ms', type=float, default=0.0, help="Extra time per stand-in detection call")
+    parser.add_argument('--embed-ms', type=float, default=0.0, help="Extra time per stand-in embedding call")
+    parser.add_argument('--gallery-size', type=int, default=1000, help="Synthetic known faces in the in-process gallery")
+    parser.add_argument('--known-ratio', type=float, default=0.3, help="Share of face images enrolled as known")
+    parser.add_argument('--cache', action='store_true', help="Keep the near-duplicate result cache enabled")
+    parser.add_argument('--images', type=int, default=64, help="Distinct synthetic frames to cycle through")
+    parser.add_argument('--fixtures', default=None, help="Directory of real photos to add to the inputs")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--duration', type=float, default=None, help="Run for this many seconds instead of a request count")
+    parser.add_argument('--warmup', type=int, default=16, help="Untimed requests sent first")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.duration:
+        args.requests = None
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.fixtures:
+        args.fixtures = os.path.abspath(args.fixtures)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
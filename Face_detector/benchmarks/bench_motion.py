@@ -0,0 +1,113 @@
+# Per-frame cost of motion detection: the original full-resolution pair
+# difference from stream_capture.py against MotionDetector. With --jpeg the
+# frames are JPEG-encoded as an MJPEG camera sends them, and decoding is timed
+# too: a full decode as cv2.VideoCapture does against the reduced decode of
+# MjpegGrabber.preview().
+#
+# Run from the Face_detector directory:
+#   python -m benchmarks.bench_motion --width 1920 --height 1080 --json
+#   python -m benchmarks.bench_motion --jpeg --scaled-widths 320
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from benchmarks.common import summarize
+from image_io import decode_grayscale_preview, reduction_factor
+from motion_detector import MotionDetector
+
+# The check stream_capture.py used to run on every pair of full-size frames
+def pair_difference(frame1, frame2, min_area):
+    diff = cv2.absdiff(frame1, frame2)
+    gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, 25, 255, cv2.THRESH_BINARY)
+    dilated = cv2.dilate(thresh, None, iterations=2)
+    contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return any(cv2.contourArea(contour) >= min_area for contour in contours)
+
+# Noisy static scene with a bright block crossing it in the second half
+def make_frames(count, width, height, rng):
+    base = cv2.resize(rng.integers(30, 200, size=(height // 16, width // 16, 3), dtype=np.uint8), (width, height))
+    frames = []
+    for i in range(count):
+        frame = cv2.add(base, rng.integers(0, 8, size=base.shape, dtype=np.uint8))
+        if i >= count // 2:
+            x = int((i - count // 2) / (count // 2) * (width - width // 8))
+            cv2.rectangle(frame, (x, height // 3), (x + width // 8, height // 3 + height // 4), (250, 250, 250), -1)
+        frames.append(frame)
+    return frames
+
+def full_decode(jpeg):
+    return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR), 1.0
+
+# Reduced grayscale decode, as MjpegGrabber.preview() does
+def reduced_decode(jpeg, width, frame_width):
+    small = decode_grayscale_preview(jpeg, reduction_factor((frame_width,), width))
+    return small, small.shape[1] / frame_width
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    frames = make_frames(args.frames, args.width, args.height, rng)
+    moving_from = args.frames // 2
+    results = []
+    if args.jpeg:
+        frames = [cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes() for frame in frames]
+
+    latencies, hits = [], []
+    previous = full_decode(frames[0])[0] if args.jpeg else frames[0]
+    for frame in frames[1:]:
+        start = time.perf_counter()
+        if args.jpeg:
+            frame = full_decode(frame)[0]
+        hits.append(pair_difference(previous, frame, args.min_area))
+        latencies.append((time.perf_counter() - start) * 1000)
+        previous = frame
+    baseline = summarize(latencies)
+    results.append({'detector': 'pair_difference', 'width': args.width, **baseline,
+                    'motion_frames': int(sum(hits[moving_from:])), 'false_alarms': int(sum(hits[:moving_from - 1]))})
+
+    decoders = [('', None)]
+    if args.jpeg:
+        decoders = [('full decode + ', lambda jpeg, width: full_decode(jpeg)),
+                    ('reduced decode + ', lambda jpeg, width: reduced_decode(jpeg, width, args.width))]
+    for label, decode in decoders:
+        for method in args.methods:
+            for scaled_width in args.scaled_widths:
+                detector = MotionDetector(min_area=args.min_area, width=scaled_width, method=method)
+                latencies, hits = [], []
+                for frame in frames:
+                    start = time.perf_counter()
+                    image, scale = decode(frame, scaled_width) if decode else (frame, 1.0)
+                    hits.append(bool(detector.detect(image, scale)))
+                    latencies.append((time.perf_counter() - start) * 1000)
+                summary = summarize(latencies)
+                results.append({'detector': label + method, 'width': scaled_width, **summary,
+                                'speedup': round(baseline['mean_ms'] / summary['mean_ms'], 2),
+                                'motion_frames': int(sum(hits[moving_from:])), 'false_alarms': int(sum(hits[:moving_from]))})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark motion detection cost per frame")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--min-area', type=int, default=1500)
+    parser.add_argument('--methods', nargs='+', default=['average', 'mog2'], choices=['average', 'mog2'])
+    parser.add_argument('--scaled-widths', type=int, nargs='+', default=[160, 320, 640], help="MotionDetector working widths")
+    parser.add_argument('--jpeg', action='store_true', help="Start from JPEG frames and include decoding in the timings")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'detector':>32} {'width':>6} {'mean ms':>9} {'p99 ms':>9} {'speedup':>8} {'motion':>7} {'false':>6}")
+    for row in results:
+        print(f"{row['detector']:>32} {row['width']:>6} {row['mean_ms']:>9.3f} {row['p99_ms']:>9.3f} "
+              f"{row.get('speedup', 1.0):>8.2f} {row['motion_frames']:>7} {row['false_alarms']:>6}")
+
+if __name__ == '__main__':
+    main()
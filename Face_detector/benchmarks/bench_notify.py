@@ -0,0 +1,236 @@
+# Load test for the notification server (fastapi_server.py). Opens a growing
+# number of /ws subscribers and, at each step, times POST /notify from the
+# publisher's side and the delivery latency to every subscriber. Some
+# subscribers can be made to stop reading (--slow-clients) to check that they
+# are dropped without holding up /notify or the other clients.
+#
+# Run from the Face_detector directory. The server is started in a child
+# process on a free port, so the load generator does not compete with it for
+# the interpreter, unless --url points at a running one:
+#   python -m benchmarks.bench_notify --clients 0 100 1000 2000 --notifications 50
+#
+# Subscribers are raw sockets served by one selector thread, so thousands of
+# them fit in this process. Each also needs a file descriptor and two threads
+# on the server side.
+import argparse
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from benchmarks.common import summarize
+
+def _serve(queue_size, ports):
+    os.environ['WS_QUEUE_SIZE'] = str(queue_size)
+    os.environ['NOTIFY_JOURNAL_DIR'] = tempfile.mkdtemp(prefix='notify_bench_')
+    import fastapi_server
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, fastapi_server.app, threaded=True)
+    server.socket.listen(1024)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+# Serve fastapi_server.app from a child process; returns its URL and the process
+def start_local_server(args):
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    process = context.Process(target=_serve, args=(args.queue_size, ports), name='notify-server', daemon=True)
+    process.start()
+    return f"http://127.0.0.1:{ports.get(timeout=60)}", process
+
+# Open a WebSocket connection and complete the handshake
+def ws_connect(host, port, receive_buffer=None):
+    sock = socket.create_connection((host, port), timeout=30)
+    if receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((f"GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError("Connection closed during the WebSocket handshake")
+        response += data
+    if not response.startswith(b'HTTP/1.1 101'):
+        status = response.split(b'\r\n', 1)[0].decode(errors='replace')
+        raise ConnectionError(f"Handshake failed: {status}")
+    sock.setblocking(False)
+    return sock, response.split(b'\r\n\r\n', 1)[1]
+
+# Reads every subscriber socket from one thread, parsing server frames
+# (unmasked) and recording how long each notification took to arrive
+class Subscribers:
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self.delays_ms = []
+        self.received = 0
+        self.closed = 0
+        self.slow = []
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='subscribers', daemon=True)
+        self._thread.start()
+
+    def add(self, sock, pending):
+        self._selector.register(sock, selectors.EVENT_READ, bytearray(pending))
+
+    @property
+    def count(self):
+        return len(self._selector.get_map())
+
+    def _frames(self, buf):
+        while len(buf) >= 2:
+            opcode, length, offset = buf[0] & 0x0F, buf[1] & 0x7F, 2
+            if length == 126:
+                if len(buf) < 4:
+                    return
+                length, offset = int.from_bytes(buf[2:4], 'big'), 4
+            elif length == 127:
+                if len(buf) < 10:
+                    return
+                length, offset = int.from_bytes(buf[2:10], 'big'), 10
+            if len(buf) < offset + length:
+                return
+            payload = bytes(buf[offset:offset + length])
+            del buf[:offset + length]
+            yield opcode, payload
+
+    def _run(self):
+        while not self._stop:
+            for key, _ in self._selector.select(timeout=0.2):
+                sock, buf = key.fileobj, key.data
+                try:
+                    data = sock.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b''
+                now = time.time()
+                buf += data
+                delays = []
+                for opcode, payload in self._frames(buf):
+                    if opcode == 1:
+                        delays.append((now - json.loads(payload)['sent_at']) * 1000)
+                    elif opcode == 8:
+                        data = b''
+                with self._lock:
+                    self.received += len(delays)
+                    self.delays_ms.extend(delays)
+                if not data:
+                    self._selector.unregister(sock)
+                    sock.close()
+                    with self._lock:
+                        self.closed += 1
+
+    def take(self):
+        with self._lock:
+            delays, self.delays_ms = self.delays_ms, []
+            received, self.received = self.received, 0
+        return delays, received
+
+    def close(self):
+        self._stop = True
+        self._thread.join(5)
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        for sock in self.slow:
+            sock.close()
+
+def run(args):
+    url, process = (args.url, None) if args.url else start_local_server(args)
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    session = requests.Session()
+    subscribers = Subscribers()
+    padding = 'x' * args.payload_bytes
+
+    for _ in range(args.slow_clients):
+        # Never read: once the socket buffers fill, the server has to drop these
+        sock, _ = ws_connect(host, port, receive_buffer=4096)
+        subscribers.slow.append(sock)
+
+    steps = []
+    for target in args.clients:
+        while subscribers.count < target:
+            subscribers.add(*ws_connect(host, port))
+        time.sleep(args.settle_s)
+        subscribers.take()
+
+        notify_ms = []
+        for i in range(args.notifications):
+            notification = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'face_result': padding, 'sent_at': time.time()}
+            start = time.perf_counter()
+            response = session.post(f"{url}/notify", json=notification, timeout=30)
+            notify_ms.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+            if args.interval_ms:
+                time.sleep(args.interval_ms / 1000)
+
+        expected = args.notifications * target
+        deadline = time.monotonic() + args.drain_s
+        received = 0
+        delays = []
+        while time.monotonic() < deadline:
+            more_delays, more = subscribers.take()
+            delays += more_delays
+            received += more
+            if received >= expected:
+                break
+            time.sleep(0.05)
+        steps.append({
+            'subscribers': target,
+            'slow_subscribers': args.slow_clients,
+            'notify': summarize(notify_ms),
+            'delivery': summarize(delays),
+            'delivered': received,
+            'expected': expected,
+        })
+
+    try:
+        server = session.get(f"{url}/stats", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        server = None
+    subscribers.close()
+    if process is not None:
+        process.terminate()
+    return {
+        'config': {
+            'url': args.url or 'local', 'notifications': args.notifications, 'interval_ms': args.interval_ms,
+            'payload_bytes': args.payload_bytes, 'queue_size': None if args.url else args.queue_size,
+        },
+        'steps': steps,
+        'server': server,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test WebSocket fan-out of /notify")
+    parser.add_argument('--url', default=None, help="Running notification server; default starts one locally")
+    parser.add_argument('--clients', type=int, nargs='+', default=[0, 100, 1000, 2000], help="Subscriber counts to measure at")
+    parser.add_argument('--slow-clients', type=int, default=0, help="Extra subscribers that never read")
+    parser.add_argument('--notifications', type=int, default=50, help="Notifications published per step")
+    parser.add_argument('--interval-ms', type=float, default=100.0, help="Pause between notifications")
+    parser.add_argument('--payload-bytes', type=int, default=200, help="Size of the face_result text")
+    parser.add_argument('--queue-size', type=int, default=64, help="WS_QUEUE_SIZE for the local server")
+    parser.add_argument('--settle-s', type=float, default=0.5, help="Wait after connecting before publishing")
+    parser.add_argument('--drain-s', type=float, default=30.0, help="Longest wait for deliveries after each step")
+    parser.add_argument('--output', default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Memory, match latency and decision changes of the compact gallery storage
+# types (GALLERY_STORAGE) against the float32 baseline.
+#
+# Run from the Face_detector directory:
+#   python -m benchmarks.bench_quantize --sizes 1000 10000 100000 --json
+#   python -m benchmarks.bench_quantize --embeddings known_faces_embeddings.npy
+#
+# Each query is a noisy copy of an enrolled face. The noise varies across
+# queries, so their distances spread around the threshold, where rounding can
+# flip a decision. A known/unknown decision uses the same rule as app.py:
+# known when the closest distance is below --threshold. --distribution relu
+# draws non-negative vectors like VGG-Face's rectified outputs. --embeddings
+# matches against a real gallery instead, and --query-embeddings takes real
+# probe embeddings instead of noisy copies.
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+from benchmarks.common import summarize
+from benchmarks.fixtures import make_gallery
+from face_index import create_index
+from face_matcher import STORAGE_TYPES
+
+def make_relu_gallery(size, dim, rng):
+    gallery = np.maximum(rng.standard_normal((size, dim), dtype=np.float32), 0)
+    gallery /= np.maximum(np.linalg.norm(gallery, axis=1, keepdims=True), 1e-12)
+    return gallery
+
+def make_queries(gallery, count, noise_range, rng):
+    picks = rng.choice(len(gallery), count, replace=len(gallery) < count)
+    noise = rng.uniform(*noise_range, size=(count, 1)).astype(np.float32)
+    queries = gallery[picks] + noise * rng.standard_normal((count, gallery.shape[1]), dtype=np.float32) / np.sqrt(gallery.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def run_queries(index, queries):
+    labels, distances, latencies = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        match = index.match(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(match['label'])
+        distances.append(match['distance'])
+    return labels, np.asarray(distances), latencies
+
+# Largest allocation made by one query on top of the gallery itself
+def query_peak_bytes(index, query):
+    tracemalloc.start()
+    try:
+        index.match(query)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# How the decisions of `labels`/`distances` differ from the baseline's
+def decision_changes(baseline, labels, distances, threshold):
+    base_labels, base_distances = baseline
+    base_known = base_distances < threshold
+    known = distances < threshold
+    same_label = np.asarray([a == b for a, b in zip(labels, base_labels)])
+    error = np.abs(distances - base_distances)
+    return {
+        'known_to_unknown': int(np.sum(base_known & ~known)),
+        'unknown_to_known': int(np.sum(~base_known & known)),
+        'identity_changed': int(np.sum(base_known & known & ~same_label)),
+        'decisions_changed': int(np.sum((base_known != known) | (base_known & known & ~same_label))),
+        'near_threshold': int(np.sum(np.abs(base_distances - threshold) < 0.01)),
+        'distance_error_mean': round(float(error.mean()), 6),
+        'distance_error_max': round(float(error.max()), 6),
+    }
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    if args.embeddings:
+        galleries = [np.asarray(np.load(args.embeddings), dtype=np.float32)]
+    else:
+        make = make_relu_gallery if args.distribution == 'relu' else make_gallery
+        galleries = [make(size, args.dim, rng) for size in args.sizes]
+    probes = np.asarray(np.load(args.query_embeddings), dtype=np.float32) if args.query_embeddings else None
+
+    results = []
+    for gallery in galleries:
+        labels = [f"face_{i}" for i in range(len(gallery))]
+        queries = probes if probes is not None else make_queries(gallery, args.queries, args.noise, rng)
+        params = {'nlist': args.nlist} if args.index == 'ivf' else {}
+        baseline = None
+        for storage in ('float32',) + tuple(s for s in args.storage if s != 'float32'):
+            start = time.perf_counter()
+            index = create_index(args.index, labels, gallery, metric=args.metric, storage=storage, **params)
+            build_s = time.perf_counter() - start
+            found, distances, latencies = run_queries(index, queries)
+            if baseline is None:
+                baseline = (found, distances)
+                baseline_bytes = index.nbytes
+            summary = summarize(latencies)
+            results.append({
+                'size': len(gallery), 'storage': storage, 'index': args.index,
+                'gallery_mib': round(index.nbytes / 2**20, 2),
+                'bytes_per_face': round(index.nbytes / max(len(gallery), 1), 1),
+                'memory_ratio': round(index.nbytes / baseline_bytes, 3),
+                'query_peak_kib': round(query_peak_bytes(index, queries[0]) / 1024, 1),
+                'build_s': round(build_s, 3),
+                'matches_per_s': round(1000 / summary['mean_ms'], 1),
+                **summary,
+                **decision_changes(baseline, found, distances, args.threshold),
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark float16/int8 gallery storage against float32")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--dim', type=int, default=4096)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--storage', nargs='+', default=list(STORAGE_TYPES), choices=STORAGE_TYPES)
+    parser.add_argument('--index', default='exact', choices=['exact', 'ivf'])
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--metric', default='euclidean', choices=['euclidean', 'cosine'])
+    parser.add_argument('--threshold', type=float, default=0.6, help="MATCH_THRESHOLD the decisions are made at")
+    parser.add_argument('--noise', type=float, nargs=2, default=[0.3, 1.2], metavar=('LOW', 'HIGH'),
+                        help="Range of query noise relative to a unit vector; 0.7 lands near distance 0.6")
+    parser.add_argument('--distribution', default='gaussian', choices=['gaussian', 'relu'], help="Synthetic gallery vectors")
+    parser.add_argument('--embeddings', default=None, help="Real gallery (.npy, one embedding per row) instead of synthetic ones")
+    parser.add_argument('--query-embeddings', default=None, help="Real probe embeddings (.npy) instead of noisy copies")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'size':>8} {'storage':>8} {'MiB':>9} {'ratio':>6} {'p50 ms':>8} {'p99 ms':>8} {'match/s':>8} "
+          f"{'changed':>8} {'near':>5} {'max err':>9}")
+    for row in results:
+        print(f"{row['size']:>8} {row['storage']:>8} {row['gallery_mib']:>9.2f} {row['memory_ratio']:>6.3f} "
+              f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['matches_per_s']:>8.1f} "
+              f"{row['decisions_changed']:>8} {row['near_threshold']:>5} {row['distance_error_max']:>9.6f}")
+
+if __name__ == '__main__':
+    main()
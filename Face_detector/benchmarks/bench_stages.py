@@ -0,0 +1,93 @@
+# Micro-benchmarks of each /process_image stage in isolation: decode, frame
+# signature, detection, embedding (at several batch sizes) and gallery matching.
+#
+# Run from the Face_detector directory:
+#   python -m benchmarks.bench_stages --json
+#   python -m benchmarks.bench_stages --models real --fixtures known_faces --json
+#
+# With the default stand-in models no TensorFlow or model weights are needed.
+# --models real uses MTCNN and VGG-Face from face_pipeline; their weights must
+# already be in ~/.deepface for the run to stay offline.
+import argparse
+import json
+import numpy as np
+from benchmarks.common import summarize, time_calls
+from benchmarks.fixtures import make_gallery, make_images
+from benchmarks.stand_in_models import StandInModels
+from face_index import create_index
+from image_io import decode_grayscale_preview, decode_image
+from result_cache import frame_signature
+
+def load_models(kind, detect_ms, embed_ms):
+    if kind == 'real':
+        from face_pipeline import detect_faces, embed_faces
+        return detect_faces, embed_faces
+    models = StandInModels(detect_ms=detect_ms, embed_ms=embed_ms)
+    return models.detect_faces, models.embed_faces
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    images = make_images(args.images, rng, args.width, args.height, fixture_dir=args.fixtures)
+    blobs = [data for _, data, _ in images]
+    detect_faces, embed_faces = load_models(args.models, args.detect_ms, args.embed_ms)
+    results = []
+
+    def record(stage, latencies, **extra):
+        results.append({'stage': stage, **extra, **summarize(latencies)})
+
+    record('decode', time_calls(decode_image, blobs, args.repeat))
+    if args.max_side:
+        record('decode', time_calls(lambda data: decode_image(data, max_side=args.max_side), blobs, args.repeat), max_side=args.max_side)
+    record('hash', time_calls(lambda data: frame_signature(decode_grayscale_preview(data)), blobs, args.repeat))
+
+    decoded = [decode_image(data, max_side=args.max_side or None) for data in blobs]
+    record('detect', time_calls(detect_faces, decoded, args.repeat))
+
+    crops = [face['face'] for img in decoded for face in detect_faces(img)]
+    if crops:
+        for batch_size in args.batch_sizes:
+            batches = [[crops[(i + j) % len(crops)] for j in range(batch_size)] for i in range(0, len(crops), batch_size)]
+            latencies = time_calls(embed_faces, batches, args.repeat)
+            record('embed', latencies, batch_size=batch_size,
+                   per_face_ms=round(float(np.mean(latencies)) / batch_size, 4))
+        dim = embed_faces(crops[:1]).shape[1]
+    else:
+        dim = args.dim
+
+    queries = make_gallery(args.queries, dim, rng)
+    for size in args.gallery_sizes:
+        index = create_index('exact', [f"face_{i}" for i in range(size)], make_gallery(size, dim, rng), metric=args.metric)
+        record('match', time_calls(lambda query: index.match(query, top_k=5), list(queries), args.repeat), gallery_size=size)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /process_image stages in isolation")
+    parser.add_argument('--models', choices=['stand-in', 'real'], default='stand-in')
+    parser.add_argument('--detect-ms', type=float, default=0.0, help="Extra time per stand-in detection call")
+    parser.add_argument('--embed-ms', type=float, default=0.0, help="Extra time per stand-in embedding call")
+    parser.add_argument('--images', type=int, default=32, help="Synthetic frames to generate")
+    parser.add_argument('--fixtures', default=None, help="Directory of real photos to add to the inputs")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--max-side', type=int, default=0, help="Also time decoding with this MAX_IMAGE_SIDE")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=4096, help="Embedding size when no face crops are found")
+    parser.add_argument('--metric', default='euclidean', choices=['euclidean', 'cosine'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'stage':>8} {'params':>18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in results:
+        params = ' '.join(f"{key}={row[key]}" for key in ('batch_size', 'gallery_size', 'max_side') if key in row)
+        print(f"{row['stage']:>8} {params or '-':>18} {row['count']:>6} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+
+if __name__ == '__main__':
+    main()
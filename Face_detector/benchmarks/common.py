@@ -0,0 +1,29 @@
+import time
+import numpy as np
+
+# Latency summary (milliseconds) shared by the benchmark scripts
+def summarize(latencies_ms):
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    if latencies.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(latencies.size),
+        'mean_ms': round(float(latencies.mean()), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+        'max_ms': round(float(latencies.max()), 4),
+    }
+
+# Call fn(item) for every item `repeat` times after `warmup` untimed rounds and
+# return the per-call latencies in milliseconds
+def time_calls(fn, items, repeat=1, warmup=1):
+    for item in items[:warmup]:
+        fn(item)
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
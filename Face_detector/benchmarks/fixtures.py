@@ -0,0 +1,91 @@
+# Benchmark inputs: synthetic face / no-face JPEGs, fixture photos from disk
+# and synthetic galleries. Everything is generated locally from a seed, so runs
+# are reproducible and need no network access.
+import os
+import cv2
+import numpy as np
+
+# BGR skin tone of the synthetic faces; the stand-in detector looks for it
+SKIN_BGR = (120, 165, 225)
+
+# Dark, low-saturation background so only the drawn faces look like skin
+def background(rng, width, height):
+    base = rng.integers(20, 70, size=(height // 8 + 1, width // 8 + 1, 1), dtype=np.uint8)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_LINEAR)
+    img = cv2.merge([img, img, img])
+    noise = rng.integers(0, 12, size=img.shape, dtype=np.uint8)
+    return cv2.add(img, noise)
+
+def draw_face(img, rng, center, size):
+    cx, cy = center
+    w, h = size, int(size * 1.25)
+    cv2.ellipse(img, (cx, cy), (w // 2, h // 2), 0, 0, 360, SKIN_BGR, -1)
+    eye_dx, eye_y, eye_r = w // 5, cy - h // 8, max(2, w // 14)
+    cv2.circle(img, (cx - eye_dx, eye_y), eye_r, (40, 30, 30), -1)
+    cv2.circle(img, (cx + eye_dx, eye_y), eye_r, (40, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + h // 5), (w // 5, h // 14), 0, 0, 180, (60, 60, 150), max(1, w // 30))
+    # Hair and a coarse skin pattern that differ per face, so different faces
+    # get different embeddings while re-encodes of one frame still match
+    hair = int(rng.integers(-w // 4, w // 4 + 1))
+    cv2.ellipse(img, (cx + hair, cy - h // 3), (w // 3, h // 6), int(rng.integers(-30, 31)), 0, 360, (40, 50, 70), -1)
+    pattern = rng.integers(-35, 36, size=(4, 4)).astype(np.float32)
+    pattern = cv2.resize(pattern, (w // 2, h // 2), interpolation=cv2.INTER_LINEAR)
+    x0, y0 = cx - w // 4, cy - h // 8
+    region = img[y0:y0 + pattern.shape[0], x0:x0 + pattern.shape[1]]
+    mask = np.all(region == SKIN_BGR, axis=2)
+    shaded = np.clip(region.astype(np.float32) + pattern[:region.shape[0], :region.shape[1], None] * [0.4, 0.6, 0.2], 0, 255)
+    region[mask] = shaded[mask].astype(np.uint8)
+
+# JPEG bytes of a frame with `faces` drawn faces that do not overlap
+def synthetic_face_jpeg(rng, width=640, height=480, faces=1, quality=90):
+    img = background(rng, width, height)
+    slot = width // max(1, faces)
+    for i in range(faces):
+        size = int(rng.integers(max(40, slot // 4), max(41, min(slot, height) // 2)))
+        cx = i * slot + slot // 2 + int(rng.integers(-slot // 8, slot // 8 + 1))
+        cy = int(rng.integers(height // 3, 2 * height // 3))
+        draw_face(img, rng, (cx, cy), size)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+# JPEG bytes of a frame with shapes and texture but no skin-coloured regions
+def synthetic_scene_jpeg(rng, width=640, height=480, quality=90):
+    img = background(rng, width, height)
+    for _ in range(int(rng.integers(3, 8))):
+        x1, y1 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x2, y2 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        tone = int(rng.integers(40, 200))
+        color = (tone, tone, int(tone * 0.6)) if rng.random() < 0.5 else (tone, int(tone * 0.8), int(tone * 0.4))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, -1)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+# Encoded photos from a directory (e.g. known_faces/ or a folder of camera
+# frames), as (name, bytes) pairs. Needed to benchmark the real MTCNN and
+# VGG-Face models, which will not find faces in the synthetic drawings.
+def load_fixture_dir(path):
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(path, name), 'rb') as f:
+                fixtures.append((name, f.read()))
+    return fixtures
+
+# Mixed benchmark inputs as (name, jpeg_bytes, has_face) tuples: `count`
+# synthetic frames of which face_ratio contain faces, plus fixture photos
+# (assumed to contain faces) when fixture_dir is given
+def make_images(count, rng, width=640, height=480, face_ratio=0.7, max_faces=2, fixture_dir=None):
+    images = []
+    for i in range(count):
+        if rng.random() < face_ratio:
+            faces = int(rng.integers(1, max_faces + 1))
+            images.append((f"synthetic_face_{i}.jpg", synthetic_face_jpeg(rng, width, height, faces), True))
+        else:
+            images.append((f"synthetic_scene_{i}.jpg", synthetic_scene_jpeg(rng, width, height), False))
+    if fixture_dir:
+        images.extend((name, data, True) for name, data in load_fixture_dir(fixture_dir))
+    return images
+
+# Synthetic L2-normalised gallery (VGG-Face embeddings are normalised the same way)
+def make_gallery(size, dim, rng):
+    gallery = rng.standard_normal((size, dim), dtype=np.float32)
+    gallery /= np.maximum(np.linalg.norm(gallery, axis=1, keepdims=True), 1e-12)
+    return gallery
@@ -0,0 +1,121 @@
+# Local stand-ins for the ESP32 camera, the face server and the Telegram Bot
+# API, for exercising stream_capture and the upload queue without hardware, a
+# model server or network access. Failures and latency can be injected to see
+# retries and backoff at work. /mjpeg/<n> serves a multipart MJPEG stream of a
+# still scene that a face crosses every few seconds; /mjpeg/1 starts with the
+# face, other numbers at a random point.
+#
+#   python -m benchmarks.stand_in_endpoints --port 8099 --fail-rate 0.3 --delay-ms 200
+#   FACE_SERVER_URL=http://localhost:8099/process_image TELEGRAM_API_URL=http://localhost:8099 python stream_capture.py
+import argparse
+import random
+import threading
+import time
+import cv2
+import numpy as np
+from flask import Flask, Response, jsonify, request
+from benchmarks.fixtures import background, draw_face
+
+# Boundary used by the ESP32 camera examples
+MJPEG_BOUNDARY = '123456789000000000000987654321'
+
+# One period of JPEG frames of a still scene with a face crossing it during
+# the first `motion_s` seconds of every `period_s`
+def mjpeg_period(fps=15, width=640, height=480, period_s=10.0, motion_s=3.0, quality=80, seed=0):
+    rng = np.random.default_rng(seed)
+    scene = background(rng, width, height)
+    still = cv2.imencode('.jpg', scene, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+    frames = []
+    for frame_no in range(max(1, int(period_s * fps))):
+        phase = frame_no / fps
+        if phase >= motion_s:
+            frames.append(still)
+            continue
+        frame = scene.copy()
+        size = height // 3
+        cx = int(size + (width - 2 * size) * phase / motion_s)
+        draw_face(frame, np.random.default_rng(seed), (cx, height // 2), size)
+        frames.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return frames
+
+# Stream the frames at `fps`, looping; each stream starts at a random point
+# of the period so many clients do not see motion at the same moment
+def paced(frames, fps, offset=0):
+    started = time.monotonic()
+    frame_no = 0
+    while True:
+        yield frames[(offset + frame_no) % len(frames)]
+        frame_no += 1
+        time.sleep(max(0.0, started + frame_no / fps - time.monotonic()))
+
+def create_app(fail_rate=0.0, delay_ms=0.0, verdict='Unknown human', seed=0, stream_fps=15, stream_size=(640, 480)):
+    app = Flask(__name__)
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    received = {'process_image': 0, 'sendPhoto': 0, 'sendVideo': 0, 'failed': 0}
+
+    def simulate(kind):
+        if delay_ms:
+            time.sleep(delay_ms / 1000.0)
+        with lock:
+            if rng.random() < fail_rate:
+                received['failed'] += 1
+                return False
+            received[kind] += 1
+            return True
+
+    @app.route('/process_image', methods=['POST'])
+    def process_image():
+        if not simulate('process_image'):
+            return jsonify({'result': False, 'error': 'Server overloaded'}), 503, {'Retry-After': '1'}
+        size = len(request.get_data())
+        return jsonify({'result': verdict == 'Unknown human', 'message': verdict, 'bytes': size})
+
+    @app.route('/bot<token>/<method>', methods=['POST'])
+    def telegram(token, method):
+        if method not in ('sendPhoto', 'sendVideo'):
+            return jsonify({'ok': False, 'description': 'Not Found'}), 404
+        if not simulate(method):
+            return jsonify({'ok': False, 'description': 'Bad Gateway'}), 502
+        upload = request.files.get('photo' if method == 'sendPhoto' else 'video')
+        size = len(upload.read()) if upload else 0
+        return jsonify({'ok': True, 'result': {'caption': request.form.get('caption'), 'bytes': size}})
+
+    stream_frames = []
+
+    @app.route('/mjpeg/<int:camera>', methods=['GET'])
+    def mjpeg(camera):
+        with lock:
+            if not stream_frames:
+                stream_frames.extend(mjpeg_period(stream_fps, *stream_size, seed=seed))
+            offset = 0 if camera == 1 else rng.randrange(len(stream_frames))
+
+        def parts():
+            for jpeg in paced(stream_frames, stream_fps, offset):
+                yield (f"\r\n--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg
+        return Response(parts(), mimetype=f"multipart/x-mixed-replace;boundary={MJPEG_BOUNDARY}")
+
+    @app.route('/received', methods=['GET'])
+    def received_counts():
+        with lock:
+            return jsonify(received)
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-ins for the face server and Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Share of requests answered with a retryable error")
+    parser.add_argument('--delay-ms', type=float, default=0.0, help="Added latency per request")
+    parser.add_argument('--verdict', default='Unknown human', help="Message returned by /process_image")
+    parser.add_argument('--stream-fps', type=float, default=15, help="Frame rate of the /mjpeg streams")
+    parser.add_argument('--stream-width', type=int, default=640)
+    parser.add_argument('--stream-height', type=int, default=480)
+    args = parser.parse_args()
+    create_app(args.fail_rate, args.delay_ms, args.verdict, stream_fps=args.stream_fps,
+               stream_size=(args.stream_width, args.stream_height)).run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Cheap stand-ins for MTCNN and VGG-Face with the same call signatures as
+# face_pipeline.detect_faces / embed_faces. They find the skin-coloured faces
+# drawn by benchmarks.fixtures and embed them with a fixed random projection,
+# so the server's own overhead (decoding, queueing, batching, matching) can be
+# measured on machines without TensorFlow or the model weights. detect_ms and
+# embed_ms add a fixed sleep per call to stand in for model compute time.
+import time
+import cv2
+import numpy as np
+from benchmarks.fixtures import synthetic_face_jpeg
+
+EMBEDDING_DIM = 4096
+_CROP_SIDE = 24
+
+class StandInModels:
+    def __init__(self, detect_ms=0.0, embed_ms=0.0, dim=EMBEDDING_DIM, min_area=400, seed=0):
+        self.detect_s = detect_ms / 1000.0
+        self.embed_s = embed_ms / 1000.0
+        self.dim = dim
+        self.min_area = min_area
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((_CROP_SIDE * _CROP_SIDE, dim), dtype=np.float32)
+        # The drawn faces share most of their structure; embedding only the
+        # difference from the average face keeps different faces apart
+        samples = [face for _ in range(16) for face in self.detect_faces(self._decode(synthetic_face_jpeg(rng)), delay=False)]
+        self.mean_face = np.mean([self._features(face['face']) for face in samples], axis=0)
+
+    # Same output shape as DeepFace.extract_faces filtered by confidence:
+    # RGB crops in [0, 1] with their facial_area
+    def detect_faces(self, img, min_confidence=0.9, delay=True):
+        if self.detect_s and delay:
+            time.sleep(self.detect_s)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (0, 60, 150), (25, 200, 255))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        faces = []
+        for x, y, w, h, area in stats[1:count]:
+            if area < self.min_area:
+                continue
+            crop = img[y:y + h, x:x + w, ::-1].astype(np.float32) / 255.0
+            faces.append({
+                'face': crop,
+                'facial_area': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
+                'confidence': 0.99,
+            })
+        return faces
+
+    def embed_faces(self, faces):
+        if self.embed_s:
+            time.sleep(self.embed_s)
+        if not faces:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        rows = np.asarray([self._features(face) for face in faces], dtype=np.float32) - self.mean_face
+        embeddings = rows @ self.projection
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    @staticmethod
+    def _features(face):
+        gray = cv2.cvtColor(np.ascontiguousarray(face, dtype=np.float32), cv2.COLOR_RGB2GRAY)
+        small = cv2.resize(gray, (_CROP_SIDE, _CROP_SIDE), interpolation=cv2.INTER_AREA).ravel()
+        return small - small.mean()
+
+    @staticmethod
+    def _decode(data):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    # Point a freshly imported app module at the stand-ins
+    def install(self, app_module):
+        app_module.detect_faces = self.detect_faces
+        app_module.embed_faces = self.embed_faces
+        if app_module.embedding_batcher is not None:
+            app_module.embedding_batcher.batch_fn = self.embed_faces
+        app_module.WARMUP_MODELS = False
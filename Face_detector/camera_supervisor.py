@@ -0,0 +1,230 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from motion_pool import MotionPool
+from notifier import Notifier
+from stream_capture import CameraWatcher
+from upload_queue import UploadQueue
+
+logger = logging.getLogger(__name__)
+
+# Per-camera settings a config file may set, globally under "defaults" or per camera
+CAMERA_OPTIONS = ('record_time', 'min_area', 'preroll_s', 'screenshot_delay', 'regions', 'exclude', 'motion_method', 'reader',
+                  'clip_target_mb')
+
+# Gauges exported per camera at /metrics
+CAMERA_GAUGES = ('stream_fps', 'analysed_fps', 'lag_s', 'frame_age_s')
+CAMERA_COUNTERS = ('frames', 'skipped', 'motion_events', 'motion_errors', 'reconnects', 'restarts')
+
+# Camera list from a JSON file:
+#   {"defaults": {"min_area": 1500},
+#    "cameras": [{"name": "door", "url": "http://192.168.137.166/mjpeg/1", "exclude": [[[0, 0], [0.3, 0], [0.3, 0.2]]]}]}
+# Returns one dict per camera with the defaults applied.
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    defaults = config.get('defaults', {})
+    cameras, names = [], set()
+    for i, camera in enumerate(config.get('cameras', [])):
+        if 'url' not in camera:
+            raise ValueError(f"Camera {i} in {path} has no 'url'")
+        camera = dict(defaults, **camera)
+        camera.setdefault('name', f"camera{i}")
+        if camera['name'] in names:
+            raise ValueError(f"Duplicate camera name '{camera['name']}' in {path}")
+        unknown = set(camera) - set(CAMERA_OPTIONS) - {'name', 'url'}
+        if unknown:
+            raise ValueError(f"Unknown options for camera '{camera['name']}': {', '.join(sorted(unknown))}")
+        names.add(camera['name'])
+        cameras.append(camera)
+    if not cameras:
+        raise ValueError(f"No cameras configured in {path}")
+    return cameras
+
+
+# Runs many cameras headless in one process. Each camera gets a grabber thread
+# for its stream and a watcher thread for motion, screenshots and recording.
+# Motion detection of JPEG frames runs in a MotionPool shared by all cameras,
+# and alerts go through one UploadQueue. A camera that fails is restarted on
+# its own with exponential backoff; the others keep running.
+class CameraSupervisor:
+    def __init__(self, cameras, output_dir='recordings', motion_workers=None, upload_workers=4,
+                 restart_delay_s=1.0, max_restart_delay_s=60.0):
+        self.cameras = cameras
+        self.output_dir = output_dir
+        self.motion_workers = motion_workers if motion_workers is not None else max(1, (os.cpu_count() or 2) // 2)
+        self.upload_workers = upload_workers
+        self.restart_delay_s = restart_delay_s
+        self.max_restart_delay_s = max_restart_delay_s
+        self.motion_pool = None
+        self.uploads = None
+        self.watchers = {}
+        self.restarts = {camera['name']: 0 for camera in cameras}
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.motion_workers > 0:
+            self.motion_pool = MotionPool(self.motion_workers).start()
+        self.uploads = UploadQueue(workers=self.upload_workers, max_queue=8 * len(self.cameras)).start()
+        for camera in self.cameras:
+            thread = threading.Thread(target=self._supervise, args=(camera,), name=f"camera-{camera['name']}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Supervising {len(self.cameras)} cameras with {self.motion_workers} motion processes")
+        return self
+
+    def _watcher(self, camera):
+        name = camera['name']
+        options = {key: camera[key] for key in CAMERA_OPTIONS if key in camera}
+        return CameraWatcher(
+            camera['url'],
+            os.path.join(self.output_dir, f"{name}.avi"),
+            os.path.join(self.output_dir, f"{name}_screenshot.jpg"),
+            notifier=Notifier(self.uploads, camera=name),
+            name=name,
+            motion_pool=self.motion_pool,
+            open_timeout_s=None,
+            **options,
+        )
+
+    def _supervise(self, camera):
+        name = camera['name']
+        delay = self.restart_delay_s
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                watcher = self._watcher(camera)
+                with self._lock:
+                    self.watchers[name] = watcher
+                if self._stop.is_set():
+                    break
+                watcher.run()
+            except Exception as e:
+                logger.exception(f"Camera {name} failed: {str(e)}")
+            if self._stop.is_set():
+                break
+            # A watcher that ran for a while before failing starts over with a short delay
+            if time.monotonic() - started > self.max_restart_delay_s:
+                delay = self.restart_delay_s
+            self.restarts[name] += 1
+            logger.warning(f"Restarting camera {name} in {delay:.0f}s")
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.max_restart_delay_s)
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        with self._lock:
+            watchers = list(self.watchers.values())
+        for watcher in watchers:
+            watcher.stop()
+        for thread in self._threads:
+            thread.join(timeout=10)
+        if self.uploads is not None:
+            self.uploads.close(timeout=timeout)
+        if self.motion_pool is not None:
+            self.motion_pool.close()
+
+    def stats(self):
+        with self._lock:
+            watchers = dict(self.watchers)
+        cameras = {}
+        for camera in self.cameras:
+            name = camera['name']
+            watcher = watchers.get(name)
+            stats = watcher.stats() if watcher is not None else {'state': 'starting'}
+            stats['restarts'] = self.restarts[name]
+            cameras[name] = stats
+        uploads = self.uploads.stats() if self.uploads is not None else {}
+        motion = self.motion_pool.stats() if self.motion_pool is not None else {}
+        return {'cameras': cameras, 'uploads': {key: value for key, value in uploads.items() if key != 'latency'}, 'motion_pool': motion}
+
+    # Prometheus text format, labelled by camera
+    def prometheus(self, prefix='camera'):
+        stats = self.stats()
+        lines = []
+        for gauge in CAMERA_GAUGES:
+            lines.append(f"# TYPE {prefix}_{gauge} gauge")
+            for name, camera in stats['cameras'].items():
+                if camera.get(gauge) is not None:
+                    lines.append(f'{prefix}_{gauge}{{camera="{name}"}} {camera[gauge]}')
+        for counter in CAMERA_COUNTERS:
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            for name, camera in stats['cameras'].items():
+                lines.append(f'{prefix}_{counter}_total{{camera="{name}"}} {camera.get(counter, 0)}')
+        lines.append(f"# TYPE {prefix}_up gauge")
+        for name, camera in stats['cameras'].items():
+            up = 1 if camera['state'] in ('streaming', 'recording') else 0
+            lines.append(f'{prefix}_up{{camera="{name}"}} {up}')
+        for key, value in stats['uploads'].items():
+            lines.append(f"# TYPE upload_queue_{key} gauge")
+            lines.append(f"upload_queue_{key} {value}")
+        for key, value in stats['motion_pool'].items():
+            kind = 'counter' if key in ('restarts', 'timed_out') else 'gauge'
+            name = f"motion_pool_{key}_total" if kind == 'counter' else f"motion_pool_{key}"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    # Serve /metrics (Prometheus) and /cameras (JSON) on a background thread
+    def serve_metrics(self, port, host='0.0.0.0'):
+        supervisor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics'):
+                    body, content_type = supervisor.prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path.startswith('/cameras'):
+                    body, content_type = json.dumps(supervisor.stats()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        logger.info(f"Camera metrics at http://{host}:{port}/metrics")
+        return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch many cameras for motion in one process")
+    parser.add_argument('--config', default=os.getenv('CAMERAS_CONFIG', 'cameras.json'), help="JSON camera list")
+    parser.add_argument('--output-dir', default=os.getenv('RECORDINGS_DIR', 'recordings'))
+    parser.add_argument('--motion-workers', type=int, default=None,
+                        help="Motion detection processes (default: half the CPUs; 0 detects on the camera threads)")
+    parser.add_argument('--upload-workers', type=int, default=4)
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('CAMERA_METRICS_PORT', 0)) or None)
+    parser.add_argument('--log-interval', type=float, default=60, help="Seconds between camera summaries in the log")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    supervisor = CameraSupervisor(load_config(args.config), output_dir=args.output_dir,
+                                  motion_workers=args.motion_workers, upload_workers=args.upload_workers).start()
+    if args.metrics_port:
+        supervisor.serve_metrics(args.metrics_port)
+    try:
+        while True:
+            time.sleep(args.log_interval)
+            for name, camera in supervisor.stats()['cameras'].items():
+                logger.info(f"{name}: {camera['state']}, {camera.get('stream_fps', 0)} fps in, "
+                            f"{camera.get('analysed_fps', 0)} fps analysed, lag {camera.get('lag_s', 0)}s")
+    except KeyboardInterrupt:
+        logger.info("Stopping cameras...")
+    finally:
+        supervisor.stop()
+
+if __name__ == '__main__':
+    main()
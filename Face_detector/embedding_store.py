@@ -0,0 +1,395 @@
+import fcntl
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.png')
+
+# Removed rows and journal lines the store tolerates before compacting itself
+COMPACT_MIN_REMOVED = 64
+COMPACT_JOURNAL_LINES = 4096
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Runs in a pool worker: each worker loads DeepFace/VGG-Face once and reuses it
+def embed_file(path):
+    from deepface import DeepFace
+    try:
+        embedding = DeepFace.represent(img_path=path, model_name='VGG-Face', detector_backend='mtcnn', enforce_detection=True)[0]['embedding']
+        return path, np.asarray(embedding, dtype=np.float32), None
+    except Exception as e:
+        return path, None, str(e)
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Write rows into a float32 .npy file in place from row `start` on, then set
+# the row count in its header (np.save leaves room there for it to grow).
+# Returns False when the file cannot take the rows that way (another dtype or
+# width, or no room in the header) and has to be rewritten instead.
+def _append_npy(path, start, rows):
+    with open(path, 'r+b') as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            return False
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_offset = f.tell()
+        if dtype != np.float32 or fortran_order or len(shape) != 2 or shape[1] != rows.shape[1] or start > shape[0]:
+            return False
+        header = repr({'descr': '<f4', 'fortran_order': False, 'shape': (start + len(rows), shape[1])}).encode('latin1')
+        if len(header) + 1 > data_offset - 10:
+            return False
+        f.seek(data_offset + start * shape[1] * 4)
+        f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(10)
+        f.write(header.ljust(data_offset - 11) + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+# Known-face embeddings persisted as a float32 .npy matrix (memory-mapped on
+# load) plus a JSON manifest describing each row's source image by path, size,
+# mtime and SHA-1. sync() only embeds images that are new or whose content
+# changed, spreading that work across a process pool. Several processes (e.g.
+# gunicorn workers) can share the files: writers hold locked(), and readers
+# call changed_on_disk() to find out when another process wrote them.
+#
+# Single changes do not rewrite the files. upsert() appends its row to the
+# .npy in place, and both it and remove() append one line to a journal next to
+# the manifest; a replaced or removed row stays in the file, marked removed.
+# Once removed rows or journal lines pile up, save() compacts the store on a
+# background thread.
+class EmbeddingStore:
+    def __init__(self, vectors_path, manifest_path):
+        self.vectors_path = vectors_path
+        self.manifest_path = manifest_path
+        self.journal_path = f"{manifest_path}.journal"
+        self.entries = []
+        # Images that had no usable face, so unchanged ones are not retried on every sync
+        self.skipped = {}
+        # Identity of the manifest and journal this copy was loaded from or wrote
+        self.stamp = None
+        # Entry of every row of the vectors file; None for rows removed since the last compaction
+        self._rows = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._vectors = None
+        # Compactions start a new generation; journal lines of an older one are ignored
+        self._generation = None
+        self._journal_offset = 0
+        self._journal_lines = 0
+        self._lock = threading.RLock()
+        self._compactor = None
+
+    @property
+    def labels(self):
+        return [entry['path'] for entry in self.entries]
+
+    # Matrix of the live rows: the memory map itself while no row is marked
+    # removed, otherwise a copy made on first use after each change
+    @property
+    def vectors(self):
+        with self._lock:
+            if self._vectors is None:
+                live = [row for row, entry in enumerate(self._rows) if entry is not None]
+                self._vectors = self._matrix if len(live) == len(self._matrix) else np.asarray(self._matrix[live], dtype=np.float32)
+            return self._vectors
+
+    # Identifies the exact set of source images, so derived data (e.g. a saved
+    # index) can tell whether it is still current
+    @property
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(f"{entry['path']}\0{entry['sha1']}\n".encode())
+        return digest.hexdigest()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _set_rows(self, rows, matrix):
+        self._rows = rows
+        self._matrix = matrix
+        self._vectors = None
+        self.entries = [entry for entry in rows if entry is not None]
+
+    # Exclusive lock, across processes, on the store files. Hold it to write
+    # them, or to load them together with data derived from them.
+    @contextmanager
+    def locked(self):
+        with open(f"{self.manifest_path}.lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Compaction replaces the manifest and every other change grows the
+    # journal, so these tell whether another process wrote the store since
+    # this copy was loaded
+    def _disk_stamp(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        try:
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            journal_size = 0
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size, journal_size)
+
+    def changed_on_disk(self):
+        return self._disk_stamp() != self.stamp
+
+    # Load the store. When only the journal grew since the last load, only the
+    # new journal lines are read.
+    def load(self):
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.vectors_path)):
+            return False
+        with self._lock:
+            stamp = self._disk_stamp()
+            incremental = self.stamp is not None and stamp is not None and stamp[:3] == self.stamp[:3]
+            try:
+                if incremental:
+                    rows, skipped, generation = list(self._rows), dict(self.skipped), self._generation
+                    offset, lines = self._journal_offset, self._journal_lines
+                else:
+                    with open(self.manifest_path) as f:
+                        manifest = json.load(f)
+                    rows, skipped, generation = list(manifest['entries']), manifest.get('skipped', {}), manifest.get('generation')
+                    offset, lines = 0, 0
+                offset, lines = self._replay(rows, skipped, generation, offset, lines)
+                matrix = np.load(self.vectors_path, mmap_mode='r')
+                if matrix.shape[0] < len(rows):
+                    raise ValueError(f"manifest has {len(rows)} rows but vectors file has {matrix.shape[0]}")
+            except Exception as e:
+                logger.warning(f"Error loading embedding store: {str(e)}. Starting from scratch.")
+                self._set_rows([], np.zeros((0, 0), dtype=np.float32))
+                self.skipped = {}
+                return False
+            self._set_rows(rows, matrix[:len(rows)])
+            self.skipped, self._generation = skipped, generation
+            self._journal_offset, self._journal_lines = offset, lines
+            self.stamp = stamp
+        logger.info(f"Mapped {len(self.entries)} embeddings from {self.vectors_path}"
+                    f"{' (journal only)' if incremental else ''}")
+        return True
+
+    # Apply journal lines from byte `offset` on. A line cut short by a crash
+    # ends the replay; the next change overwrites it.
+    def _replay(self, rows, skipped, generation, offset, lines):
+        try:
+            journal = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return offset, lines
+        with journal:
+            journal.seek(offset)
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    break
+                change = json.loads(line)
+                offset += len(line)
+                lines += 1
+                if change.get('generation') != generation:
+                    # Left by a compaction that stopped before removing the journal
+                    continue
+                for row in change.get('remove', []):
+                    rows[row] = None
+                entry = change.get('append')
+                if entry is not None:
+                    if change['row'] != len(rows):
+                        raise ValueError(f"journal appends row {change['row']} to {len(rows)} rows")
+                    rows.append(entry)
+                    skipped.pop(entry['path'], None)
+        return offset, lines
+
+    def _log(self, change):
+        data = (json.dumps(dict(change, generation=self._generation)) + '\n').encode()
+        with open(self.journal_path, 'a+b') as f:
+            f.truncate(self._journal_offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset += len(data)
+        self._journal_lines += 1
+
+    def _require_current(self):
+        if self.changed_on_disk():
+            raise RuntimeError("Embedding store changed on disk; load() it under locked() before writing")
+
+    # Rewrite the vectors file and manifest with the live rows only, and start
+    # a new journal
+    def save(self):
+        with self._lock:
+            vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+            entries = list(self.entries)
+            generation = uuid.uuid4().hex
+            _write_atomic(self.vectors_path, lambda f: np.save(f, vectors))
+            _write_atomic(self.manifest_path, lambda f: f.write(json.dumps(
+                {'entries': entries, 'skipped': self.skipped, 'generation': generation}, indent=1).encode()))
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._generation, self._journal_offset, self._journal_lines = generation, 0, 0
+            # Re-map so the in-memory copy built during sync can be released
+            self._set_rows(entries, np.load(self.vectors_path, mmap_mode='r'))
+            self.stamp = self._disk_stamp()
+        logger.info(f"Saved {len(entries)} embeddings to {self.vectors_path}")
+
+    # Compact on a background thread once removed rows make up over a quarter
+    # of the file, or the journal is long enough to slow down loading
+    def _maybe_compact(self):
+        removed = len(self._rows) - len(self.entries)
+        if removed <= max(COMPACT_MIN_REMOVED, len(self._rows) // 4) and self._journal_lines <= COMPACT_JOURNAL_LINES:
+            return
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = threading.Thread(target=self.compact, name='embedding-compaction', daemon=True)
+            self._compactor.start()
+
+    def compact(self):
+        try:
+            with self.locked(), self._lock:
+                # Another process changed the store; it compacts when it needs to
+                if self.changed_on_disk():
+                    return
+                self.save()
+        except Exception as e:
+            logger.error(f"Compacting embedding store failed: {str(e)}")
+
+    # Bring the store in line with the images in image_dir. Returns True if
+    # anything changed. With in_process=False images are always embedded in
+    # spawned workers, so this process never imports TensorFlow.
+    def sync(self, image_dir, workers=None, in_process=True):
+        start = time.time()
+        current = {entry['path']: (entry, row) for row, entry in enumerate(self.entries)}
+        by_hash = {entry['sha1']: row for row, entry in enumerate(self.entries)}
+
+        kept, to_embed, skipped = [], [], {}
+        for name in sorted(os.listdir(image_dir)):
+            if not name.endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(image_dir, name)
+            stat = os.stat(path)
+            entry, row = current.get(path, (None, None))
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                kept.append((entry, row))
+                continue
+            failed = self.skipped.get(path)
+            if failed is not None and failed['size'] == stat.st_size and failed['mtime'] == stat.st_mtime:
+                skipped[path] = failed
+                continue
+            sha1 = file_sha1(path)
+            new_entry = {'path': path, 'sha1': sha1, 'size': stat.st_size, 'mtime': stat.st_mtime}
+            if sha1 in by_hash:
+                # Touched, copied or renamed without changing content: reuse the vector
+                kept.append((new_entry, by_hash[sha1]))
+            else:
+                to_embed.append(new_entry)
+
+        if not to_embed and [entry for entry, _ in kept] == self.entries and skipped == self.skipped:
+            logger.info(f"Embedding store up to date ({len(self.entries)} images)")
+            return False
+        seen = {entry['path'] for entry, _ in kept} | {entry['path'] for entry in to_embed} | set(skipped)
+        removed = sum(1 for path in current if path not in seen)
+
+        embedded = self._embed(to_embed, workers, in_process)
+        vectors = self.vectors
+        rows = [vectors[row] for _, row in kept] + [embedded[entry['path']] for entry in to_embed if entry['path'] in embedded]
+        entries = [entry for entry, _ in kept] + [entry for entry in to_embed if entry['path'] in embedded]
+        skipped.update({entry['path']: entry for entry in to_embed if entry['path'] not in embedded})
+        dim = rows[0].shape[0] if rows else vectors.shape[1]
+        with self._lock:
+            self.skipped = skipped
+            self._set_rows(entries, np.stack(rows).astype(np.float32) if rows else np.zeros((0, dim), dtype=np.float32))
+            self.save()
+        logger.info(f"Synced embedding store in {time.time() - start:.2f}s: {len(embedded)} embedded, "
+                    f"{len(to_embed) - len(embedded)} skipped, {removed} removed, {len(self.entries)} total")
+        return True
+
+    # Record the embedding of one image, replacing any existing row for that
+    # path: the row is appended to the vectors file and the old one marked
+    # removed, in a single journal line
+    def upsert(self, path, vector):
+        stat = os.stat(path)
+        entry = {'path': path, 'sha1': file_sha1(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            self._require_current()
+            replaced = [row for row, existing in enumerate(self._rows) if existing is not None and existing['path'] == path]
+            rows = list(self._rows)
+            for row in replaced:
+                rows[row] = None
+            row = len(rows)
+            rows.append(entry)
+            self.skipped.pop(path, None)
+            width = self._matrix.shape[1] if self._matrix.ndim == 2 and len(self._matrix) else vector.shape[0]
+            if self.stamp is None or width != vector.shape[0] or not _append_npy(self.vectors_path, row, vector[None, :]):
+                # Nothing on disk to append to yet, or a file np.save did not write
+                matrix = np.concatenate([np.asarray(self._matrix, dtype=np.float32).reshape(-1, width), vector[None, :]])
+                self._set_rows(rows, matrix)
+                self.save()
+                return
+            self._log({'remove': replaced, 'append': entry, 'row': row})
+            self._set_rows(rows, np.load(self.vectors_path, mmap_mode='r')[:len(rows)])
+            self.stamp = self._disk_stamp()
+            self._maybe_compact()
+
+    # Mark the rows of these paths removed; compaction drops them from the files
+    def remove(self, paths):
+        paths = set(paths)
+        with self._lock:
+            self._require_current()
+            removed = [row for row, entry in enumerate(self._rows) if entry is not None and entry['path'] in paths]
+            if not removed:
+                return
+            rows = list(self._rows)
+            for row in removed:
+                rows[row] = None
+            self._log({'remove': removed})
+            self._set_rows(rows, self._matrix)
+            self.stamp = self._disk_stamp()
+            self._maybe_compact()
+
+    def _embed(self, entries, workers, in_process=True):
+        if not entries:
+            return {}
+        paths = [entry['path'] for entry in entries]
+        workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+        logger.info(f"Embedding {len(paths)} new or changed images with {workers} worker(s)")
+
+        if workers == 1 and in_process:
+            results = map(embed_file, paths)
+            return self._collect(results)
+        # spawn, not fork: TensorFlow state must not be inherited by the workers
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return self._collect(pool.map(embed_file, paths))
+
+    def _collect(self, results):
+        embedded = {}
+        for path, embedding, error in results:
+            if error is not None:
+                logger.warning(f"Skipping {path}: {error}")
+                continue
+            embedded[path] = embedding
+            logger.info(f"Computed embedding for {path}")
+        return embedded
@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Fields of an event, in column order
+EVENT_FIELDS = ('ts', 'camera', 'verdict', 'identity', 'distance', 'faces', 'cached', 'latency_ms', 'stages')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera TEXT,
+    verdict TEXT NOT NULL,
+    identity TEXT,
+    distance REAL,
+    faces INTEGER NOT NULL DEFAULT 0,
+    cached INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL,
+    stages TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_verdict_ts ON events (verdict, ts);
+CREATE INDEX IF NOT EXISTS events_camera_ts ON events (camera, ts);
+"""
+
+PARTITION_PREFIX = 'events-'
+PARTITION_SUFFIX = '.db'
+
+# Partition (UTC day) a timestamp falls in
+def partition_of(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+def _partition_start(day):
+    return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+# Epoch seconds from epoch seconds or an ISO 8601 time (local time if it has
+# no offset); None stays None. Raises ValueError otherwise.
+def parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}', expected epoch seconds or ISO 8601")
+
+# Paging cursor of the event after which the next page starts
+def encode_cursor(event):
+    return f"{event['ts']!r}:{event['id']}"
+
+def decode_cursor(cursor):
+    ts, _, row_id = cursor.partition(':')
+    try:
+        return float(ts), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+# Detection events in SQLite, off the request path. record() only appends to
+# an in-memory queue; a writer thread inserts the queued events in one
+# transaction every flush_interval_s, or as soon as batch_size are waiting.
+# Events are partitioned by UTC day into separate WAL-mode database files,
+# so retention deletes whole files instead of rows. Each partition is indexed
+# on time, verdict and camera. query() pages through them newest first with
+# a keyset cursor.
+class EventStore:
+    def __init__(self, directory, retention_days=30, batch_size=256, flush_interval_s=1.0, max_queue=10000):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._connections = {}
+        self._pruned_at = 0.0
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{PARTITION_PREFIX}{day}{PARTITION_SUFFIX}")
+
+    def partitions(self):
+        names = os.listdir(self.directory)
+        return sorted(name[len(PARTITION_PREFIX):-len(PARTITION_SUFFIX)] for name in names
+                      if name.startswith(PARTITION_PREFIX) and name.endswith(PARTITION_SUFFIX))
+
+    # The writer thread is started on first use so the store survives a fork
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._connections = {}
+                self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+                self._thread.start()
+
+    # Queue one event; never blocks. Missing fields are stored as NULL, and
+    # stages (a dict of stage name to seconds) is stored as JSON milliseconds.
+    def record(self, **event):
+        self._ensure_started()
+        event.setdefault('ts', time.time())
+        event['faces'] = event.get('faces') or 0
+        event['cached'] = bool(event.get('cached'))
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                # The disk cannot keep up; keep the newest events
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(event)
+            self.recorded += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    # Wait until everything recorded so far is written
+    def flush(self, timeout=10.0):
+        with self._cond:
+            target = self.recorded
+            self._cond.notify()
+            return self._cond.wait_for(lambda: self.written + self.dropped >= target, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._queue) >= self.batch_size, timeout=self.flush_interval_s)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+            if batch:
+                try:
+                    self._write(batch)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not store {len(batch)} detection events: {str(e)}")
+                with self._cond:
+                    self.written += len(batch)
+                    self._cond.notify_all()
+            if time.time() - self._pruned_at > 3600:
+                self.prune()
+
+    def _write(self, batch):
+        rows = {}
+        for event in batch:
+            stages = event.get('stages')
+            if stages is not None:
+                stages = json.dumps({stage: round(seconds * 1000, 3) for stage, seconds in stages.items()})
+            row = tuple(event.get(field) for field in EVENT_FIELDS[:-1]) + (stages,)
+            rows.setdefault(partition_of(event['ts']), []).append(row)
+        for day, day_rows in rows.items():
+            connection = self._connections.get(day)
+            if connection is None:
+                connection = self._connections[day] = _connect(self._path(day))
+                connection.executescript(SCHEMA)
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO events ({', '.join(EVENT_FIELDS)}) VALUES ({', '.join('?' * len(EVENT_FIELDS))})", day_rows)
+        # Only the newest two days are still written to (events may straddle midnight)
+        for day in sorted(self._connections)[:-2]:
+            self._connections.pop(day).close()
+
+    # Delete partitions older than retention_days
+    def prune(self, now=None):
+        self._pruned_at = now = now or time.time()
+        if not self.retention_days:
+            return []
+        oldest = partition_of(now - self.retention_days * 86400)
+        removed = []
+        for day in self.partitions():
+            if day >= oldest:
+                break
+            connection = self._connections.pop(day, None)
+            if connection is not None:
+                connection.close()
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self._path(day) + suffix)
+                except FileNotFoundError:
+                    pass
+            removed.append(day)
+        if removed:
+            logger.info(f"Removed detection events of {', '.join(removed)}")
+        return removed
+
+    # Events matching the filters, newest first, as (events, next_cursor).
+    # since/until are epoch seconds; cursor is the next_cursor of the
+    # previous page. next_cursor is None on the last page.
+    def query(self, since=None, until=None, camera=None, verdict=None, identity=None, limit=100, cursor=None):
+        after = decode_cursor(cursor) if cursor else None
+        upper = after[0] if after else until
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts <= ?')
+            params.append(until)
+        if after is not None:
+            conditions.append('(ts < ? OR (ts = ? AND id < ?))')
+            params += [after[0], after[0], after[1]]
+        for column, value in (('camera', camera), ('verdict', verdict), ('identity', identity)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        sql = (f"SELECT id, {', '.join(EVENT_FIELDS)} FROM events"
+               f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY ts DESC, id DESC LIMIT ?")
+
+        events = []
+        for day in reversed(self.partitions()):
+            if upper is not None and _partition_start(day) > upper:
+                continue
+            if since is not None and _partition_start(day) + 86400 <= since:
+                break
+            connection = sqlite3.connect(self._path(day), timeout=5.0)
+            try:
+                connection.row_factory = sqlite3.Row
+                rows = connection.execute(sql, params + [limit + 1 - len(events)]).fetchall()
+            except sqlite3.OperationalError:
+                # Partition created but its table not yet
+                rows = []
+            finally:
+                connection.close()
+            for row in rows:
+                event = dict(row)
+                event['cached'] = bool(event['cached'])
+                event['stages'] = json.loads(event['stages']) if event['stages'] else None
+                events.append(event)
+            if len(events) > limit:
+                break
+        if len(events) > limit:
+            return events[:limit], encode_cursor(events[limit - 1])
+        return events, None
+
+    def stats(self):
+        with self._cond:
+            return {'recorded': self.recorded, 'written': self.written, 'dropped': self.dropped, 'queued': len(self._queue),
+                    'partitions': len(self.partitions())}
@@ -0,0 +1,186 @@
+import json
+import logging
+import numpy as np
+from face_matcher import FaceMatcher
+
+logger = logging.getLogger(__name__)
+
+INDEX_KINDS = ('exact', 'ivf')
+
+# Exact (brute force) index: every query scans the whole gallery matrix
+class ExactIndex(FaceMatcher):
+    kind = 'exact'
+    # Fingerprint of the data the index was built from, saved alongside it
+    source = None
+
+    def params(self):
+        return {}
+
+    def _arrays(self):
+        return {}
+
+    def save(self, path):
+        arrays = {
+            'labels': np.asarray([str(label) for label in self.labels], dtype=np.str_),
+            'matrix': self.matrix,
+            'scales': self.scales,
+            'norms': self.norms,
+            'meta': np.asarray(json.dumps({'kind': self.kind, 'metric': self.metric, 'storage': self.storage,
+                                           'params': self.params(), 'source': self.source})),
+        }
+        arrays.update(self._arrays())
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+        logger.info(f"Saved {self.kind} index with {len(self)} faces to {path}")
+
+    # Rebuild an index from saved arrays without re-normalising or re-training
+    @classmethod
+    def _restore(cls, data, metric, params, storage='float32'):
+        index = cls.__new__(cls)
+        index.metric = metric
+        index.storage = storage
+        # Indexes saved before compact storage have no scales
+        scales = data['scales'] if 'scales' in data else np.ones(len(data['norms']), dtype=np.float32)
+        index._set_rows(data['matrix'], scales, data['norms'], np.asarray(data['labels'].tolist(), dtype=object))
+        return index
+
+
+# Inverted-file index: rows are clustered around nlist spherical k-means
+# centroids and stored contiguously per cluster. A query only scores the rows of
+# the nprobe closest clusters, trading recall for latency. Rows added after
+# training sit in a tail past the last cluster that every query scans, until the
+# index is rebuilt. An index built from an empty gallery has no clusters: it
+# scans every row until the first enrollment trains it.
+class IVFIndex(ExactIndex):
+    kind = 'ivf'
+    # nlist as requested, before it was capped by the gallery size
+    requested_nlist = None
+
+    def __init__(self, labels, embeddings, metric='euclidean', storage='float32', nlist=None, nprobe=8, train_iters=10, seed=0):
+        super().__init__(labels, embeddings, metric=metric, storage=storage)
+        self.requested_nlist = nlist
+        self.nlist = self._nlist_for(len(self))
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self._train()
+
+    def _nlist_for(self, size):
+        return max(1, min(self.requested_nlist or int(4 * np.sqrt(max(size, 1))), max(size, 1)))
+
+    @property
+    def trained(self):
+        return self.centroids.size > 0
+
+    def params(self):
+        return {'nlist': self.nlist, 'nprobe': self.nprobe, 'train_iters': self.train_iters, 'seed': self.seed}
+
+    def _arrays(self):
+        return {'centroids': self.centroids, 'offsets': self.offsets}
+
+    @classmethod
+    def _restore(cls, data, metric, params, storage='float32'):
+        index = super()._restore(data, metric, params, storage)
+        index.nlist = params['nlist']
+        index.nprobe = params['nprobe']
+        index.train_iters = params['train_iters']
+        index.seed = params['seed']
+        index.centroids = np.ascontiguousarray(data['centroids'], dtype=np.float32)
+        index.offsets = np.asarray(data['offsets'], dtype=np.int64)
+        return index
+
+    def _train(self):
+        if len(self) == 0:
+            self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(self), 256 * self.nlist)
+        sample = self.decoded(rng.choice(len(self), sample_size, replace=False))
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(self.nlist):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+        # Reorder the gallery so each inverted list is one contiguous slice
+        assignment = self._assign(self.matrix)
+        order = np.argsort(assignment, kind='stable')
+        self._set_rows(self.matrix[order], self.scales[order], self.norms[order], self.labels[order])
+        counts = np.bincount(assignment, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    # Closest centroid of each row. int8 rows need no rescaling here: a row's
+    # scale does not change which centroid it is closest to.
+    def _assign(self, rows, chunk=1024):
+        return np.concatenate([
+            np.argmax(rows[start:start + chunk].astype(np.float32, copy=False) @ self.centroids.T, axis=1)
+            for start in range(0, len(rows), chunk)
+        ])
+
+    def _candidates(self, query, nprobe):
+        if not self.trained:
+            return np.arange(len(self))
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ query
+        probed = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        lists = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probed]
+        return np.concatenate(lists + [np.arange(self.offsets[-1], len(self))])
+
+    # The first rows added to an untrained index train it
+    def added(self, labels, embeddings):
+        index = super().added(labels, embeddings)
+        if not index.trained and len(index):
+            index.nlist = index._nlist_for(len(index))
+            index._train()
+            logger.info(f"Trained ivf index on its first {len(index)} faces ({index.nlist} clusters)")
+        return index
+
+    # Shift the cluster boundaries past the rows that were dropped
+    def _after_subset(self, keep):
+        removed_before = np.concatenate(([0], np.cumsum(~keep)))
+        self.offsets = self.offsets - removed_before[self.offsets]
+
+    def match(self, embedding, top_k=1, nprobe=None):
+        if len(self) == 0:
+            return None
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        query_norm = float(np.linalg.norm(query))
+        unit_query = query / query_norm if query_norm > 0 else query
+        rows = self._candidates(unit_query, nprobe or self.nprobe)
+        if len(rows) == 0:
+            return None
+
+        similarity = self.similarity(unit_query, rows)
+        if self.metric == 'cosine':
+            distances = 1.0 - similarity
+        else:
+            norms = self.norms[rows]
+            distances = np.sqrt(np.maximum(query_norm ** 2 + norms ** 2 - 2.0 * query_norm * norms * similarity, 0.0))
+
+        k = max(1, min(top_k, len(rows)))
+        best = np.argpartition(distances, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        best = best[np.argsort(distances[best], kind='stable')]
+        top = [(self.labels[rows[i]], float(distances[i])) for i in best]
+        return {'label': top[0][0], 'distance': top[0][1], 'top_k': top}
+
+
+INDEX_CLASSES = {'exact': ExactIndex, 'ivf': IVFIndex}
+
+def create_index(kind, labels, embeddings, metric='euclidean', **params):
+    if kind not in INDEX_CLASSES:
+        raise ValueError(f"Unsupported index '{kind}', expected one of {INDEX_KINDS}")
+    return INDEX_CLASSES[kind](labels, embeddings, metric=metric, **params)
+
+def load_index(path):
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        index = INDEX_CLASSES[meta['kind']]._restore(data, meta['metric'], meta['params'], meta.get('storage', 'float32'))
+        index.source = meta.get('source')
+    logger.info(f"Loaded {index.kind} index with {len(index)} faces from {path}")
+    return index
@@ -0,0 +1,190 @@
+import copy
+import numpy as np
+
+METRICS = ('cosine', 'euclidean')
+STORAGE_TYPES = ('float32', 'float16', 'int8')
+
+# Compact rows are widened to float32 this many at a time while scoring
+BLOCK_ROWS = 256
+
+# L2-normalise rows, returning the unit rows and the original norms
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1)
+    safe_norms = np.where(norms > 0, norms, 1.0)
+    return (matrix / safe_norms[:, None]).astype(np.float32), norms.astype(np.float32)
+
+# Unit rows in a storage type, returning the stored rows and per-row scales.
+# An int8 row is rounded with its largest component at 127 and scaled back to
+# unit length, so rounding changes its direction but not its norm. The other
+# types are stored as they are, with a scale of 1.
+def quantize_rows(unit_rows, storage):
+    if storage == 'int8':
+        peaks = np.max(np.abs(unit_rows), axis=1) if unit_rows.size else np.zeros(len(unit_rows), dtype=np.float32)
+        codes = np.rint(unit_rows * (127.0 / np.where(peaks > 0, peaks, 1.0))[:, None])
+        # A non-zero row has a code of 127, so its code norm is at least that
+        scales = (1.0 / np.maximum(np.linalg.norm(codes, axis=1), 1.0)).astype(np.float32)
+        return codes.astype(np.int8), scales
+    return unit_rows.astype(storage), np.ones(len(unit_rows), dtype=np.float32)
+
+# Known-face gallery held as one contiguous, L2-normalised float32 matrix with a
+# parallel label array. A query is scored against every row with a single
+# matrix-vector product; the original row norms are kept next to the matrix so
+# euclidean distances come out exactly as the old per-face loop computed them.
+#
+# With storage='float16' or 'int8' the matrix is kept in that type, at half or
+# a quarter of the memory. Queries score it directly, a block of rows at a
+# time, and norms stay float32.
+#
+# A matcher is never modified once built: added() and removed() return a new
+# matcher, so readers holding the old one keep a consistent gallery. Appends
+# write into spare capacity past the end of the old matcher's rows, which it
+# never reads, so they avoid copying the whole gallery.
+class FaceMatcher:
+    def __init__(self, labels, embeddings, metric='euclidean', storage='float32'):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric '{metric}', expected one of {METRICS}")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unsupported storage '{storage}', expected one of {STORAGE_TYPES}")
+        self.metric = metric
+        self.storage = storage
+        labels = np.asarray(list(labels), dtype=object)
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, matrix.shape[-1] if matrix.ndim == 2 else 0)
+        if matrix.ndim != 2 or matrix.shape[0] != len(labels):
+            raise ValueError(f"Expected {len(labels)} embeddings, got array of shape {matrix.shape}")
+
+        rows, norms = normalize_rows(matrix)
+        self._set_rows(*quantize_rows(rows, storage), norms, labels)
+
+    # Build from the {path: embedding} mapping produced by load_or_compute_embeddings
+    @classmethod
+    def from_dict(cls, embeddings, metric='euclidean', storage='float32'):
+        labels = list(embeddings.keys())
+        return cls(labels, [embeddings[label] for label in labels], metric=metric, storage=storage)
+
+    # Move the rows (already in the storage type) into fresh storage with room
+    # for `capacity` rows
+    def _set_rows(self, matrix, scales, norms, labels, capacity=None):
+        size = len(labels)
+        capacity = max(capacity or size, size)
+        self._matrix_buffer = np.empty((capacity, matrix.shape[1]), dtype=self.storage)
+        self._scales_buffer = np.empty(capacity, dtype=np.float32)
+        self._norms_buffer = np.empty(capacity, dtype=np.float32)
+        self._labels_buffer = np.empty(capacity, dtype=object)
+        self._matrix_buffer[:size] = matrix
+        self._scales_buffer[:size] = scales
+        self._norms_buffer[:size] = norms
+        self._labels_buffer[:size] = labels
+        # Shared by every matcher appending into these buffers: rows in use so far
+        self._filled = [size]
+        self._view(size)
+
+    def _view(self, size):
+        self.matrix = self._matrix_buffer[:size]
+        self.scales = self._scales_buffer[:size]
+        self.norms = self._norms_buffer[:size]
+        self.labels = self._labels_buffer[:size]
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    # Bytes held by the gallery rows, their scales and norms (labels excluded)
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.scales.nbytes + self.norms.nbytes
+
+    # New matcher with extra rows appended
+    def added(self, labels, embeddings):
+        labels = list(labels)
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(labels), -1)
+        rows, norms = normalize_rows(matrix)
+        rows, scales = quantize_rows(rows, self.storage)
+        size, extra = len(self), len(labels)
+
+        matcher = copy.copy(self)
+        if size == 0 and matrix.shape[1] != self.dim:
+            matcher._set_rows(rows[:0], scales[:0], norms[:0], [], capacity=max(2 * extra, 16))
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Embeddings have {matrix.shape[1]} dimensions, gallery has {self.dim}")
+        elif self._filled[0] != size or size + extra > len(self._matrix_buffer):
+            # Out of room, or another matcher already appended past our rows
+            matcher._set_rows(self.matrix, self.scales, self.norms, self.labels, capacity=max(2 * (size + extra), 16))
+
+        matcher._matrix_buffer[size:size + extra] = rows
+        matcher._scales_buffer[size:size + extra] = scales
+        matcher._norms_buffer[size:size + extra] = norms
+        matcher._labels_buffer[size:size + extra] = labels
+        matcher._filled[0] = size + extra
+        matcher._view(size + extra)
+        return matcher
+
+    # New matcher without the rows carrying any of the given labels
+    def removed(self, labels):
+        keep = ~np.isin(self.labels.astype(str), [str(label) for label in labels])
+        matcher = copy.copy(self)
+        matcher._set_rows(self.matrix[keep], self.scales[keep], self.norms[keep], self.labels[keep])
+        matcher._after_subset(keep)
+        return matcher
+
+    # Hook for subclasses that keep per-row structure alongside the matrix
+    def _after_subset(self, keep):
+        pass
+
+    # Rows (all by default) as float32 unit vectors
+    def decoded(self, rows=slice(None)):
+        matrix = self.matrix[rows].astype(np.float32)
+        if self.storage == 'int8':
+            matrix *= self.scales[rows][:, None]
+        return matrix
+
+    # Cosine similarity of a unit query to the given rows (all by default).
+    # float32 rows take one matrix-vector product. Compact rows are widened to
+    # float32 a block at a time, so no query holds a float32 copy of the
+    # whole gallery; int8 scores are then multiplied by their row's scale.
+    def similarity(self, query, rows=None):
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.storage == 'float32':
+            return matrix @ query
+        similarity = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            similarity[start:start + BLOCK_ROWS] = matrix[start:start + BLOCK_ROWS].astype(np.float32) @ query
+        if self.storage == 'int8':
+            similarity *= self.scales if rows is None else self.scales[rows]
+        return similarity
+
+    # Distance from the query to every known face, in row order
+    def distances(self, embedding):
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, gallery has {self.dim}")
+        query_norm = float(np.linalg.norm(query))
+        if query_norm > 0:
+            query = query / query_norm
+        similarity = self.similarity(query)
+
+        if self.metric == 'cosine':
+            return 1.0 - similarity
+        # |q - x|^2 = |q|^2 + |x|^2 - 2|q||x|cos(q, x)
+        squared = query_norm ** 2 + self.norms ** 2 - 2.0 * query_norm * self.norms * similarity
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    # Best match plus the top_k closest known faces as (label, distance) pairs.
+    # Returns None when the gallery is empty.
+    def match(self, embedding, top_k=1):
+        if len(self) == 0:
+            return None
+        distances = self.distances(embedding)
+        k = max(1, min(top_k, len(distances)))
+        if k < len(distances):
+            candidates = np.argpartition(distances, k - 1)[:k]
+        else:
+            candidates = np.arange(len(distances))
+        candidates = candidates[np.argsort(distances[candidates], kind='stable')]
+        top = [(self.labels[i], float(distances[i])) for i in candidates]
+        return {'label': top[0][0], 'distance': top[0][1], 'top_k': top}
@@ -0,0 +1,62 @@
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'VGG-Face'
+DETECTOR_BACKEND = 'mtcnn'
+MIN_FACE_CONFIDENCE = 0.9
+
+# DeepFace pulls in TensorFlow, so it is only imported when first needed
+def _deepface():
+    from deepface import DeepFace
+    return DeepFace
+
+# Run the detector once and keep the aligned crops of confident faces.
+# img may be a file path or a BGR numpy array.
+def detect_faces(img, min_confidence=MIN_FACE_CONFIDENCE):
+    faces = _deepface().extract_faces(img_path=img, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+    valid_faces = [face for face in faces if face['confidence'] > min_confidence]
+    logger.debug(f"Detected {len(faces)} faces, {len(valid_faces)} valid (confidence > {min_confidence})")
+    return valid_faces
+
+def get_model():
+    return _deepface().build_model(model_name=MODEL_NAME)
+
+# Same preprocessing DeepFace.represent applies to a detected face:
+# extract_faces returns RGB in [0, 1], the model expects a letterboxed BGR batch
+def preprocess_face(face, target_size):
+    from deepface.modules import preprocessing
+    img = face[:, :, ::-1]
+    img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization='base')
+
+# Embed already-detected face crops in one forward pass. Returns a float32
+# (n_faces, dim) array of L2-normalised embeddings, as DeepFace.represent does for VGG-Face.
+def embed_faces(faces):
+    model = get_model()
+    if not faces:
+        return np.zeros((0, model.output_shape), dtype=np.float32)
+    batch = np.concatenate([preprocess_face(face, model.input_shape) for face in faces])
+    embeddings = model.model(batch, training=False).numpy().astype(np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+# Public summary of a detected face, safe to return as JSON
+def face_region(face):
+    area = face['facial_area']
+    return {
+        'x': int(area['x']), 'y': int(area['y']), 'w': int(area['w']), 'h': int(area['h']),
+        'confidence': float(face['confidence']),
+    }
+
+# Load the detector and recognition weights and run one dummy inference through
+# each, so the first real request does not pay for graph building
+def warmup():
+    start = time.time()
+    get_model()
+    blank = np.zeros((224, 224, 3), dtype=np.uint8)
+    detect_faces(blank)
+    embed_faces([blank.astype(np.float32)])
+    logger.info(f"Models warmed up in {time.time() - start:.2f}s")
@@ -1,12 +1,21 @@
 from flask import Flask, request, jsonify, render_template_string
 from flask_sock import Sock
-import json
+import os
+from notification_hub import NotificationHub
+from notification_journal import NotificationJournal
 
 app = Flask(__name__)
 sock = Sock(app)
 
-# Store connected WebSocket clients
-connected_clients = []
+# Notifications are journaled so reconnecting clients get what they missed;
+# an empty NOTIFY_JOURNAL_DIR keeps no history
+JOURNAL_DIR = os.getenv('NOTIFY_JOURNAL_DIR', 'notification_journal')
+journal = NotificationJournal(JOURNAL_DIR, max_events=int(os.getenv('NOTIFY_JOURNAL_MAX_EVENTS', 100000))) if JOURNAL_DIR else None
+
+# Each WebSocket client has a bounded send queue; one with WS_QUEUE_SIZE
+# notifications still unsent is disconnected
+hub = NotificationHub(max_queue=int(os.getenv('WS_QUEUE_SIZE', 64)), send_timeout_s=float(os.getenv('WS_SEND_TIMEOUT_S', 10)),
+                      journal=journal, max_replay=int(os.getenv('WS_REPLAY_LIMIT', 1000)))
 
 # HTML for frontend
 html = """
@@ -24,24 +33,40 @@ html = """
     <h1>Security System Notifications</h1>
     <div id="notifications"></div>
     <script>
-        let ws = new WebSocket("ws://localhost:8000/ws");
-        
-        ws.onopen = () => console.log("Connected to WebSocket");
-        ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+        // Last notification shown, so a reconnect only asks for what was missed
+        let lastSeq = localStorage.getItem("lastSeq");
+
+        function show(data) {
             const div = document.createElement("div");
             div.className = "notification";
             div.textContent = `Motion detected at ${data.timestamp}, Face: ${data.face_result}`;
             document.getElementById("notifications").prepend(div);
-            alert(`New motion detected at ${data.timestamp}\nFace: ${data.face_result}`);
-        };
-        ws.onclose = () => {
-            console.log("WebSocket closed, reconnecting...");
-            setTimeout(() => {
-                ws = new WebSocket("ws://localhost:8000/ws");
-            }, 5000);
-        };
-        ws.onerror = (error) => console.error("WebSocket error:", error);
+            lastSeq = data.seq;
+            localStorage.setItem("lastSeq", lastSeq);
+        }
+
+        function connect() {
+            const ws = new WebSocket("ws://localhost:8000/ws" + (lastSeq ? `?since=${lastSeq}` : ""));
+
+            ws.onopen = () => console.log("Connected to WebSocket");
+            ws.onmessage = (event) => {
+                const data = JSON.parse(event.data);
+                if (Array.isArray(data)) {
+                    // Notifications sent while disconnected, oldest first
+                    data.forEach(show);
+                    alert(`${data.length} motion alerts while disconnected, latest at ${data[data.length - 1].timestamp}`);
+                    return;
+                }
+                show(data);
+                alert(`New motion detected at ${data.timestamp}\nFace: ${data.face_result}`);
+            };
+            ws.onclose = () => {
+                console.log("WebSocket closed, reconnecting...");
+                setTimeout(connect, 5000);
+            };
+            ws.onerror = (error) => console.error("WebSocket error:", error);
+        }
+        connect();
     </script>
 </body>
 </html>
@@ -53,12 +78,8 @@ def get():
 
 @sock.route("/ws")
 def websocket(ws):
-    connected_clients.append(ws)
-    try:
-        while True:
-            ws.receive()  # Keep connection alive
-    except Exception:
-        connected_clients.remove(ws)
+    # ?since=<seq> resumes after the last notification the client saw
+    hub.serve(ws, since=request.args.get("since", type=int))
 
 @app.route("/notify", methods=["POST"])
 def notify():
@@ -67,21 +88,15 @@ def notify():
         if not notification or "timestamp" not in notification or "face_result" not in notification:
             return jsonify({"error": "Invalid notification format"}), 400
         
-        # Broadcast to all connected clients
-        message = json.dumps(notification)
-        disconnected = []
-        for client in connected_clients:
-            try:
-                client.send(message)
-            except Exception:
-                disconnected.append(client)
-        # Remove disconnected clients
-        for client in disconnected:
-            connected_clients.remove(client)
-        
-        return jsonify({"status": "notification sent"}), 200
+        # Queue for every client; their connection threads do the sending
+        seq = hub.publish(notification)
+        return jsonify({"status": "notification sent", "seq": seq}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(hub.stats())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,215 @@
+import logging
+import math
+import threading
+import time
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fixed-size ring of preallocated frames. Every write gets the next sequence
+# number; slot seq % capacity holds it until the ring wraps around. Readers get
+# views into the slots, not copies, so a frame stays valid only until
+# `capacity` newer frames have been written (check with is_current()). With
+# shape=None the slots hold references to encoded frames (bytes) instead.
+class FrameRing:
+    def __init__(self, capacity, shape, dtype=np.uint8, start_seq=0):
+        self.capacity = max(2, capacity)
+        if shape is None:
+            self.shape = None
+            self.frames = [None] * self.capacity
+        else:
+            self.shape = tuple(shape)
+            self.frames = np.empty((self.capacity,) + self.shape, dtype=dtype)
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self.next_seq = start_seq
+        self._first_seq = start_seq
+        self._cond = threading.Condition()
+
+    # Slot the next frame will be written to; the writer fills it in place
+    def next_slot(self):
+        return self.frames[self.next_seq % self.capacity]
+
+    # Publish the frame written into next_slot()
+    def commit(self, timestamp):
+        with self._cond:
+            self.timestamps[self.next_seq % self.capacity] = timestamp
+            self.next_seq += 1
+            self._cond.notify_all()
+            return self.next_seq - 1
+
+    def write(self, frame, timestamp):
+        if self.shape is None:
+            self.frames[self.next_seq % self.capacity] = frame
+        else:
+            self.next_slot()[...] = frame
+        return self.commit(timestamp)
+
+    @property
+    def oldest_seq(self):
+        return max(self._first_seq, self.next_seq - self.capacity)
+
+    def is_current(self, seq):
+        return self.oldest_seq <= seq < self.next_seq
+
+    # (seq, timestamp, frame) or None if seq was never written or is overwritten
+    def get(self, seq):
+        if not self.is_current(seq):
+            return None
+        slot = seq % self.capacity
+        return seq, self.timestamps[slot], self.frames[slot]
+
+    def latest(self):
+        return self.get(self.next_seq - 1)
+
+    # First sequence number still in the ring with a timestamp >= since
+    def seq_at(self, since):
+        for seq in range(self.oldest_seq, self.next_seq):
+            if self.timestamps[seq % self.capacity] >= since:
+                return seq
+        return self.next_seq
+
+    # Block until a frame newer than after_seq is written; returns it or None on timeout
+    def wait_newer(self, after_seq, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.next_seq - 1 > after_seq, timeout=timeout):
+                return None
+        return self.latest()
+
+
+# Reads a cv2.VideoCapture on its own thread as fast as the stream delivers,
+# decoding straight into the slots of a FrameRing. Consumers never stall the
+# capture: slow motion analysis, uploads or recording only mean they skip to
+# the latest frame, and the ring keeps the last preroll_s seconds (plus
+# slack_s for consumers that fall behind) so clips can start before the motion
+# that triggered them. Reconnects with backoff when the stream drops.
+class FrameGrabber:
+    def __init__(self, stream_url, preroll_s=3.0, slack_s=5.0, fps_hint=25.0, reconnect_delay_s=1.0, max_reconnect_delay_s=30.0, name='grabber'):
+        self.stream_url = stream_url
+        self.preroll_s = preroll_s
+        self.slack_s = slack_s
+        self.fps_hint = fps_hint
+        self.reconnect_delay_s = reconnect_delay_s
+        self.max_reconnect_delay_s = max_reconnect_delay_s
+        self.name = name
+        self.ring = None
+        self.fps = 0.0
+        self.reconnects = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # Wait for the first frame; False if the stream could not be opened in time
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def latest(self):
+        return self.ring.latest() if self.ring is not None else None
+
+    def wait_newer(self, after_seq, timeout=None):
+        return self.ring.wait_newer(after_seq, timeout) if self.ring is not None else None
+
+    # Sequence number of the first buffered frame at or after `since` (time.time())
+    def seq_at(self, since):
+        return self.ring.seq_at(since)
+
+    def get(self, seq):
+        return self.ring.get(seq)
+
+    # (width, height) of the stream, once the first frame has been read
+    @property
+    def frame_size(self):
+        return (self.ring.shape[1], self.ring.shape[0]) if self.ring is not None else None
+
+    # Ring frames are already decoded BGR arrays
+    def decode(self, frame):
+        return frame
+
+    # Frame to run motion detection on, as (image, scale relative to the full frame)
+    def preview(self, frame, width):
+        return frame, 1.0
+
+    # JPEG bytes of a frame, e.g. to upload it
+    def encode_jpeg(self, frame):
+        ok, buf = cv2.imencode('.jpg', frame)
+        return buf.tobytes() if ok else None
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.stream_url)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        # Keep the driver-side queue short: this thread is the buffer
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _allocate(self, frame, fps):
+        capacity = int(math.ceil((self.preroll_s + self.slack_s) * fps)) + 2
+        if self.ring is None or self.ring.shape != frame.shape:
+            logger.info(f"{self.name}: buffering {capacity} frames of {frame.shape[1]}x{frame.shape[0]} "
+                        f"({capacity * frame.nbytes / 2**20:.0f} MB)")
+            # Sequence numbers continue across a reallocation
+            self.ring = FrameRing(capacity, frame.shape, frame.dtype, start_seq=self.ring.next_seq if self.ring else 0)
+
+    def _run(self):
+        delay = self.reconnect_delay_s
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                logger.warning(f"{self.name}: failed to open stream {self.stream_url}, retrying in {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay_s)
+                continue
+            try:
+                if self._capture(cap):
+                    delay = self.reconnect_delay_s
+            finally:
+                cap.release()
+            if not self._stop.is_set():
+                self.reconnects += 1
+                logger.warning(f"{self.name}: stream lost, reconnecting in {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay_s)
+
+    # Read until the stream fails or stop() is called; True if any frame was read
+    def _capture(self, cap):
+        ret, frame = cap.read()
+        if not ret:
+            return False
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self._allocate(frame, fps if 1 <= fps <= 120 else self.fps_hint)
+        self.ring.write(frame, time.time())
+        self._ready.set()
+        last = time.monotonic()
+        while not self._stop.is_set():
+            if not cap.grab():
+                return True
+            slot = self.ring.next_slot()
+            ret, frame = cap.retrieve(slot)
+            if not ret:
+                return True
+            if frame.ctypes.data != slot.ctypes.data:
+                if frame.shape != self.ring.shape:
+                    # Resolution changed mid-stream
+                    self._allocate(frame, self.fps or self.fps_hint)
+                    slot = self.ring.next_slot()
+                slot[...] = frame
+            self.ring.commit(time.time())
+            now = time.monotonic()
+            self.fps = 0.9 * self.fps + 0.1 / max(now - last, 1e-6) if self.fps else 1.0 / max(now - last, 1e-6)
+            last = now
+        return True
@@ -0,0 +1,11 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+# Each worker keeps its own copy of the gallery; enrollments take a file lock on
+# the embedding store and the other workers reload it on their next request
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+# Threads let concurrent requests in one worker share micro-batched forward passes
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Load and warm the models once in the master; workers inherit them copy-on-write
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+timeout = 120
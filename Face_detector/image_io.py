@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+# imdecode flags that let libjpeg scale the image down while decoding
+REDUCED_COLOR_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Start-of-frame markers carry the image size; DHT (C4), JPG (C8) and DAC (CC) share the range
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+# imdecode flags for cheap grayscale previews (hashing, motion analysis)
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Read (width, height) from a JPEG header without decoding it. Returns None for
+# anything that is not a well-formed JPEG.
+def jpeg_size(data):
+    buf = memoryview(data)
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    i = 2
+    while i + 3 < len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            if i + 8 >= len(buf):
+                return None
+            height = (buf[i + 5] << 8) | buf[i + 6]
+            width = (buf[i + 7] << 8) | buf[i + 8]
+            return width, height
+        i += 2 + ((buf[i + 2] << 8) | buf[i + 3])
+    return None
+
+# Largest libjpeg reduction (1, 2, 4 or 8) that keeps the longest side >= max_side
+def reduction_factor(size, max_side):
+    longest = max(size)
+    factor = 1
+    for candidate in (2, 4, 8):
+        if longest / candidate >= max_side:
+            factor = candidate
+    return factor
+
+# Decode an encoded image straight from memory into a BGR array. The request
+# bytes are wrapped, not copied. When max_side is set, oversized JPEGs are
+# reduced by libjpeg while decoding and anything still too large is resized.
+# Returns None if the data cannot be decoded.
+def decode_image(data, max_side=None):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+
+    flag = cv2.IMREAD_COLOR
+    if max_side:
+        size = jpeg_size(buf)
+        if size is not None:
+            flag = REDUCED_COLOR_FLAGS.get(reduction_factor(size, max_side), cv2.IMREAD_COLOR)
+
+    img = cv2.imdecode(buf, flag)
+    if img is None:
+        return None
+
+    if max_side and max(img.shape[:2]) > max_side:
+        scale = max_side / max(img.shape[:2])
+        img = cv2.resize(img, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    return img
+
+# Small grayscale version of an encoded image. JPEGs are reduced by libjpeg
+# while decoding (1/8 by default), so this is far cheaper than a full decode.
+def decode_grayscale_preview(data, reduction=8):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    flag = REDUCED_GRAYSCALE_FLAGS[reduction] if jpeg_size(buf) is not None else cv2.IMREAD_GRAYSCALE
+    return cv2.imdecode(buf, flag)
+
+# File extension matching the encoded image format, or None if unrecognised
+def encoded_extension(data):
+    head = bytes(memoryview(data)[:8])
+    if head.startswith(b'\xff\xd8'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    return None
+
+# Split a body of length-prefixed images (4-byte big-endian length, then the
+# encoded bytes, repeated) into zero-copy memoryview slices.
+def split_length_prefixed(data):
+    buf = memoryview(data)
+    images = []
+    i = 0
+    while i < len(buf):
+        if i + 4 > len(buf):
+            raise ValueError("Truncated length prefix")
+        length = int.from_bytes(buf[i:i + 4], 'big')
+        i += 4
+        if i + length > len(buf):
+            raise ValueError(f"Image {len(images)} declares {length} bytes but only {len(buf) - i} remain")
+        images.append(buf[i:i + length])
+        i += length
+    return images
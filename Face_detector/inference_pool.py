@@ -0,0 +1,104 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+# Raised at admission when the pool is too busy; retry_after is in seconds
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Inference pool overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# Fixed pool of inference threads with admission control. New work is rejected
+# straight away when the queue is full or the expected wait (queued work times
+# the recent average service time) is over max_wait_s. A caller stops waiting
+# at its deadline. Work that has not started yet is cancelled; a call already
+# running keeps its thread until it returns, and still counts against
+# admission until then.
+class InferencePool:
+    def __init__(self, workers=2, max_queue=8, max_wait_s=5.0, name='inference'):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_s = max_wait_s
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._service_avg = None
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    # Created on first use so a pool built before a gunicorn fork has no threads yet
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def expected_wait(self, pending=None):
+        pending = self._pending if pending is None else pending
+        queued = max(0, pending - self.workers + 1)
+        return queued / self.workers * (self._service_avg or 0.0)
+
+    def submit(self, fn, *args):
+        executor = self._get_executor()
+        with self._lock:
+            wait = self.expected_wait()
+            if self._pending >= self.workers + self.max_queue or wait > self.max_wait_s:
+                self.rejected += 1
+                raise Overloaded(retry_after=max(1, math.ceil(wait or self._service_avg or 1)))
+            self._pending += 1
+        future = executor.submit(self._timed, fn, args)
+        future.add_done_callback(self._done)
+        return future
+
+    # Submit and wait until the deadline (a time.monotonic() timestamp)
+    def run(self, fn, *args, deadline):
+        future = self.submit(fn, *args)
+        return self.wait(future, deadline)
+
+    def wait(self, future, deadline):
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise DeadlineExceeded(f"{self.name} call missed its deadline")
+
+    def _timed(self, fn, args):
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._service_avg = elapsed if self._service_avg is None else 0.8 * self._service_avg + 0.2 * elapsed
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'expected_wait_s': round(self.expected_wait(), 3),
+                'avg_service_s': round(self._service_avg or 0.0, 3),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
@@ -0,0 +1,397 @@
+import atexit
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import select
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import process as mp_process, shared_memory
+from multiprocessing.connection import wait as wait_for_exit
+import numpy as np
+from inference_pool import DeadlineExceeded, Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Largest result message. Results only carry face regions and timings; frames
+# and embeddings stay in shared memory.
+MAX_RESULT_BYTES = 1 << 20
+
+# How long submit() waits for a free slot before rejecting the frame
+ADMIT_WAIT_S = 0.05
+
+# A datagram socket pair buffers about 160 small messages by default, and
+# every slot can have a message queued at once
+MAX_SLOTS = 128
+
+# Room for the task an inference process is working on (id, reply address,
+# slot and segment as JSON), kept in shared memory for the monitor
+TASK_BYTES = 512
+
+def _set_current(current, index, task=None):
+    data = json.dumps(task).encode() if task is not None else b''
+    current[index * TASK_BYTES:(index + 1) * TASK_BYTES] = data.ljust(TASK_BYTES, b'\0')
+
+def _get_current(current, index):
+    data = bytes(current[index * TASK_BYTES:(index + 1) * TASK_BYTES]).rstrip(b'\0')
+    return json.loads(data) if data else None
+
+# Detection or embedding failed in an inference process; stage says which, or
+# is 'process' when the inference process died while handling the frame
+class InferenceError(Exception):
+    def __init__(self, message, stage):
+        super().__init__(message)
+        self.stage = stage
+
+
+# Queue of small JSON messages between processes, on a Unix datagram socket
+# pair. Each message is one datagram, so put() and get() need no lock, and a
+# process killed while waiting in get() cannot leave the queue locked the way
+# a multiprocessing.Queue would be.
+class DatagramQueue:
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def put(self, message):
+        self._writer.send(json.dumps(message).encode())
+
+    # Next message; raises queue.Empty after `timeout` seconds (None waits for ever)
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self._reader], [], [], remaining)[0]:
+                raise queue.Empty
+            try:
+                return json.loads(self._reader.recv(MAX_RESULT_BYTES, socket.MSG_DONTWAIT))
+            except BlockingIOError:
+                # Another process took it first
+                continue
+
+
+# Detection and embedding of one frame, run in an inference process. The frame
+# is read from `buffer`; the embeddings are written back over it.
+def _analyse(buffer, task, models):
+    detect_faces, embed_faces, detect_in_crops = models
+    img = np.ndarray(task['shape'], dtype=np.uint8, buffer=buffer)
+    start = time.perf_counter()
+    try:
+        faces = detect_in_crops(detect_faces, img, task['boxes']) if task['boxes'] else detect_faces(img)
+    except Exception as e:
+        return {'error': str(e), 'stage': 'detection'}
+    detected = time.perf_counter()
+    try:
+        embeddings = embed_faces([face['face'] for face in faces]) if faces else np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.nbytes > len(buffer):
+            raise ValueError(f"{len(faces)} embeddings do not fit in the frame buffer")
+    except Exception as e:
+        return {'error': str(e), 'stage': 'embedding'}
+    # The crops are copies, so the frame is no longer needed
+    np.ndarray(embeddings.shape, dtype=np.float32, buffer=buffer)[...] = embeddings
+    return {
+        'faces': [{'facial_area': {key: int(face['facial_area'][key]) for key in ('x', 'y', 'w', 'h')},
+                   'confidence': float(face['confidence'])} for face in faces],
+        'dim': int(embeddings.shape[1]),
+        'detection_s': detected - start,
+        'embedding_s': time.perf_counter() - detected,
+    }
+
+# Main loop of an inference process: load the models once, then analyse
+# frames from the shared task queue until it yields None. The task in hand is
+# published in `current`, so the monitor can answer it if this process dies.
+def _serve(index, tasks, free_slots, current, ready, slot_names, warm):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        from face_pipeline import detect_faces, embed_faces, warmup
+        from region_hints import detect_in_crops
+        if warm:
+            warmup()
+    except Exception as e:
+        ready.put((index, str(e)))
+        return
+    models = (detect_faces, embed_faces, detect_in_crops)
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    replies = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    ready.put((index, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        _set_current(current, index, {key: task[key] for key in ('id', 'reply_to', 'slot', 'segment')})
+        segment = shared_memory.SharedMemory(name=task['segment']) if task['segment'] else None
+        try:
+            if time.time() > task['expires']:
+                # The caller has already given up
+                result = {'expired': True}
+            else:
+                result = _analyse((segment or slots[task['slot']]).buf, task, models)
+        finally:
+            if segment is not None:
+                segment.close()
+        result.update(id=task['id'], slot=task['slot'], segment=task['segment'])
+        try:
+            replies.sendto(json.dumps(result).encode(), task['reply_to'])
+        except OSError as e:
+            # The front end is gone; nobody else will hand its slot back
+            logger.warning(f"Could not return result to {task['reply_to']}: {str(e)}")
+            free_slots.put(task['slot'])
+        _set_current(current, index)
+
+
+# Fixed pool of model processes shared by every HTTP process. Each process
+# loads TensorFlow and the model weights once. The HTTP processes only decode,
+# match and respond. A frame is handed over through one of a fixed set of
+# shared-memory slots: the caller copies the decoded image into a free slot
+# and queues a small task. The inference process detects and embeds in place,
+# writes the embeddings back into the slot and returns face regions and
+# timings as a JSON datagram on the caller's reply socket. Nothing large is
+# pickled either way.
+#
+# Slots double as admission control: with none free, new work is rejected with
+# Overloaded, like InferencePool with a full queue. Frames larger than a slot
+# get a shared-memory segment of their own.
+#
+# start() runs once, e.g. in the gunicorn master with preload_app. Forked HTTP
+# workers inherit the queues and slots; each opens its own reply socket on
+# first use. The process that started the pool restarts inference processes
+# that die. Exits are noticed through each process's sentinel, because the
+# gunicorn arbiter reaps any child of the master, so is_alive() would not see
+# them.
+class InferenceProcessPool:
+    def __init__(self, processes=2, slots=None, slot_bytes=8 << 20, warm=True, start_timeout_s=600.0):
+        self.processes = max(1, processes)
+        self.slot_count = min(max(self.processes, slots or 2 * self.processes), MAX_SLOTS)
+        self.slot_bytes = slot_bytes
+        self.warm = warm
+        self.start_timeout_s = start_timeout_s
+        self._owner = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._receiver_pid = None
+        self._service_avg = None
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.oversized = 0
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_serve, name=f'inference-{index}', daemon=True,
+            args=(index, self._tasks, self._free, self._current, self._ready, [slot.name for slot in self._slots], self.warm))
+        process.start()
+        return process
+
+    # Start the inference processes and wait until each has loaded its models
+    def start(self):
+        # spawn, not fork: TensorFlow state must not be inherited
+        self._context = multiprocessing.get_context('spawn')
+        self._owner = os.getpid()
+        self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.slot_count)]
+        self._tasks = DatagramQueue()
+        self._free = DatagramQueue()
+        for slot in range(self.slot_count):
+            self._free.put(slot)
+        self._current = self._context.Array('c', self.processes * TASK_BYTES, lock=False)
+        self._ready = self._context.Queue()
+        self._reply_dir = tempfile.mkdtemp(prefix='inference-')
+        atexit.register(self.close)
+
+        self._workers = [self._spawn(index) for index in range(self.processes)]
+        os.register_at_fork(after_in_child=self._after_fork)
+        deadline = time.monotonic() + self.start_timeout_s
+        started = 0
+        while started < self.processes:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Inference processes did not start within {self.start_timeout_s}s")
+            try:
+                index, error = self._ready.get(timeout=1.0)
+            except queue.Empty:
+                exited = [process for process in self._workers if wait_for_exit([process.sentinel], timeout=0)]
+                if exited:
+                    raise RuntimeError(f"Inference process {exited[0].name} exited during startup")
+                continue
+            if error is not None:
+                raise RuntimeError(f"Inference process {index} failed to start: {error}")
+            started += 1
+        logger.info(f"Started {self.processes} inference processes with {self.slot_count} frame slots "
+                    f"of {self.slot_bytes / 2**20:.1f} MiB")
+        threading.Thread(target=self._monitor, name='inference-monitor', daemon=True).start()
+
+    # A forked HTTP worker must not treat the inference processes as its own
+    # children: at exit multiprocessing would terminate them
+    def _after_fork(self):
+        if self._owner != os.getpid():
+            mp_process._children.difference_update(self._workers)
+
+    # Restart inference processes that died. The frame a dead process was
+    # working on is answered with an error on its caller's reply socket, which
+    # fails the caller's future and hands the slot back there.
+    def _monitor(self):
+        replies = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        while self._workers:
+            sentinels = {process.sentinel: index for index, process in enumerate(self._workers)}
+            for sentinel in wait_for_exit(list(sentinels), timeout=1.0):
+                if not self._workers:
+                    return
+                index = sentinels[sentinel]
+                self._workers[index].join(timeout=0.1)
+                exitcode = self._workers[index].exitcode
+                logger.error(f"Inference process {index} exited with code {exitcode}, restarting it")
+                try:
+                    task = _get_current(self._current, index)
+                except ValueError:
+                    # Died while publishing its task; that slot is lost until restart
+                    logger.error(f"Inference process {index} left an unreadable task behind")
+                    task = None
+                _set_current(self._current, index)
+                if task is not None:
+                    error = dict(task, error=f"Inference process exited with code {exitcode}", stage='process')
+                    try:
+                        replies.sendto(json.dumps(error).encode(), task['reply_to'])
+                    except OSError:
+                        # The caller is gone too
+                        self._free.put(task['slot'])
+                self._workers[index] = self._spawn(index)
+
+    # Each HTTP process receives its results on its own socket, opened after
+    # the fork
+    def _ensure_receiver(self):
+        if self._receiver_pid == os.getpid():
+            return
+        with self._lock:
+            if self._receiver_pid == os.getpid():
+                return
+            self._futures = {}
+            self._reply_address = os.path.join(self._reply_dir, f'{os.getpid()}.sock')
+            if os.path.exists(self._reply_address):
+                os.remove(self._reply_address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self._reply_address)
+            threading.Thread(target=self._receive, args=(sock,), name='inference-results', daemon=True).start()
+            self._receiver_pid = os.getpid()
+
+    # Queue one decoded BGR frame for detection (within `boxes` if given) and
+    # embedding. The future's result has 'faces' (regions and confidences, as
+    # detect_faces returns them minus the crops), 'embeddings', 'detection_s'
+    # and 'embedding_s'.
+    def submit(self, img, boxes=None, deadline=None):
+        self._ensure_receiver()
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        try:
+            slot = self._free.get(timeout=ADMIT_WAIT_S)
+        except queue.Empty:
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(retry_after=max(1, math.ceil(self._service_avg or 1)))
+
+        segment = None
+        try:
+            if img.nbytes > self.slot_bytes:
+                segment = shared_memory.SharedMemory(create=True, size=img.nbytes)
+                with self._lock:
+                    self.oversized += 1
+            buffer = (segment or self._slots[slot]).buf
+            np.ndarray(img.shape, dtype=np.uint8, buffer=buffer)[...] = img
+        except Exception:
+            self._free.put(slot)
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            raise
+
+        task_id = uuid.uuid4().hex
+        remaining = None if deadline is None else deadline - time.monotonic()
+        future = Future()
+        with self._lock:
+            self._futures[task_id] = (future, segment, time.monotonic())
+        self._tasks.put({
+            'id': task_id, 'reply_to': self._reply_address, 'slot': slot, 'segment': segment.name if segment else None,
+            'shape': img.shape, 'boxes': [tuple(int(v) for v in box) for box in boxes] if boxes else None,
+            'expires': time.time() + (remaining if remaining is not None else 3600.0),
+        })
+        return future
+
+    # Submit and wait until the deadline (a time.monotonic() timestamp)
+    def run(self, img, boxes=None, deadline=None):
+        return self.wait(self.submit(img, boxes, deadline), deadline)
+
+    def wait(self, future, deadline):
+        try:
+            return future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            # The task cannot be recalled; its inference process skips it once it expires
+            with self._lock:
+                self.timed_out += 1
+            raise DeadlineExceeded("inference process call missed its deadline")
+
+    def _receive(self, sock):
+        while True:
+            result = json.loads(sock.recv(MAX_RESULT_BYTES))
+            with self._lock:
+                entry = self._futures.pop(result['id'], None)
+            # Only a task still outstanding owns its slot. A second answer (the
+            # monitor's, for a process that died just after replying) is ignored.
+            if entry is None:
+                continue
+            future, segment, submitted = entry
+            # Copy the embeddings out before the slot can be reused
+            shm = segment or self._slots[result['slot']]
+            if 'faces' in result:
+                count = len(result['faces'])
+                embeddings = np.ndarray((count, result['dim']), dtype=np.float32, buffer=shm.buf).copy()
+            self._free.put(result['slot'])
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            if future.done():
+                continue
+
+            if result.get('expired'):
+                future.set_exception(DeadlineExceeded("inference process call missed its deadline"))
+                continue
+            elapsed = time.monotonic() - submitted
+            with self._lock:
+                self.completed += 1
+                self._service_avg = elapsed if self._service_avg is None else 0.8 * self._service_avg + 0.2 * elapsed
+            if 'error' in result:
+                future.set_exception(InferenceError(result['error'], result['stage']))
+            else:
+                future.set_result({'faces': result['faces'], 'embeddings': embeddings,
+                                   'detection_s': result['detection_s'], 'embedding_s': result['embedding_s']})
+
+    # Stop the inference processes and free the slots (only in the process that started them)
+    def close(self):
+        if self._owner != os.getpid() or not self._workers:
+            return
+        workers, self._workers = self._workers, []
+        for _ in workers:
+            self._tasks.put(None)
+        for process in workers:
+            if not wait_for_exit([process.sentinel], timeout=5):
+                process.terminate()
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        shutil.rmtree(self._reply_dir, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'slots': self.slot_count,
+                'pending': len(self._futures) if self._receiver_pid == os.getpid() else 0,
+                'avg_service_s': round(self._service_avg or 0.0, 3),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'oversized': self.oversized,
+            }
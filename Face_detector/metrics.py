@@ -0,0 +1,136 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+def _bucket_label(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+# Cumulative-bucket latency histogram, as Prometheus represents one
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_S):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.total += seconds
+        self.count += 1
+        for bucket, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[bucket] += 1
+                break
+
+    def snapshot(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            buckets[_bucket_label(bound)] = cumulative
+        return {'count': self.count, 'sum': round(self.total, 6), 'buckets': buckets}
+
+
+# In-process request metrics: per-stage latency histograms, labelled counters
+# and the number of requests in flight. Recording is a few additions under a
+# lock, cheap enough to do on every request.
+class Metrics:
+    def __init__(self, prefix='face_server'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._in_flight = 0
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    # Time the body of a with-block as one observation of `stage`
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # Increment a counter, optionally split by one label: inc('outcomes', outcome='known')
+    def inc(self, name, amount=1, **label):
+        key = (name,) + next(iter(label.items()), (None, None))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    # Also collect the stages this thread observes during a with-block, as a
+    # dict of stage name to seconds (one request's breakdown)
+    @contextmanager
+    def recording(self):
+        stages = self._local.stages = {}
+        try:
+            yield stages
+        finally:
+            self._local.stages = None
+
+    # Count a request as in flight for the duration of a with-block
+    @contextmanager
+    def in_flight(self):
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = {}
+            for (name, _, label), value in sorted(self._counters.items(), key=lambda item: (item[0][0], str(item[0][2]))):
+                if label is None:
+                    counters[name] = value
+                else:
+                    counters.setdefault(name, {})[label] = value
+            label_names = {name: label_name for name, label_name, _ in self._counters if label_name is not None}
+            return {
+                'in_flight': self._in_flight,
+                'counters': counters,
+                'counter_labels': label_names,
+                'stages': {stage: histogram.snapshot() for stage, histogram in sorted(self._stages.items())},
+            }
+
+    # Prometheus text exposition format. gauges maps extra metric names to
+    # current values (gallery size, queue depths, ...); counters maps extra
+    # names to running totals kept elsewhere (e.g. result-cache hits).
+    def prometheus(self, gauges=None, counters=None):
+        snapshot = self.snapshot()
+        lines = []
+        name = f"{self.prefix}_stage_latency_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in snapshot['stages'].items():
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+        for counter, value in dict(snapshot['counters'], **(counters or {})).items():
+            name = f"{self.prefix}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            if isinstance(value, dict):
+                label_name = snapshot['counter_labels'][counter]
+                for label, count in value.items():
+                    lines.append(f'{name}{{{label_name}="{label}"}} {count}')
+            else:
+                lines.append(f"{name} {value}")
+        gauges = dict(gauges or {}, in_flight=snapshot['in_flight'])
+        for gauge, value in gauges.items():
+            name = f"{self.prefix}_{gauge}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,212 @@
+import base64
+import http.client
+import logging
+import math
+import time
+from urllib.parse import urlsplit
+import cv2
+import numpy as np
+from frame_grabber import FrameGrabber, FrameRing
+from image_io import decode_grayscale_preview, jpeg_size, reduction_factor
+
+logger = logging.getLogger(__name__)
+
+class MjpegError(Exception):
+    pass
+
+# Boundary token of a multipart Content-Type header, without leading dashes.
+# Some servers (the ESP32 examples among them) put the dashes in the header;
+# searching for '--' + token matches the body delimiter either way.
+def parse_boundary(content_type):
+    mime, _, params = (content_type or '').partition(';')
+    if not mime.strip().lower().startswith('multipart/'):
+        return None
+    for param in params.split(';'):
+        key, _, value = param.strip().partition('=')
+        if key.strip().lower() == 'boundary':
+            token = value.strip().strip('"').lstrip('-')
+            return token.encode('latin-1') if token else None
+    return None
+
+# Grayscale copy of a JPEG decoded at the largest libjpeg reduction that keeps
+# it at least `width` wide, as (image, scale relative to the full frame).
+# (None, 1.0) if the data is not a decodable JPEG.
+def motion_preview(jpeg, width):
+    size = jpeg_size(jpeg)
+    if size is None:
+        return None, 1.0
+    small = decode_grayscale_preview(jpeg, reduction_factor((size[0],), width))
+    if small is None:
+        return None, 1.0
+    return small, small.shape[1] / size[0]
+
+def _part_headers(block):
+    headers = {}
+    for line in bytes(block).split(b'\r\n'):
+        key, sep, value = line.partition(b':')
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+# Incremental parser for a multipart/x-mixed-replace body. feed() takes bytes
+# as they arrive and returns the complete JPEG parts found so far. Parts with a
+# Content-Length are cut by length; others end at the next boundary.
+class MultipartParser:
+    def __init__(self, boundary, max_part_bytes=8 * 2**20):
+        self.delimiter = b'--' + boundary
+        self.max_part_bytes = max_part_bytes
+        self.buffer = bytearray()
+        self.skipped = 0
+        self._scan_from = 0
+
+    def feed(self, data):
+        self.buffer += data
+        parts = []
+        while True:
+            part = self._next_part()
+            if part is None:
+                break
+            if part[:2] == b'\xff\xd8':
+                parts.append(part)
+            else:
+                self.skipped += 1
+        if len(self.buffer) > self.max_part_bytes:
+            raise MjpegError(f"No complete part within {self.max_part_bytes} bytes")
+        return parts
+
+    def _next_part(self):
+        buf = self.buffer
+        start = buf.find(self.delimiter)
+        if start < 0:
+            # Keep only a tail long enough to hold the start of a delimiter
+            del buf[:max(0, len(buf) - len(self.delimiter))]
+            return None
+        headers_end = buf.find(b'\r\n\r\n', start)
+        if headers_end < 0:
+            return None
+        headers = _part_headers(buf[start + len(self.delimiter):headers_end])
+        body_start = headers_end + 4
+        length = headers.get(b'content-length')
+        if length is not None and length.isdigit():
+            end = body_start + int(length)
+            if len(buf) < end:
+                return None
+        else:
+            end = buf.find(self.delimiter, max(body_start, self._scan_from))
+            if end < 0:
+                # Resume the search where this one stopped once more data arrives
+                self._scan_from = max(body_start, len(buf) - len(self.delimiter))
+                return None
+            while end > body_start and buf[end - 1] in b'\r\n':
+                end -= 1
+        part = bytes(buf[body_start:end])
+        del buf[:end]
+        self._scan_from = 0
+        return part
+
+
+# An MJPEG (multipart/x-mixed-replace) HTTP stream read straight from the
+# socket. frames() yields each JPEG exactly as the camera encoded it.
+class MjpegStream:
+    def __init__(self, url, timeout=10.0, chunk_size=64 * 1024):
+        self.url = url
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._conn = None
+        self._response = None
+        self._parser = None
+
+    def open(self):
+        parts = urlsplit(self.url)
+        if parts.scheme not in ('http', 'https'):
+            raise MjpegError(f"Unsupported stream URL scheme '{parts.scheme}'")
+        connection = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._conn = connection(parts.hostname, parts.port, timeout=self.timeout)
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        headers = {'Accept': 'multipart/x-mixed-replace, image/jpeg'}
+        if parts.username:
+            credentials = f"{parts.username}:{parts.password or ''}".encode()
+            headers['Authorization'] = f"Basic {base64.b64encode(credentials).decode()}"
+        self._conn.request('GET', path, headers=headers)
+        self._response = self._conn.getresponse()
+        if self._response.status != 200:
+            raise MjpegError(f"Stream returned HTTP {self._response.status}")
+        content_type = self._response.getheader('Content-Type', '')
+        boundary = parse_boundary(content_type)
+        if boundary is None:
+            raise MjpegError(f"Not a multipart MJPEG stream: '{content_type}'")
+        self._parser = MultipartParser(boundary)
+        return self
+
+    # JPEG bytes of each frame as it arrives; ends when the server closes the stream
+    def frames(self):
+        while True:
+            data = self._response.read1(self.chunk_size)
+            if not data:
+                return
+            yield from self._parser.feed(data)
+
+    def release(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# FrameGrabber for MJPEG streams that keeps frames encoded: the ring holds the
+# camera's JPEG bytes, which can be uploaded as they are. Frames are decoded
+# only on demand, and at reduced scale by libjpeg for motion detection.
+class MjpegGrabber(FrameGrabber):
+    def __init__(self, stream_url, timeout_s=10.0, **kwargs):
+        super().__init__(stream_url, **kwargs)
+        self.timeout_s = timeout_s
+        self._frame_size = None
+
+    @property
+    def frame_size(self):
+        return self._frame_size
+
+    def decode(self, frame):
+        return cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def preview(self, frame, width):
+        return motion_preview(frame, width)
+
+    def encode_jpeg(self, frame):
+        return frame
+
+    def _open(self):
+        stream = MjpegStream(self.stream_url, timeout=self.timeout_s)
+        try:
+            return stream.open()
+        except (OSError, http.client.HTTPException, MjpegError) as e:
+            logger.warning(f"{self.name}: {str(e)}")
+            stream.release()
+            return None
+
+    # Read until the stream fails or stop() is called; True if any frame was read
+    def _capture(self, stream):
+        read_any = False
+        last = time.monotonic()
+        try:
+            for jpeg in stream.frames():
+                if self._stop.is_set():
+                    break
+                size = jpeg_size(jpeg)
+                if size is None:
+                    continue
+                if self.ring is None:
+                    # Encoded frames are small, so size the ring for the fps hint up front
+                    capacity = int(math.ceil((self.preroll_s + self.slack_s) * self.fps_hint)) + 2
+                    self.ring = FrameRing(capacity, None)
+                self._frame_size = size
+                self.ring.write(jpeg, time.time())
+                self._ready.set()
+                now = time.monotonic()
+                if read_any:
+                    self.fps = 0.9 * self.fps + 0.1 / max(now - last, 1e-6) if self.fps else 1.0 / max(now - last, 1e-6)
+                last = now
+                read_any = True
+        except (OSError, http.client.HTTPException, MjpegError) as e:
+            logger.warning(f"{self.name}: {str(e)}")
+        return read_any
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+METHODS = ('average', 'mog2')
+
+# Rasterise polygons given in frame-relative coordinates (0..1) into a uint8 mask
+def polygon_mask(polygons, width, height, fill=255):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for polygon in polygons:
+        points = np.asarray(polygon, dtype=np.float32).reshape(-1, 2) * [width - 1, height - 1]
+        cv2.fillPoly(mask, [np.round(points).astype(np.int32)], fill)
+    return mask
+
+# Background-model motion detection on a downscaled grayscale copy of each
+# frame. Frames are shrunk so their width is at most `width` pixels and compared
+# with a running-average background (or MOG2, tuned by history and
+# var_threshold). Changes are kept only inside the `regions` polygons and
+# outside the `exclude` polygons (both in 0..1 frame coordinates), then grouped
+# with connectedComponentsWithStats. min_area is in full-resolution pixels.
+class MotionDetector:
+    def __init__(self, min_area=1500, width=320, method='average', threshold=25, alpha=0.05,
+                 regions=None, exclude=None, warmup_frames=5, history=200, var_threshold=16):
+        if method not in METHODS:
+            raise ValueError(f"Unsupported motion method '{method}', expected one of {METHODS}")
+        self.min_area = min_area
+        self.width = width
+        self.method = method
+        self.threshold = threshold
+        self.alpha = alpha
+        self.regions = regions
+        self.exclude = exclude
+        self.warmup_frames = warmup_frames
+        self.history = history
+        self.var_threshold = var_threshold
+        self.reset()
+
+    # Forget the background, e.g. after a reconnect or a camera move
+    def reset(self):
+        self._background = None
+        self._subtractor = None
+        self._mask = None
+        self._shape = None
+        self._scale = 1.0
+        self.frames = 0
+
+    def _prepare(self, shape):
+        height, width = shape[:2]
+        self._scale = min(1.0, self.width / width)
+        small = (max(1, round(width * self._scale)), max(1, round(height * self._scale)))
+        self._shape = shape[:2]
+        self._small_size = small
+        mask = None
+        if self.regions or self.exclude:
+            mask = polygon_mask(self.regions, *small) if self.regions else np.full((small[1], small[0]), 255, dtype=np.uint8)
+            if self.exclude:
+                mask = cv2.bitwise_and(mask, cv2.bitwise_not(polygon_mask(self.exclude, *small)))
+        self._mask = mask
+        if self.method == 'mog2':
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(history=self.history, varThreshold=self.var_threshold, detectShadows=False)
+
+    # Downscaled grayscale copy of a BGR or grayscale frame
+    def shrink(self, frame):
+        if self._shape is None or frame.shape[:2] != self._shape:
+            if self._shape is not None:
+                self.reset()
+            self._prepare(frame.shape)
+        small = frame
+        if self._scale < 1.0:
+            small = cv2.resize(frame, self._small_size, interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    # Foreground mask of the downscaled frame, updating the background model
+    def foreground(self, frame):
+        small = self.shrink(frame)
+        if self.method == 'mog2':
+            changed = self._subtractor.apply(small)
+        else:
+            small = cv2.GaussianBlur(small, (3, 3), 0)
+            if self._background is None:
+                self._background = small.astype(np.float32)
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+            cv2.accumulateWeighted(small, self._background, self.alpha)
+            _, changed = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        if self._mask is not None:
+            changed = cv2.bitwise_and(changed, self._mask)
+        return cv2.dilate(changed, None, iterations=1)
+
+    # Bounding boxes (x, y, w, h) in full-frame pixels of moving regions of at
+    # least min_area. Empty while the background model is still warming up.
+    # frame_scale is the size of `frame` relative to the full frame, for frames
+    # that were already reduced while decoding.
+    def detect(self, frame, frame_scale=1.0):
+        changed = self.foreground(frame)
+        self.frames += 1
+        if self.frames <= self.warmup_frames:
+            return []
+        scale = self._scale * frame_scale
+        min_small_area = self.min_area * scale * scale
+        # Most frames are still: skip labelling when too few pixels changed
+        if cv2.countNonZero(changed) < min_small_area:
+            return []
+        count, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(changed, 8, cv2.CV_32S, cv2.CCL_BBDT)
+        boxes = []
+        for x, y, w, h, area in stats[1:]:
+            if area >= min_small_area:
+                boxes.append((int(x / scale), int(y / scale), int(np.ceil(w / scale)), int(np.ceil(h / scale))))
+        return boxes
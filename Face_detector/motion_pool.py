@@ -0,0 +1,197 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import wait as wait_for_ready
+from motion_detector import MotionDetector
+from mjpeg_stream import motion_preview
+
+logger = logging.getLogger(__name__)
+
+# Worker process loop. Detectors keep a background model, so each camera is
+# pinned to one worker and its MotionDetector lives there between frames.
+# Results go back on the worker's own pipe, so a worker that dies mid-write
+# cannot leave a shared queue locked for the others.
+def _worker(requests, results):
+    detectors = {}
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        request_id, camera, config, jpeg, expires = item
+        try:
+            if config is not None:
+                detectors[camera] = MotionDetector(**config)
+            # The caller stopped waiting for this frame
+            if expires is not None and time.time() > expires:
+                continue
+            detector = detectors[camera]
+            small, scale = motion_preview(jpeg, detector.width)
+            boxes = detector.detect(small, scale) if small is not None else []
+            results.send((request_id, boxes, None))
+        except Exception as e:
+            results.send((request_id, None, f"{type(e).__name__}: {e}"))
+
+
+# Shared pool of processes running motion detection on JPEG frames, so the
+# decode and background-model work of many cameras is spread over several
+# cores instead of contending for one interpreter. register() a camera with
+# its MotionDetector settings, then detect() returns a Future of its boxes, or
+# run() waits for them. A worker that dies is restarted: the frames it had
+# fail, and its cameras' detectors are rebuilt from their settings.
+class MotionPool:
+    def __init__(self, workers=2):
+        self.workers = max(1, workers)
+        self._context = multiprocessing.get_context('spawn')
+        self._requests = []
+        self._results = []
+        self._processes = []
+        self._collector = None
+        self._closed = threading.Event()
+        self._pending = {}
+        self._cameras = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._next_worker = itertools.cycle(range(self.workers))
+        self.restarts = 0
+        self.timed_out = 0
+
+    def _spawn(self, index):
+        requests = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker, args=(requests, writer), name=f"motion-{index}", daemon=True)
+        process.start()
+        # Only the worker writes results; closing our end lets a dead worker show up as EOF
+        writer.close()
+        return requests, reader, process
+
+    def start(self):
+        for index in range(self.workers):
+            requests, reader, process = self._spawn(index)
+            self._requests.append(requests)
+            self._results.append(reader)
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, name='motion-results', daemon=True)
+        self._collector.start()
+        logger.info(f"Motion pool started with {self.workers} processes")
+        return self
+
+    # (Re)configure a camera's detector; its background model starts over
+    def register(self, camera, **config):
+        with self._lock:
+            worker = self._cameras[camera][0] if camera in self._cameras else next(self._next_worker)
+            self._cameras[camera] = [worker, config, True]
+
+    # Queue a frame; the worker skips it if it is still queued after timeout seconds
+    def detect(self, camera, jpeg, timeout=None):
+        return self._submit(camera, jpeg, timeout)[1]
+
+    # Boxes of a frame, or TimeoutError after timeout seconds. A frame that
+    # times out is forgotten here and skipped by its worker.
+    def run(self, camera, jpeg, timeout=5.0):
+        request_id, future = self._submit(camera, jpeg, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._pending.pop(request_id, None)
+                self.timed_out += 1
+            raise TimeoutError(f"Motion detection of camera {camera} took over {timeout}s")
+
+    def _submit(self, camera, jpeg, timeout):
+        future = Future()
+        expires = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("Motion pool closed")
+            entry = self._cameras[camera]
+            worker, config, send_config = entry
+            # The settings travel with the camera's first frame on a worker only
+            entry[2] = False
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, worker)
+            # Under the lock, so a frame never lands on a worker being replaced
+            self._requests[worker].put((request_id, camera, config if send_config else None, jpeg, expires))
+        return request_id, future
+
+    # Routes results to their futures and restarts workers that exit
+    def _collect(self):
+        while not self._closed.is_set():
+            with self._lock:
+                readers = {reader: index for index, reader in enumerate(self._results)}
+                sentinels = {process.sentinel: index for index, process in enumerate(self._processes)}
+            for ready in wait_for_ready(list(readers) + list(sentinels), timeout=0.5):
+                if self._closed.is_set():
+                    return
+                if ready in sentinels:
+                    self._restart(sentinels[ready])
+                    continue
+                try:
+                    self._deliver(ready.recv())
+                except (EOFError, OSError):
+                    # The worker is gone; its sentinel triggers the restart
+                    continue
+
+    def _deliver(self, item):
+        request_id, boxes, error = item
+        with self._lock:
+            future, _ = self._pending.pop(request_id, (None, None))
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(boxes)
+
+    def _restart(self, index):
+        # Results the worker sent before it died still count
+        try:
+            while self._results[index].poll():
+                self._deliver(self._results[index].recv())
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            if self._closed.is_set():
+                return
+            process = self._processes[index]
+            process.join(timeout=0.1)
+            logger.error(f"Motion worker {index} exited with code {process.exitcode}, restarting it")
+            # Frames still queued for the dead worker are dropped with its queue
+            self._requests[index].cancel_join_thread()
+            self._requests[index].close()
+            self._results[index].close()
+            self._requests[index], self._results[index], self._processes[index] = self._spawn(index)
+            self.restarts += 1
+            lost = [request_id for request_id, (_, worker) in self._pending.items() if worker == index]
+            futures = [self._pending.pop(request_id)[0] for request_id in lost]
+            for entry in self._cameras.values():
+                if entry[0] == index:
+                    entry[2] = True
+        for future in futures:
+            future.set_exception(RuntimeError(f"Motion worker {index} died"))
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'pending': len(self._pending), 'restarts': self.restarts, 'timed_out': self.timed_out}
+
+    def close(self, timeout=5):
+        with self._lock:
+            self._closed.set()
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._collector is not None:
+            self._collector.join(timeout)
+        for requests in self._requests:
+            requests.close()
+        for reader in self._results:
+            reader.close()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(RuntimeError("Motion pool closed"))
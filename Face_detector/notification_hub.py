@@ -0,0 +1,270 @@
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+# Send without blocking even though the connection's socket is in blocking
+# mode (its reader thread relies on that)
+SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# An unfragmented, unmasked WebSocket text frame. Server frames are the same
+# bytes for every client, and an uncompressed frame is valid even where
+# permessage-deflate was negotiated, so one frame can be sent to all clients.
+def text_frame(message):
+    payload = message.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x81, length))
+    elif length < 2**16:
+        header = bytes((0x81, 126)) + length.to_bytes(2, 'big')
+    else:
+        header = bytes((0x81, 127)) + length.to_bytes(8, 'big')
+    return header + payload
+
+
+# One WebSocket client and its bounded queue of frames waiting to be sent
+class Subscriber:
+    def __init__(self, ws):
+        self.ws = ws
+        self.sock = ws.sock
+        self.fd = ws.sock.fileno()
+        self.queue = deque()
+        # Frames simple_websocket wrote (pongs, close), sent ahead of notifications
+        self.control = deque()
+        self.partial = None
+        self.stalled_since = None
+        self.active = True
+        # simple_websocket is done with the connection; close it once flushed
+        self.closing = False
+
+
+# Stands in for a connection's socket inside simple_websocket, so the frames
+# it writes itself (pongs, close frames) are queued like notifications. The
+# hub's writer is then the only thread writing to the socket, and a pong can
+# never land in the middle of a notification frame.
+class QueuedSocket:
+    def __init__(self, hub, subscriber):
+        self.hub = hub
+        self.subscriber = subscriber
+        self.sock = subscriber.sock
+
+    def send(self, data):
+        self.hub._send_control(self.subscriber, bytes(data))
+        return len(data)
+
+    sendall = send
+
+    def close(self):
+        self.hub._close(self.subscriber)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+# Fans notifications out to WebSocket subscribers without letting one client
+# hold up /notify or the others. publish() serializes a notification and
+# builds its frame once, appends that frame to every subscriber's bounded
+# queue and returns. A writer thread drains the queues with non-blocking
+# sends, waiting in a selector on clients whose socket buffers are full. A
+# client whose queue fills up, or that accepts nothing for send_timeout_s, is
+# disconnected instead of buffered for; the page reconnects.
+#
+# With a NotificationJournal, every notification gets the journal's sequence
+# number as "seq", and a client reconnecting with the last seq it saw is first
+# sent everything it missed (up to max_replay) as one JSON array frame.
+#
+# One writer serves every client because waking a thread per client on each
+# notification makes them all queue for the interpreter lock, and /notify
+# with them.
+class NotificationHub:
+    def __init__(self, max_queue=64, send_timeout_s=10.0, poll_s=1.0, journal=None, max_replay=1000):
+        self.max_queue = max(1, max_queue)
+        self.journal = journal
+        self.max_replay = max_replay
+        self.send_timeout_s = send_timeout_s
+        self.poll_s = poll_s
+        self._subscribers = set()
+        self._closing = set()
+        self._lock = threading.Lock()
+        self._seq = journal.last_seq if journal is not None else 0
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self._writer = None
+        self.published = 0
+        self.dropped = 0
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except BlockingIOError:
+            # Already awake with wake-ups pending
+            pass
+
+    # Queue a notification for every subscriber; returns its sequence number
+    def publish(self, notification):
+        slow = []
+        with self._lock:
+            if self.journal is not None:
+                seq, message = self.journal.append(notification)
+            else:
+                seq, message = self._seq + 1, json.dumps(dict(notification, seq=self._seq + 1))
+            frame = text_frame(message)
+            self._seq = seq
+            self.published += 1
+            for subscriber in self._subscribers:
+                if subscriber.closing:
+                    continue
+                if len(subscriber.queue) >= self.max_queue:
+                    slow.append(subscriber)
+                else:
+                    subscriber.queue.append(frame)
+        for subscriber in slow:
+            self._drop(subscriber)
+        self._wake()
+        return seq
+
+    # Connection loop for one client (a simple_websocket connection from
+    # flask_sock), resuming after seq `since` if given. Sending is done by the
+    # writer, which also closes the socket once simple_websocket lets go of
+    # it; this only waits for the client to go away, discarding anything it
+    # sends.
+    def serve(self, ws, since=None):
+        subscriber = Subscriber(ws)
+        ws.sock = QueuedSocket(self, subscriber)
+        try:
+            missed = []
+            if since is not None and self.journal is not None and since < self.journal.last_seq:
+                # Read older events without holding up publish(), then the rest below
+                missed = self.journal.since(since, limit=self.max_replay)
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write, name='notification-writer', daemon=True)
+                    self._writer.start()
+                if since is not None and self.journal is not None:
+                    missed += self.journal.since(missed[-1][0] if missed else since)
+                    missed = missed[max(0, len(missed) - self.max_replay):]
+                    if missed:
+                        subscriber.queue.append(text_frame('[' + ','.join(line for _, line in missed) + ']'))
+                self._subscribers.add(subscriber)
+        except Exception:
+            # Never subscribed, so the connection writes for itself again
+            ws.sock = subscriber.sock
+            raise
+        if subscriber.queue or subscriber.control:
+            self._wake()
+        while ws.connected and subscriber.active:
+            ws.receive(timeout=self.poll_s)
+
+    # A frame simple_websocket wrote (pong, close). It is sent before the
+    # notifications still queued, as soon as the frame being sent is complete.
+    # A client pinging faster than it reads is dropped like a slow one.
+    def _send_control(self, subscriber, data):
+        with self._lock:
+            if not subscriber.active or subscriber.closing:
+                raise BrokenPipeError("WebSocket subscriber disconnected")
+            full = len(subscriber.control) >= self.max_queue
+            if not full:
+                subscriber.control.append(data)
+        if full:
+            self._drop(subscriber)
+            raise BrokenPipeError("WebSocket subscriber not reading")
+        self._wake()
+
+    # simple_websocket closed the connection; the writer sends what is still
+    # queued (e.g. the close frame) and then closes the socket
+    def _close(self, subscriber):
+        with self._lock:
+            subscriber.closing = True
+            self._closing.add(subscriber)
+        self._wake()
+
+    # Disconnect a client at once; its connection thread then finishes
+    def _drop(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.discard(subscriber)
+            self.dropped += 1
+        subscriber.active = False
+        try:
+            subscriber.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # Send what a subscriber has queued; False once its socket buffer is full
+    def _flush(self, subscriber):
+        while True:
+            if subscriber.partial is None:
+                if subscriber.control:
+                    subscriber.partial = memoryview(subscriber.control.popleft())
+                elif subscriber.queue:
+                    subscriber.partial = memoryview(subscriber.queue.popleft())
+                else:
+                    return True
+            try:
+                sent = subscriber.sock.send(subscriber.partial, SEND_FLAGS)
+            except (BlockingIOError, InterruptedError):
+                return False
+            subscriber.partial = subscriber.partial[sent:] if sent < len(subscriber.partial) else None
+
+    def _write(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_recv.fileno(), selectors.EVENT_READ, None)
+        waiting = {}
+        while True:
+            for key, _ in selector.select(self.poll_s if waiting else None):
+                if key.data is None:
+                    try:
+                        while self._wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    # Writable again: the client is reading
+                    selector.unregister(key.fd)
+                    waiting.pop(key.fd, None)
+                    key.data.stalled_since = None
+
+            now = time.monotonic()
+            for fd, subscriber in list(waiting.items()):
+                if not subscriber.active or now - subscriber.stalled_since > self.send_timeout_s:
+                    selector.unregister(fd)
+                    del waiting[fd]
+                    self._drop(subscriber)
+
+            with self._lock:
+                subscribers = [subscriber for subscriber in self._subscribers
+                               if (subscriber.queue or subscriber.control or subscriber.partial is not None)
+                               and subscriber.fd not in waiting]
+            for subscriber in subscribers:
+                try:
+                    if self._flush(subscriber):
+                        continue
+                except OSError:
+                    self._drop(subscriber)
+                    continue
+                if subscriber.stalled_since is None:
+                    subscriber.stalled_since = now
+                selector.register(subscriber.fd, selectors.EVENT_WRITE, subscriber)
+                waiting[subscriber.fd] = subscriber
+
+            with self._lock:
+                finished = [subscriber for subscriber in self._closing
+                            if not subscriber.active
+                            or (not subscriber.queue and not subscriber.control and subscriber.partial is None)]
+                for subscriber in finished:
+                    self._closing.discard(subscriber)
+                    self._subscribers.discard(subscriber)
+            for subscriber in finished:
+                if waiting.get(subscriber.fd) is subscriber:
+                    selector.unregister(subscriber.fd)
+                    del waiting[subscriber.fd]
+                subscriber.active = False
+                subscriber.sock.close()
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'published': self.published, 'dropped': self.dropped, 'seq': self._seq}
@@ -0,0 +1,184 @@
+import bisect
+import json
+import logging
+import os
+import threading
+from collections import deque
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+
+class _Segment:
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = first_seq - 1
+        self.size = 0
+        # Sparse index: (seq, byte offset) of every index_every-th event
+        self.index = []
+
+    @property
+    def count(self):
+        return self.last_seq - self.first_seq + 1
+
+
+# Journal of notifications with increasing sequence numbers, so clients that
+# reconnect can be sent what they missed. Events are appended as JSON lines
+# to segment files named after their first sequence number. The newest
+# ring_size events are also kept in memory. A new segment is started every
+# segment_events events. Whole segments are deleted from the oldest once
+# more than max_events are kept, so the files never grow without bound.
+# since() serves a cursor from the ring, or from the files through each
+# segment's sparse offset index. Either way it reads only the events after
+# the cursor, not the whole history.
+class NotificationJournal:
+    def __init__(self, directory, ring_size=1024, segment_events=10000, max_events=100000, index_every=64):
+        self.directory = directory
+        self.segment_events = max(1, segment_events)
+        self.max_events = max(self.segment_events, max_events)
+        self.index_every = max(1, index_every)
+        self.last_seq = 0
+        self._ring = deque(maxlen=max(1, ring_size))
+        self._segments = []
+        self._file = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _segment_path(self, first_seq):
+        return os.path.join(self.directory, f"{first_seq:012d}.jsonl")
+
+    # Rebuild the segment indexes and the ring from the files. A line cut
+    # short by a crash is dropped from the end of the newest segment.
+    def _load(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.jsonl') and name[:-6].isdigit())
+        for name in names:
+            segment = _Segment(os.path.join(self.directory, name), int(name[:-6]))
+            # The segment's newest events, added to the ring if it is kept
+            events = deque(maxlen=self._ring.maxlen)
+            offset = 0
+            with open(segment.path, 'rb') as f:
+                for line in f:
+                    try:
+                        seq = json.loads(line)['seq'] if line.endswith(b'\n') else None
+                    except (ValueError, KeyError, TypeError):
+                        seq = None
+                    if seq is None or seq != segment.last_seq + 1:
+                        logger.warning(f"Journal segment {name} is damaged after seq {segment.last_seq}, truncating it")
+                        break
+                    if (seq - segment.first_seq) % self.index_every == 0:
+                        segment.index.append((seq, offset))
+                    segment.last_seq = seq
+                    offset += len(line)
+                    events.append((seq, line.decode('utf-8').rstrip('\n')))
+            if offset < os.path.getsize(segment.path):
+                with open(segment.path, 'r+b') as f:
+                    f.truncate(offset)
+            segment.size = offset
+            if segment.count == 0:
+                os.remove(segment.path)
+                continue
+            if segment.first_seq != self.last_seq + 1:
+                # Events are missing before this segment; the ring only holds consecutive ones
+                self._ring.clear()
+            self._ring.extend(events)
+            self._segments.append(segment)
+            self.last_seq = segment.last_seq
+        if self._segments:
+            logger.info(f"Notification journal at {self.directory}: seq {self._segments[0].first_seq}-{self.last_seq}")
+
+    # Append a notification; returns its sequence number and its JSON line,
+    # which carries the sequence number as "seq"
+    def append(self, notification):
+        with self._lock:
+            seq = self.last_seq + 1
+            line = json.dumps(dict(notification, seq=seq))
+            data = line.encode('utf-8') + b'\n'
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or segment.count >= self.segment_events or self._file is None:
+                segment = self._roll(seq)
+            if (seq - segment.first_seq) % self.index_every == 0:
+                segment.index.append((seq, segment.size))
+            self._file.write(data)
+            self._file.flush()
+            segment.size += len(data)
+            segment.last_seq = seq
+            self.last_seq = seq
+            self._ring.append((seq, line))
+            return seq, line
+
+    def _roll(self, first_seq):
+        if self._file is not None:
+            self._file.close()
+        current = self._segments[-1] if self._segments else None
+        if current is not None and current.count < self.segment_events:
+            # Reopened after a restart: keep filling the newest segment
+            segment = current
+        else:
+            segment = _Segment(self._segment_path(first_seq), first_seq)
+            self._segments.append(segment)
+        self._file = open(segment.path, 'ab')
+        self._compact()
+        return segment
+
+    # Delete the oldest segments while the rest still hold max_events
+    def _compact(self):
+        total = sum(segment.count for segment in self._segments)
+        while len(self._segments) > 1 and total - self._segments[0].count >= self.max_events:
+            segment = self._segments.pop(0)
+            total -= segment.count
+            try:
+                os.remove(segment.path)
+            except OSError as e:
+                logger.warning(f"Could not remove journal segment {segment.path}: {str(e)}")
+
+    # Events after `cursor` as (seq, line) pairs, oldest first; with `limit`
+    # only the newest `limit` of them. Events already compacted away are
+    # skipped.
+    def since(self, cursor, limit=None):
+        with self._lock:
+            last_seq = self.last_seq
+            start = cursor + 1 if limit is None else max(cursor + 1, last_seq - limit + 1)
+            if start > last_seq:
+                return []
+            # Everything is read from the files when the ring is empty
+            ring_start = self._ring[0][0] if self._ring else last_seq + 1
+            if start >= ring_start:
+                return list(islice(self._ring, start - ring_start, None))
+            segments = list(self._segments)
+            tail = list(self._ring)
+        return self._read(segments, start, ring_start) + tail
+
+    # Events from the segment files with start <= seq < end
+    def _read(self, segments, start, end):
+        events = []
+        first_seqs = [segment.first_seq for segment in segments]
+        position = max(0, bisect.bisect_right(first_seqs, start) - 1)
+        for segment in segments[position:]:
+            if segment.first_seq >= end:
+                break
+            if segment.last_seq < start:
+                continue
+            indexed = bisect.bisect_right(segment.index, (start, float('inf'))) - 1
+            seq, offset = segment.index[indexed] if indexed >= 0 else (segment.first_seq, 0)
+            try:
+                with open(segment.path, 'rb') as f:
+                    f.seek(offset)
+                    # Sequence numbers within a segment are consecutive
+                    for line in f:
+                        if seq >= end:
+                            return events
+                        if seq >= start:
+                            events.append((seq, line.decode('utf-8').rstrip('\n')))
+                        seq += 1
+            except FileNotFoundError:
+                # Compacted while being read
+                continue
+        return events
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
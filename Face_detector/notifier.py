@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from region_hints import format_regions
+from upload_queue import UploadQueue
+
+FACE_RESULT_UNAVAILABLE = "Face detection failed"
+
+# Endpoints come from the environment so tests can point them at local stand-ins
+def endpoints_from_env():
+    return {
+        'face_server_url': os.getenv('FACE_SERVER_URL', 'http://localhost:5000/process_image'),
+        'api_key': os.getenv('api_key'),
+        'telegram_api_url': os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/'),
+        'telegram_bot_token': os.getenv('telegram_bot_token'),
+        'telegram_chat_id': os.getenv('telegram_chat_id'),
+    }
+
+def caption(timestamp, face_result):
+    return f"Motion detected at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}\nFace detection: {face_result}"
+
+
+# One upload job; discard() resolves its face-result future so that later jobs
+# waiting for it (the clip's caption) do not hang when the job is dropped
+class _Job:
+    def __init__(self, fn, face_result):
+        self.fn = fn
+        self.face_result = face_result
+
+    def __call__(self, context):
+        self.fn(context)
+
+    def discard(self):
+        if not self.face_result.done():
+            self.face_result.set_result(FACE_RESULT_UNAVAILABLE)
+
+
+# Sends motion alerts through an UploadQueue: the screenshot goes to the face
+# server and then to Telegram with the verdict as caption, and the recorded
+# clip follows once it is ready. Nothing here blocks the caller.
+class Notifier:
+    def __init__(self, uploads=None, camera='camera', face_server_url=None, api_key=None, telegram_api_url=None,
+                 telegram_bot_token=None, telegram_chat_id=None, caption_wait_s=60.0):
+        config = endpoints_from_env()
+        self.uploads = uploads or UploadQueue().start()
+        self.camera = camera
+        self.face_server_url = face_server_url or config['face_server_url']
+        self.api_key = api_key or config['api_key']
+        telegram_api_url = (telegram_api_url or config['telegram_api_url']).rstrip('/')
+        bot_token = telegram_bot_token or config['telegram_bot_token']
+        self.telegram_chat_id = telegram_chat_id or config['telegram_chat_id']
+        self.telegram_photo_url = f"{telegram_api_url}/bot{bot_token}/sendPhoto"
+        self.telegram_video_url = f"{telegram_api_url}/bot{bot_token}/sendVideo"
+        self.caption_wait_s = caption_wait_s
+
+    # Ask the face server about a JPEG; returns its message. regions are motion
+    # boxes (x, y, w, h) the server may limit face detection to.
+    def classify(self, context, jpeg, regions=None):
+        # The camera name files the verdict under this camera in the server's event store
+        params = {'camera': self.camera}
+        if regions:
+            params['regions'] = format_regions(regions)
+        response = context.request('face_server', 'POST', self.face_server_url, data=jpeg, params=params,
+                                   headers={'X-API-Key': self.api_key, 'Content-Type': 'application/octet-stream'})
+        if response.status_code != 200:
+            print(f"Server error: {response.status_code} - {response.text}")
+            return FACE_RESULT_UNAVAILABLE
+        try:
+            face_result = response.json()['message']
+        except (ValueError, KeyError) as e:
+            print(f"Invalid server response: {e}")
+            return FACE_RESULT_UNAVAILABLE
+        print(f"Face detection result: {face_result}")
+        return face_result
+
+    # Queue the screenshot of a motion event. Returns a Future resolving to the
+    # face server's verdict, to be passed to send_clip(). regions are the
+    # frame's motion boxes, forwarded to the face server as hints.
+    def send_screenshot(self, jpeg, timestamp, regions=None):
+        face_result = Future()
+
+        def job(context):
+            try:
+                result = self.classify(context, jpeg, regions)
+            except Exception as e:
+                print(f"Failed to send image to server: {e}")
+                result = FACE_RESULT_UNAVAILABLE
+            face_result.set_result(result)
+            files = {'photo': ('screenshot.jpg', jpeg, 'image/jpeg')}
+            data = {'chat_id': self.telegram_chat_id, 'caption': caption(timestamp, result)}
+            response = context.request('telegram_photo', 'POST', self.telegram_photo_url, files=files, data=data)
+            if response.status_code == 200:
+                print("Screenshot sent to Telegram bot successfully")
+            else:
+                print(f"Telegram API error (photo): {response.status_code} - {response.text}")
+
+        # A newer screenshot from the same camera replaces one still waiting
+        self.uploads.submit(_Job(job, face_result), key=f"photo:{self.camera}")
+        return face_result
+
+    # Queue a recorded clip; its caption carries the screenshot's verdict. The
+    # clip is queued once the verdict is in, or after caption_wait_s without
+    # it, so it never holds an upload worker that the screenshot job needs.
+    def send_clip(self, path, timestamp, face_result=None):
+        # Read now: the file may be overwritten by the next recording
+        with open(path, 'rb') as f:
+            video = f.read()
+
+        def job(context):
+            result = FACE_RESULT_UNAVAILABLE
+            if face_result is not None and face_result.done():
+                result = face_result.result()
+            files = {'video': (os.path.basename(path), video)}
+            data = {'chat_id': self.telegram_chat_id, 'caption': caption(timestamp, result)}
+            print("Sending video to Telegram...")
+            response = context.request('telegram_video', 'POST', self.telegram_video_url, files=files, data=data)
+            if response.status_code == 200:
+                print("Video sent to Telegram bot successfully")
+            else:
+                print(f"Telegram API error (video): {response.status_code} - {response.text}")
+
+        if face_result is None or face_result.done():
+            self.uploads.submit(job)
+            return
+        waiting = [True]
+        lock = threading.Lock()
+
+        def submit(_=None):
+            with lock:
+                if not waiting:
+                    return
+                waiting.clear()
+            timer.cancel()
+            self.uploads.submit(job)
+
+        timer = threading.Timer(self.caption_wait_s, submit)
+        timer.daemon = True
+        timer.start()
+        face_result.add_done_callback(submit)
+
+    def stats(self):
+        return self.uploads.stats()
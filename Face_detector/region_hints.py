@@ -0,0 +1,76 @@
+import numpy as np
+
+# Most region hints accepted with one image
+MAX_REGIONS = 16
+
+# Parse region hints "x,y,w,h;x,y,w,h" (pixels of the uploaded image) into
+# (x, y, w, h) tuples. Raises ValueError on malformed input.
+def parse_regions(text):
+    regions = []
+    for part in (text or '').replace(' ', '').split(';'):
+        if not part:
+            continue
+        values = part.split(',')
+        if len(values) != 4:
+            raise ValueError(f"Region '{part}' should be x,y,w,h")
+        x, y, w, h = (int(float(value)) for value in values)
+        if w <= 0 or h <= 0:
+            raise ValueError(f"Region '{part}' has no area")
+        regions.append((x, y, w, h))
+    if len(regions) > MAX_REGIONS:
+        raise ValueError(f"{len(regions)} regions given, limit is {MAX_REGIONS}")
+    return regions
+
+def format_regions(boxes):
+    return ';'.join(f"{int(x)},{int(y)},{int(w)},{int(h)}" for x, y, w, h in boxes)
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+# Crops (x1, y1, x2, y2) to run detection on: each region grown by `padding`
+# of its size on every side and to at least min_side pixels, clipped to the
+# image, with overlapping crops merged so no face is searched twice. `scale`
+# maps hint coordinates to the decoded image (when it was downscaled). Returns
+# None when the crops would cover more than max_coverage of the image, where
+# searching the whole frame once is cheaper.
+def crop_boxes(regions, width, height, scale=1.0, padding=0.25, min_side=160, max_coverage=0.6):
+    boxes = []
+    for x, y, w, h in regions:
+        x, y, w, h = x * scale, y * scale, w * scale, h * scale
+        pad_x, pad_y = max(w * padding, (min_side - w) / 2), max(h * padding, (min_side - h) / 2)
+        box = (max(0, int(x - pad_x)), max(0, int(y - pad_y)), min(width, int(np.ceil(x + w + pad_x))), min(height, int(np.ceil(y + h + pad_y))))
+        if box[2] > box[0] and box[3] > box[1]:
+            boxes.append(box)
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                if _overlaps(boxes[i], boxes[j]):
+                    a, b = boxes[i], boxes.pop(j)
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    merged = True
+                    break
+            if merged:
+                break
+
+    area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+    if not boxes or area > max_coverage * width * height:
+        return None
+    return boxes
+
+# Run detect_fn on each crop of img and map the faces back to image
+# coordinates. detect_fn has the signature of face_pipeline.detect_faces.
+def detect_in_crops(detect_fn, img, boxes):
+    faces = []
+    for x1, y1, x2, y2 in boxes:
+        for face in detect_fn(np.ascontiguousarray(img[y1:y2, x1:x2])):
+            area = dict(face['facial_area'])
+            area['x'] = int(area['x']) + x1
+            area['y'] = int(area['y']) + y1
+            for eye in ('left_eye', 'right_eye'):
+                if area.get(eye) is not None:
+                    area[eye] = (int(area[eye][0]) + x1, int(area[eye][1]) + y1)
+            faces.append(dict(face, facial_area=area))
+    return faces
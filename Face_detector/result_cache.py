@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Grid of the frame signature: about 40x40-pixel cells on a 720p frame, so a
+# face of 50 pixels or more covers most of at least one cell
+SIGNATURE_SIZE = (32, 18)
+
+# Signature of a grayscale frame: the mean brightness of each grid cell
+def frame_signature(gray):
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).ravel()
+
+# Largest change of a single cell between each stored signature and `value`.
+# Sensor noise and re-encoding move every cell by a level or two, while a new
+# face or person changes the cells it covers by tens of levels, even when the
+# rest of the frame is identical.
+def signature_distances(signatures, value):
+    return np.abs(signatures.astype(np.int16) - value.astype(np.int16)).max(axis=1)
+
+
+# Bounded LRU cache of responses keyed by source (camera) and frame signature.
+# A lookup returns the closest entry from the same source whose cells all
+# differ by at most max_distance levels, so near-duplicate frames share a
+# result. Entries expire ttl_s seconds after they were stored.
+class PerceptualCache:
+    def __init__(self, max_entries=256, ttl_s=30.0, max_distance=12):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._signatures = np.zeros((self.max_entries, SIGNATURE_SIZE[0] * SIGNATURE_SIZE[1]), dtype=np.uint8)
+        self._sources = np.full(self.max_entries, None, dtype=object)
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._used = np.zeros(self.max_entries, dtype=bool)
+        self._values = [None] * self.max_entries
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, source=None):
+        now = time.monotonic()
+        with self._lock:
+            if self._lru:
+                distances = signature_distances(self._signatures, key)
+                live = self._used & (self._expires > now)
+                for slot in np.flatnonzero(self._used & ~live):
+                    self._free(int(slot))
+                    self.expirations += 1
+                distances[~(live & (self._sources == source))] = 256
+                slot = int(np.argmin(distances))
+                if distances[slot] <= self.max_distance:
+                    self._lru.move_to_end(slot)
+                    self.hits += 1
+                    return self._values[slot]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, source=None):
+        with self._lock:
+            if len(self._lru) < self.max_entries:
+                slot = int(np.flatnonzero(~self._used)[0])
+            else:
+                slot, _ = self._lru.popitem(last=False)
+                self.evictions += 1
+            self._signatures[slot] = key
+            self._sources[slot] = source
+            self._expires[slot] = time.monotonic() + self.ttl_s
+            self._values[slot] = value
+            self._used[slot] = True
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def clear(self):
+        with self._lock:
+            for slot in list(self._lru):
+                self._free(slot)
+
+    def _free(self, slot):
+        self._lru.pop(slot, None)
+        self._values[slot] = None
+        self._sources[slot] = None
+        self._used[slot] = False
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._lru),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+import cv2
+import numpy as np
+from avi_writer import AVI_HEADER_BYTES, avi_frame_cost, write_mjpeg_avi
+from image_io import REDUCED_COLOR_FLAGS, jpeg_size, reduction_factor
+
+logger = logging.getLogger(__name__)
+
+# Telegram bots may send videos up to 50 MB
+TELEGRAM_VIDEO_LIMIT = 50 * 2**20
+
+# (scale, JPEG quality) steps tried in order until a clip fits its budget.
+# Quality None keeps the camera's own JPEG (MJPEG streams) untouched.
+DEFAULT_LADDER = ((1.0, None), (1.0, 75), (1.0, 60), (0.75, 60), (0.5, 60), (0.5, 45), (0.35, 40))
+
+# JPEG quality for frames that arrive decoded (reader='opencv') at the first step
+DEFAULT_QUALITY = 90
+
+
+class _Clip:
+    def __init__(self, path, start_time, end_time):
+        self.path = path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.future = Future()
+        self.frames = []
+        self.timestamps = []
+        self.bytes = AVI_HEADER_BYTES
+        self.source_size = None
+        self.size = None
+        self.step = 0
+        self.trimmed = False
+
+
+# Records motion clips on its own thread from a grabber's frame buffer, so
+# detection keeps running while a clip is written. Frames are collected in
+# short segments; after each one the clip's final size is projected, and if it
+# would go over target_bytes the following frames are encoded at the next
+# step of the (scale, quality) ladder. A clip that would still overflow is
+# re-encoded at a lower step, and at the last step it is trimmed, so it never
+# exceeds the target. Clips are Motion-JPEG AVI: JPEG frames from an MJPEG
+# camera are written as they are, without decoding.
+class SegmentRecorder:
+    def __init__(self, grabber, target_bytes=45 * 2**20, segment_s=2.0, max_clip_s=60.0, ladder=DEFAULT_LADDER, name='recorder'):
+        self.grabber = grabber
+        self.target_bytes = min(target_bytes, TELEGRAM_VIDEO_LIMIT)
+        self.segment_s = segment_s
+        self.max_clip_s = max_clip_s
+        self.ladder = ladder
+        self.name = name
+        self._jobs = deque()
+        self._active = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        # Ladder step new clips start from, learned from the previous clip
+        self._start_step = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    # Finish the clip in progress with the frames it has, then stop
+    def stop(self, timeout=10):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Record preroll_s before motion_time to record_time after it into `path`.
+    # Returns a Future of the clip's summary dict (None if no frame was
+    # recorded). Motion during a clip being recorded extends that clip, up to
+    # max_clip_s, and returns its Future.
+    def record(self, path, motion_time, preroll_s, record_time):
+        start_time, end_time = motion_time - preroll_s, motion_time + record_time
+        with self._cond:
+            for clip in ([self._active] if self._active else []) + list(self._jobs):
+                if clip.path == path and start_time <= clip.end_time:
+                    clip.end_time = min(max(clip.end_time, end_time), clip.start_time + self.max_clip_s)
+                    return clip.future
+            clip = _Clip(path, start_time, end_time)
+            self._jobs.append(clip)
+            self._cond.notify()
+            return clip.future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs or self._stop.is_set())
+                if not self._jobs:
+                    return
+                self._active = clip = self._jobs.popleft()
+            try:
+                clip.future.set_result(self._record(clip))
+            except Exception as e:
+                logger.error(f"{self.name}: recording {clip.path} failed: {str(e)}")
+                clip.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._active = None
+
+    # JPEG bytes of a frame at a ladder step, sized to clip.size
+    def _encode(self, frame, step, clip):
+        scale, quality = self.ladder[step]
+        if isinstance(frame, (bytes, bytearray)):
+            if quality is None:
+                return bytes(frame)
+            # Let libjpeg do most of the downscaling while decoding
+            size = jpeg_size(frame)
+            reduction = reduction_factor((size[0],), clip.size[0]) if size else 1
+            image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), REDUCED_COLOR_FLAGS.get(reduction, cv2.IMREAD_COLOR))
+            if image is None:
+                return None
+        else:
+            image = frame
+        if (image.shape[1], image.shape[0]) != clip.size:
+            image = cv2.resize(image, clip.size, interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality or DEFAULT_QUALITY])
+        return buf.tobytes() if ok else None
+
+    def _output_size(self, step, source_size):
+        scale, quality = self.ladder[step]
+        if quality is None:
+            return source_size
+        width, height = source_size
+        return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+    # Move the clip to a lower ladder step. With reencode, frames already in
+    # the clip are re-encoded too (needed when the frame size changes).
+    def _step_down(self, clip, step, reencode):
+        old_size = clip.size
+        clip.step = step
+        clip.size = self._output_size(step, clip.source_size)
+        if not reencode and clip.size == old_size:
+            return
+        frames = [self._encode(frame, step, clip) for frame in clip.frames]
+        clip.frames = [frame for frame in frames if frame is not None]
+        clip.bytes = AVI_HEADER_BYTES + sum(avi_frame_cost(len(frame)) for frame in clip.frames)
+        logger.info(f"{self.name}: {clip.path} stepped down to {clip.size[0]}x{clip.size[1]} "
+                    f"q{self.ladder[step][1] or 'source'} ({clip.bytes / 2**20:.1f} MB so far)")
+
+    def _record(self, clip):
+        grabber = self.grabber
+        seq = grabber.seq_at(clip.start_time)
+        segment_start, segment_bytes = None, 0
+        last = len(self.ladder) - 1
+        clip.step = self._start_step
+        while not self._stop.is_set():
+            item = grabber.get(seq)
+            if item is None:
+                if seq < grabber.ring.oldest_seq:
+                    logger.warning(f"{self.name}: recording fell behind the frame buffer, skipping ahead")
+                    seq = grabber.ring.oldest_seq
+                elif grabber.wait_newer(seq - 1, timeout=5) is None:
+                    logger.warning(f"{self.name}: stream lost, finishing {clip.path} early")
+                    break
+                continue
+            seq, timestamp, frame = item
+            seq += 1
+            timestamp = float(timestamp)
+            with self._cond:
+                end_time = clip.end_time
+            if timestamp > end_time:
+                break
+
+            source_size = jpeg_size(frame) if isinstance(frame, (bytes, bytearray)) else (frame.shape[1], frame.shape[0])
+            if source_size is None:
+                continue
+            if clip.source_size is None:
+                clip.source_size = source_size
+                clip.size = self._output_size(clip.step, source_size)
+            elif source_size != clip.source_size:
+                # Resolution changed mid-clip; the AVI holds one frame size
+                continue
+            jpeg = self._encode(frame, clip.step, clip)
+            if jpeg is None:
+                continue
+
+            # Never let the clip grow past its budget: re-encode what is
+            # there at a lower step, or trim the rest at the last step
+            while clip.bytes + avi_frame_cost(len(jpeg)) > self.target_bytes and clip.step < last:
+                self._step_down(clip, clip.step + 1, reencode=True)
+                jpeg = self._encode(frame, clip.step, clip)
+            if jpeg is None or clip.bytes + avi_frame_cost(len(jpeg)) > self.target_bytes:
+                clip.trimmed = True
+                logger.warning(f"{self.name}: {clip.path} reached {self.target_bytes / 2**20:.0f} MB, trimming the rest")
+                break
+            clip.frames.append(jpeg)
+            clip.timestamps.append(timestamp)
+            clip.bytes += avi_frame_cost(len(jpeg))
+
+            if segment_start is None:
+                segment_start, segment_bytes = timestamp, 0
+            segment_bytes += avi_frame_cost(len(jpeg))
+            if timestamp - segment_start >= self.segment_s:
+                # Segment done: project the final size at this segment's rate
+                rate = segment_bytes / (timestamp - segment_start)
+                projected = clip.bytes + rate * max(0.0, end_time - timestamp)
+                if projected > self.target_bytes and clip.step < last:
+                    self._step_down(clip, clip.step + 1, reencode=self.ladder[clip.step + 1][0] != self.ladder[clip.step][0])
+                segment_start = None
+
+        if not clip.frames:
+            return None
+        duration = clip.timestamps[-1] - clip.timestamps[0]
+        fps = (len(clip.frames) - 1) / duration if duration > 0 else (grabber.fps or 25.0)
+        tmp_path = f"{clip.path}.part"
+        write_mjpeg_avi(tmp_path, clip.frames, fps, *clip.size)
+        os.replace(tmp_path, clip.path)
+        # Start the next clip one step above where this one ended
+        self._start_step = max(0, clip.step - 1)
+        return {
+            'path': clip.path,
+            'frames': len(clip.frames),
+            'bytes': os.path.getsize(clip.path),
+            'duration_s': round(duration, 2),
+            'fps': round(fps, 2),
+            'size': clip.size,
+            'quality': self.ladder[clip.step][1] or 'source',
+            'trimmed': clip.trimmed,
+        }
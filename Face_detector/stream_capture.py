@@ -1,237 +1,278 @@
 import cv2
+import threading
 import time
-import numpy as np
-import requests
-import os
-
-def save_on_movement(stream_url, output_path, screenshot_path, record_time=10, min_area=1500):
-    def open_stream(url):
-        cap = cv2.VideoCapture(url)
-        if not cap.isOpened():
-            print(f"Failed to open stream: {url}")
+from frame_grabber import FrameGrabber
+from mjpeg_stream import MjpegGrabber
+from motion_detector import MotionDetector
+from notifier import Notifier
+from segment_recorder import SegmentRecorder
+
+# Largest motion boxes sent to the face server as region hints
+MAX_HINT_REGIONS = 8
+
+# Motion-pool failures in a row after which the watcher fails, so its
+# supervisor restarts the camera instead of it running without motion detection
+MAX_MOTION_FAILURES = 3
+
+# Watches one camera: detects motion, uploads a screenshot and records a clip.
+# Frames are read by a FrameGrabber thread into a ring buffer, so the stream
+# keeps being drained while this loop analyses, uploads or records. Recordings
+# start preroll_s seconds before the motion that triggered them. regions and
+# exclude are optional polygons in 0..1 frame coordinates limiting where motion counts.
+# With reader='mjpeg' the multipart stream is parsed directly and frames stay
+# JPEG-encoded: motion runs on reduced decodes and the camera's own JPEG is
+# uploaded. reader='opencv' decodes every frame with cv2.VideoCapture, for
+# streams that are not MJPEG over HTTP. show=True displays a window.
+# A motion_pool (MotionPool) runs motion detection of JPEG frames in worker
+# processes shared with other cameras. open_timeout_s=None keeps waiting for an
+# unreachable stream instead of giving up. Clips are recorded on a
+# SegmentRecorder thread and kept under clip_target_mb.
+class CameraWatcher:
+    def __init__(self, stream_url, output_path, screenshot_path, record_time=10, min_area=1500, preroll_s=3, screenshot_delay=3,
+                 regions=None, exclude=None, motion_method='average', notifier=None, reader='mjpeg', show=False,
+                 name=None, motion_pool=None, open_timeout_s=30, clip_target_mb=45):
+        self.stream_url = stream_url
+        self.output_path = output_path
+        self.screenshot_path = screenshot_path
+        self.record_time = record_time
+        self.preroll_s = preroll_s
+        self.screenshot_delay = screenshot_delay
+        self.notifier = notifier
+        self.reader = reader
+        self.show = show
+        self.name = name
+        self.motion_pool = motion_pool
+        self.open_timeout_s = open_timeout_s
+        self.window_name = "Live Cam" if name is None else f"Live Cam {name}"
+        detector_config = dict(min_area=min_area, method=motion_method, regions=regions, exclude=exclude)
+        self.detector = MotionDetector(**detector_config)
+        if motion_pool is not None:
+            motion_pool.register(name, **detector_config)
+        self.clip_target_mb = clip_target_mb
+        self.grabber = None
+        self.recorder = None
+        self._clip = None
+        self.state = 'idle'
+        self.frames = 0
+        self.skipped = 0
+        self.motion_events = 0
+        self.motion_errors = 0
+        self._motion_failures = 0
+        self.lag_s = 0.0
+        self.analysed_fps = 0.0
+        self._last_analysed = None
+        self._stop = threading.Event()
+
+    def log(self, message):
+        print(message if self.name is None else f"[{self.name}] {message}")
+
+    def stop(self):
+        self._stop.set()
+
+    # Per-camera health: stream and analysis rates, how far analysis trails the
+    # stream (lag_s) and how many frames were not analysed, either because
+    # analysis fell behind or while recording
+    def stats(self):
+        grabber = self.grabber
+        latest = grabber.latest() if grabber is not None else None
+        return {
+            'state': self.state,
+            'stream_fps': round(grabber.fps, 2) if grabber is not None else 0.0,
+            'analysed_fps': round(self.analysed_fps, 2),
+            'lag_s': round(self.lag_s, 3),
+            'frame_age_s': round(time.time() - float(latest[1]), 3) if latest is not None else None,
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'motion_events': self.motion_events,
+            'motion_errors': self.motion_errors,
+            'reconnects': grabber.reconnects if grabber is not None else 0,
+        }
+
+    def _next_frame(self, seq):
+        latest = self.grabber.wait_newer(seq, timeout=5)
+        if latest is None and not self._stop.is_set():
+            self.state = 'waiting'
+            self.log("No frames from stream, waiting for reconnection...")
+        return latest
+
+    # Motion boxes (x, y, w, h) of a frame in full-frame pixels. A frame the
+    # motion pool fails on (timeout, or a worker that died and is being
+    # restarted) counts as no motion; after MAX_MOTION_FAILURES in a row the
+    # error is raised.
+    def _motion_boxes(self, frame):
+        if self.motion_pool is not None and isinstance(frame, bytes):
+            try:
+                boxes = self.motion_pool.run(self.name, frame, timeout=5)
+            except Exception as e:
+                self.motion_errors += 1
+                self._motion_failures += 1
+                self.log(f"Motion detection failed ({self._motion_failures} in a row): {e}")
+                if self._motion_failures >= MAX_MOTION_FAILURES:
+                    raise
+                return []
+            self._motion_failures = 0
+            return boxes
+        small, scale = self.grabber.preview(frame, self.detector.width)
+        return self.detector.detect(small, scale) if small is not None else []
+
+    # Analyse the next frame as (seq, timestamp, frame, boxes), keeping the
+    # stats up to date; None while the stream is down. boxes is empty
+    # without movement.
+    def _analyse(self, seq):
+        latest = self._next_frame(seq)
+        if latest is None:
             return None
-        return cap
-
-    cap = open_stream(stream_url)
-    if not cap:
-        return
-
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    target_fps = 25.0  # Fixed frame rate for recording
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    ret, frame1 = cap.read()
-    ret, frame2 = cap.read()
-    if not ret:
-        print("Failed to read initial frames")
-        cap.release()
-        return
-
-    window_name = "Live Cam"
-    cv2.namedWindow(window_name)
-    print("Monitoring for movement... Press ESC to exit.")
-    
-    server_url = "http://localhost:5000/process_image"
-    api_key = os.getenv('api_key')
-
-    telegram_bot_token = os.getenv('telegram_bot_token')
-    telegram_chat_id = os.getenv('telegram_chat_id')
-    telegram_photo_url = f"https://api.telegram.org/bot{telegram_bot_token}/sendPhoto"
-    telegram_video_url = f"https://api.telegram.org/bot{telegram_bot_token}/sendVideo"
+        new_seq, timestamp, frame = latest
+        boxes = self._motion_boxes(frame)
+        now = time.time()
+        self.frames += 1
+        self.skipped += max(0, new_seq - seq - 1)
+        self.lag_s = now - float(timestamp)
+        if self._last_analysed is not None:
+            rate = 1.0 / max(now - self._last_analysed, 1e-6)
+            self.analysed_fps = 0.9 * self.analysed_fps + 0.1 * rate if self.analysed_fps else rate
+        self._last_analysed = now
+        return new_seq, timestamp, frame, boxes
 
-    try:
-        while True:
-            diff = cv2.absdiff(frame1, frame2)
-            gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-            blur = cv2.GaussianBlur(gray, (5,5), 0)
-            _, thresh = cv2.threshold(blur, 25, 255, cv2.THRESH_BINARY)
-            dilated = cv2.dilate(thresh, None, iterations=2)
-            contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-            movement = any(cv2.contourArea(contour) >= min_area for contour in contours)
-
-            if movement:
-                print("Movement detected! Capturing screenshot and recording for 10 seconds...")
-                time.sleep(3)
-                ret, frame = cap.read()
-                if ret:
-                    cv2.imwrite(screenshot_path, frame)
-                    print(f"Screenshot saved to {screenshot_path}")
-
-                    if os.path.exists(screenshot_path):
-                        face_result = "Face detection failed"
-                        try:
-                            with open(screenshot_path, 'rb') as img_file:
-                                headers = {'X-API-Key': api_key}
-                                response = requests.post(server_url, data=img_file, headers=headers)
-                            
-                            if response.status_code == 200:
-                                result = response.json()
-                                face_result = result['message']
-                                print(f"Face detection result: {face_result}")
-                            else:
-                                print(f"Server error: {response.status_code} - {response.text}")
-                        except requests.exceptions.RequestException as e:
-                            print(f"Failed to send image to server: {e}")
-                        except ValueError as e:
-                            print(f"Invalid server response: {e}")
-
-                        try:
-                            with open(screenshot_path, 'rb') as img_file:
-                                files = {'photo': img_file}
-                                data = {
-                                    'chat_id': telegram_chat_id,
-                                    'caption': f"Motion detected at {time.strftime('%Y-%m-%d %H:%M:%S')}\nFace detection: {face_result}"
-                                }
-                                response = requests.post(telegram_photo_url, files=files, data=data)
-                            
-                            if response.status_code == 200:
-                                print("Screenshot sent to Telegram bot successfully")
-                            else:
-                                print(f"Telegram API error (photo): {response.status_code} - {response.text}")
-                        except requests.exceptions.RequestException as e:
-                            print(f"Failed to send image to Telegram: {e}")
-                        except Exception as e:
-                            print(f"Error sending to Telegram (photo): {e}")
-                    else:
-                        print(f"Screenshot file not found: {screenshot_path}")
+    # Show a frame; True if ESC was pressed
+    def _display(self, frame, delay=1):
+        if not self.show:
+            return False
+        image = self.grabber.decode(frame)
+        if image is not None:
+            cv2.imshow(self.window_name, image)
+        return cv2.waitKey(delay) == 27
+
+    def _open(self):
+        grabber_class = MjpegGrabber if self.reader == 'mjpeg' else FrameGrabber
+        self.grabber = grabber_class(self.stream_url, preroll_s=self.preroll_s, slack_s=self.screenshot_delay + 10,
+                                     name=f"grabber-{self.name}" if self.name else 'grabber').start()
+        self.state = 'connecting'
+        waited = 0
+        while not self._stop.is_set():
+            if self.grabber.wait_ready(timeout=5):
+                return True
+            waited += 5
+            if self.open_timeout_s is not None and waited >= self.open_timeout_s:
+                self.log(f"Failed to open stream: {self.stream_url}")
+                return False
+        return False
+
+    # Queue a finished clip for Telegram
+    def _send_clip(self, done, motion_time, face_result):
+        try:
+            clip = done.result()
+        except Exception as e:
+            self.log(f"Recording error: {e}")
+            return
+        if clip is None:
+            self.log("Recording finished without frames")
+            return
+        trimmed = ", trimmed to fit" if clip['trimmed'] else ""
+        self.log(f"Recording finished. Wrote {clip['frames']} frames, {clip['size'][0]}x{clip['size'][1]}, "
+                 f"{clip['bytes'] / 2**20:.1f} MB{trimmed}")
+        self.notifier.send_clip(clip['path'], motion_time, face_result)
+
+    # Watch until stop() is called or ESC is pressed in the window
+    def run(self):
+        notifier = self.notifier = self.notifier or Notifier()
+        try:
+            if self._open():
+                self.recorder = SegmentRecorder(self.grabber, target_bytes=int(self.clip_target_mb * 2**20),
+                                                name=f"recorder-{self.name}" if self.name else 'recorder').start()
+                self._watch(notifier)
+        finally:
+            self.state = 'stopped'
+            if self.recorder is not None:
+                # Finish the clip in progress before the grabber goes away
+                self.recorder.stop()
+            if self.grabber is not None:
+                self.grabber.stop()
+            if self.show:
+                cv2.destroyWindow(self.window_name)
 
+    def _watch(self, notifier):
+        grabber = self.grabber
+        seq2 = grabber.latest()[0]
+
+        if self.show:
+            cv2.namedWindow(self.window_name)
+        self.log("Monitoring for movement... Press ESC to exit." if self.show else "Monitoring for movement...")
+
+        while not self._stop.is_set():
+            analysed = self._analyse(seq2)
+            if analysed is None:
+                continue
+            self.state = 'streaming'
+            seq2, motion_time, frame2, boxes = analysed
+
+            if boxes:
+                self.motion_events += 1
+                self.state = 'recording'
+                self.log(f"Movement detected! Recording for {self.record_time} seconds...")
+                # The recorder thread collects the clip from the frame buffer, pre-roll included
+                clip = self.recorder.record(self.output_path, motion_time, self.preroll_s, self.record_time)
+
+                # Give the subject time to come into view, analysing frames meanwhile
+                while not self._stop.is_set() and time.time() < motion_time + self.screenshot_delay:
+                    analysed = self._analyse(seq2)
+                    if analysed is None:
+                        continue
+                    seq2, _, frame2, boxes = analysed
+                    if self._display(frame2):
+                        return
+                # The screenshot is the last analysed frame, so its motion
+                # boxes tell the face server where to look
+                jpeg = grabber.encode_jpeg(frame2)
+                if jpeg is not None:
+                    regions = sorted(boxes, key=lambda box: box[2] * box[3], reverse=True)[:MAX_HINT_REGIONS]
+                    # Upload the bytes directly; the file is only a local copy
+                    face_result = notifier.send_screenshot(jpeg, motion_time, regions=regions)
+                    with open(self.screenshot_path, 'wb') as img_file:
+                        img_file.write(jpeg)
+                    self.log(f"Screenshot saved to {self.screenshot_path}")
                 else:
-                    print("Failed to capture screenshot frame.")
-
-                print("Starting video recording...")
-                out = cv2.VideoWriter(output_path, fourcc, target_fps, (width, height))
-                total_frames = int(target_fps * record_time)
-                frame_interval = 1.0 / target_fps
-                frames_written = 0
-
-                try:
-                    start_time = time.time()
-                    for i in range(total_frames):
-                        ret, frame = cap.read()
-                        if not ret:
-                            print(f"Frame {i+1}/{total_frames}: Stream lost, attempting to reconnect...")
-                            cap.release()
-                            cap = open_stream(stream_url)
-                            if not cap:
-                                print("Reconnection failed, aborting recording")
-                                break
-                            ret, frame = cap.read()
-                            if not ret:
-                                print("Failed to read frame after reconnection")
-                                break
-
-                        out.write(frame)
-                        frames_written += 1
-                        if frames_written % 50 == 0:
-                            print(f"Recorded {frames_written}/{total_frames} frames")
-
-                        elapsed = time.time() - start_time
-                        expected_time = (i + 1) * frame_interval
-                        if elapsed < expected_time:
-                            time.sleep(expected_time - elapsed)
-
-                        if cv2.waitKey(1) == 27:
-                            print("ESC pressed, stopping recording")
-                            break
-                except Exception as e:
-                    print(f"Recording error: {e}")
-                finally:
-                    out.release()
-                    print(f"Recording finished. Wrote {frames_written} frames")
-
-                    # Send video to Telegram
-                    if os.path.exists(output_path):
-                        video_size = os.path.getsize(output_path) / (1024 * 1024)  # Size in MB
-                        if video_size <= 50:
-                            try:
-                                with open(output_path, 'rb') as video_file:
-                                    files = {'video': video_file}
-                                    data = {
-                                        'chat_id': telegram_chat_id,
-                                        'caption': f"Motion detected at {time.strftime('%Y-%m-%d %H:%M:%S')}\nFace detection: {face_result}"
-                                    }
-                                    print("Sending video to Telegram...")
-                                    response = requests.post(telegram_video_url, files=files, data=data)
-                                
-                                if response.status_code == 200:
-                                    print("Video sent to Telegram bot successfully")
-                                else:
-                                    print(f"Telegram API error (video): {response.status_code} - {response.text}")
-                            except requests.exceptions.RequestException as e:
-                                print(f"Failed to send video to Telegram: {e}")
-                            except Exception as e:
-                                print(f"Error sending to Telegram (video): {e}")
-                        else:
-                            print(f"Video too large ({video_size:.2f} MB). Telegram limit is 50 MB. Reduce resolution or record_time.")
-                    else:
-                        print(f"Video file not found: {output_path}")
-
-                print("Waiting for new movement...")
-
-                while movement:
-                    ret, frame1 = cap.read()
-                    if not ret:
-                        print("Stream lost in movement skip, reconnecting...")
-                        cap.release()
-                        cap = open_stream(stream_url)
-                        if not cap:
-                            print("Reconnection failed, exiting")
-                            return
-                        ret, frame1 = cap.read()
-                        if not ret:
-                            print("Failed to read frame after reconnection")
-                            return
-                    ret, frame2 = cap.read()
-                    if not ret:
-                        print("Stream lost in movement skip, reconnecting...")
-                        cap.release()
-                        cap = open_stream(stream_url)
-                        if not cap:
-                            print("Reconnection failed, exiting")
-                            return
-                        ret, frame2 = cap.read()
-                        if not ret:
-                            print("Failed to read frame after reconnection")
-                            return
-
-                    diff = cv2.absdiff(frame1, frame2)
-                    gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-                    blur = cv2.GaussianBlur(gray, (5,5), 0)
-                    _, thresh = cv2.threshold(blur, 25, 255, cv2.THRESH_BINARY)
-                    dilated = cv2.dilate(thresh, None, iterations=2)
-                    contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-                    movement = any(cv2.contourArea(contour) >= min_area for contour in contours)
-                    cv2.imshow(window_name, frame1)
-                    if cv2.waitKey(1) == 27:
-                        cap.release()
-                        cv2.destroyAllWindows()
+                    face_result = None
+                    self.log("Failed to capture screenshot frame.")
+
+                # Motion during a clip extends it; send each clip once
+                if clip is not self._clip:
+                    self._clip = clip
+                    clip.add_done_callback(lambda done, motion_time=motion_time, face_result=face_result:
+                                           self._send_clip(done, motion_time, face_result))
+
+                self.log("Waiting for new movement...")
+
+                while boxes and not self._stop.is_set():
+                    analysed = self._analyse(seq2)
+                    if analysed is None:
+                        continue
+                    seq2, _, frame2, boxes = analysed
+                    if self._display(frame2):
                         return
+                self.state = 'streaming'
             else:
-                frame1 = frame2
-                ret, frame2 = cap.read()
-                if not ret:
-                    print("Stream lost, attempting to reconnect...")
-                    cap.release()
-                    cap = open_stream(stream_url)
-                    if not cap:
-                        print("Reconnection failed, exiting")
-                        return
-                    ret, frame2 = cap.read()
-                    if not ret:
-                        print("Failed to read frame after reconnection")
-                        return
-                cv2.imshow(window_name, frame1)
-                if cv2.waitKey(10) == 27:
+                if self._display(frame2, delay=10):
                     break
+
+# Watch a single camera in the foreground; see CameraWatcher for the options.
+# camera_supervisor.py runs many cameras in one process.
+def save_on_movement(stream_url, output_path, screenshot_path, record_time=10, min_area=1500, preroll_s=3, screenshot_delay=3,
+                     regions=None, exclude=None, motion_method='average', notifier=None, reader='mjpeg', show=True, clip_target_mb=45):
+    notifier = notifier or Notifier()
+    watcher = CameraWatcher(stream_url, output_path, screenshot_path, record_time=record_time, min_area=min_area,
+                            preroll_s=preroll_s, screenshot_delay=screenshot_delay, regions=regions, exclude=exclude,
+                            motion_method=motion_method, notifier=notifier, reader=reader, show=show,
+                            clip_target_mb=clip_target_mb)
+    try:
+        watcher.run()
     finally:
-        cap.release()
-        cv2.destroyAllWindows()
-        print("Stopped.")
+        # Let queued alerts go out before exiting
+        notifier.uploads.close(timeout=30)
+        print(f"Stopped. Uploads: {notifier.stats()}")
 
 if __name__ == "__main__":
     stream_url = "http://192.168.137.166/mjpeg/1"
     output_path = "esp32_stream.avi"
     screenshot_path = "esp32_stream_screenshot.jpg"
-    save_on_movement(stream_url, output_path, screenshot_path)
\ No newline at end of file
+    save_on_movement(stream_url, output_path, screenshot_path)
@@ -0,0 +1,183 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class UploadFailed(Exception):
+    pass
+
+def _discard(job):
+    discard = getattr(job, 'discard', None)
+    if discard is not None:
+        try:
+            discard()
+        except Exception as e:
+            logger.error(f"Discarding upload job failed: {str(e)}")
+
+
+# Handed to each job: a pooled session plus request() with retries
+class UploadContext:
+    def __init__(self, uploads, session):
+        self.uploads = uploads
+        self.session = session
+
+    # session.request with retries on connection errors, timeouts and
+    # RETRY_STATUSES, backing off exponentially with jitter (or for the
+    # server's Retry-After). `name` labels the latency histogram. Returns the
+    # final response; raises UploadFailed when every attempt failed to connect.
+    def request(self, name, method, url, **kwargs):
+        uploads = self.uploads
+        kwargs.setdefault('timeout', uploads.timeout_s)
+        for attempt in range(uploads.retries + 1):
+            start = time.monotonic()
+            retry_after = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                uploads._observe(name, time.monotonic() - start)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                uploads._observe(name, time.monotonic() - start)
+                response, error = None, str(e)
+            if attempt == uploads.retries or uploads.closed:
+                break
+            delay = uploads.backoff(attempt, retry_after)
+            logger.warning(f"{name}: attempt {attempt + 1} failed ({error}), retrying in {delay:.1f}s")
+            uploads._count('retries')
+            time.sleep(delay)
+        if response is not None:
+            return response
+        raise UploadFailed(f"{name}: giving up after {uploads.retries + 1} attempts: {error}")
+
+
+# Bounded queue of outbound I/O jobs drained by a few worker threads, each with
+# its own keep-alive connection pool, so alerts and inference calls never block
+# the capture loop. A job is a callable taking an UploadContext. A job with the
+# same `key` as one still waiting replaces it (coalescing); when the queue is
+# full the oldest waiting job is dropped. Replaced and dropped jobs have their
+# discard() method called, if they define one.
+class UploadQueue:
+    def __init__(self, workers=2, max_queue=32, retries=3, backoff_s=0.5, max_backoff_s=30.0, timeout_s=30.0, name='uploads'):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.timeout_s = timeout_s
+        self.name = name
+        self.closed = False
+        # Set by close(): new jobs are refused while queued ones drain
+        self.draining = False
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._active = 0
+        self._threads = []
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0, 'coalesced': 0, 'retries': 0}
+        self._latency = {}
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    # Exponential backoff with +-50% jitter, or the server's Retry-After in seconds
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff_s)
+            except ValueError:
+                pass
+        delay = min(self.max_backoff_s, self.backoff_s * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+    # Queue a job; returns False if it replaced or evicted another one
+    def submit(self, job, key=None):
+        with self._cond:
+            if self.closed or self.draining:
+                _discard(job)
+                return False
+            self._counters['submitted'] += 1
+            accepted = True
+            if key is not None:
+                for i, (pending_key, pending) in enumerate(self._jobs):
+                    if pending_key == key:
+                        self._jobs[i] = (key, job)
+                        self._counters['coalesced'] += 1
+                        _discard(pending)
+                        return False
+            if len(self._jobs) >= self.max_queue:
+                dropped_key, dropped = self._jobs.popleft()
+                self._counters['dropped'] += 1
+                logger.warning(f"{self.name}: queue full, dropped oldest job {dropped_key or ''}")
+                _discard(dropped)
+                accepted = False
+            self._jobs.append((key, job))
+            self._cond.notify()
+            return accepted
+
+    # Stop accepting work; wait up to timeout for queued jobs to finish
+    def close(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.draining = True
+            self._cond.wait_for(lambda: not self._jobs and not self._active,
+                                timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            self.closed = True
+            self._cond.notify_all()
+
+    def _run(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        context = UploadContext(self, session)
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs or self.closed)
+                if not self._jobs:
+                    return
+                key, job = self._jobs.popleft()
+                self._active += 1
+            try:
+                job(context)
+                self._count('completed')
+            except Exception as e:
+                logger.error(f"{self.name}: job {key or ''} failed: {str(e)}")
+                self._count('failed')
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def _count(self, counter):
+        with self._cond:
+            self._counters[counter] += 1
+
+    def _observe(self, name, seconds):
+        with self._cond:
+            histogram = self._latency.get(name)
+            if histogram is None:
+                histogram = self._latency[name] = Histogram()
+            histogram.observe(seconds)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._counters,
+                depth=len(self._jobs),
+                active=self._active,
+                latency={name: histogram.snapshot() for name, histogram in self._latency.items()},
+            )
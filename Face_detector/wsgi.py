@@ -0,0 +1,9 @@
+# Gunicorn entry point:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# With preload_app the startup phase below runs once in the master before the
+# workers are forked, so they start ready and share the loaded models.
+from app import app, startup
+
+__all__ = ['app']
+
+startup()